@@ -0,0 +1,139 @@
+"""Synthetic fixtures for the SPIREpy benchmarks.
+
+The fixtures mimic the shape of the SPIRE tables and archives, so that the
+benchmarks exercise the same code paths as real downloads without any network
+access. :func:`recorded` redirects the remote URLs used by SPIREpy to local
+files.
+"""
+
+import gzip
+import io
+import json
+import os
+import os.path as path
+import tarfile
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import numpy as np
+import polars as pl
+
+
+def sample_ids(n_samples: int) -> list:
+    return [f"SAMEA{i:08d}" for i in range(n_samples)]
+
+
+def genome_table(n_genomes: int, n_samples: int, seed: int = 0) -> pl.DataFrame:
+    """Synthetic genome metadata, with the columns used by SPIREpy."""
+    rng = np.random.default_rng(seed)
+    samples = np.array(sample_ids(n_samples))
+    return pl.DataFrame(
+        {
+            "spire_id": [f"spire_mag_{i:08d}" for i in range(n_genomes)],
+            "derived_from_sample": samples[rng.integers(0, n_samples, n_genomes)],
+            "spire_cluster": rng.integers(0, n_genomes // 10 + 1, n_genomes),
+            "completeness": rng.uniform(50, 100, n_genomes).round(2),
+            "contamination": rng.uniform(0, 10, n_genomes).round(2),
+            "genome_size": rng.integers(500_000, 8_000_000, n_genomes),
+        }
+    )
+
+
+def write_metadata_cache(cache_dir: str, n_genomes: int, n_samples: int):
+    """Populate a SPIREpy cache directory with synthetic genome metadata."""
+    from spirepy.data import RELEASE
+
+    release_dir = path.join(cache_dir, RELEASE)
+    os.makedirs(release_dir, exist_ok=True)
+    genome_table(n_genomes, n_samples).write_parquet(
+        path.join(release_dir, "genome_metadata.parquet")
+    )
+    now = time.time()
+    with open(path.join(release_dir, "genome_metadata.json"), "w") as f:
+        json.dump({"fetched": now, "checked": now}, f)
+
+
+def write_study_table(fpath: str, study: str, n_samples: int):
+    pl.DataFrame(
+        {"study_id": [study] * n_samples, "sample_id": sample_ids(n_samples)}
+    ).write_csv(fpath, separator="\t")
+
+
+def write_eggnog(fpath: str, n_rows: int, seed: int = 0):
+    """Synthetic eggNOG-mapper output, with the usual header and footer."""
+    rng = np.random.default_rng(seed)
+    table = pl.DataFrame(
+        {
+            "#query": [f"gene_{i}" for i in range(n_rows)],
+            "seed_ortholog": [f"1234.ORTH{i % 9973}" for i in range(n_rows)],
+            "evalue": rng.uniform(0, 1e-5, n_rows),
+            "score": rng.uniform(50, 1000, n_rows).round(1),
+            "eggNOG_OGs": ["COG0001@1|root,COG0001@2|Bacteria"] * n_rows,
+            "COG_category": rng.choice(list("CEGJKLMS"), n_rows),
+            "Description": ["hypothetical protein"] * n_rows,
+            "KEGG_ko": [f"ko:K{i % 25000:05d}" for i in range(n_rows)],
+        }
+    )
+    body = io.StringIO()
+    table.write_csv(body, separator="\t")
+    with gzip.open(fpath, "wt") as f:
+        f.write("## emapper-2.1.0\n## time\n## command\n##\n")
+        f.write(body.getvalue())
+        f.write("## 3 queries scanned\n## Total time\n## Rate\n")
+
+
+def write_mags_tar(fpath: str, n_mags: int, mag_size: int, seed: int = 0):
+    """Uncompressed tarball of gzipped FASTA files, as in the SPIRE downloads."""
+    rng = np.random.default_rng(seed)
+    with tarfile.open(fpath, "w") as tar:
+        for i in range(n_mags):
+            seq = rng.choice(np.frombuffer(b"ACGT", dtype=np.uint8), mag_size)
+            data = gzip.compress(b">contig_1\n" + seq.tobytes() + b"\n", 1)
+            info = tarfile.TarInfo(f"spire_mag_{i:08d}.fa.gz")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+class _Response(io.BytesIO):
+    """A response to a request served from a local file."""
+
+    def __init__(self, content: bytes, status: int, headers: dict):
+        super().__init__(content)
+        self.status = status
+        self.headers = headers
+
+
+@contextmanager
+def recorded(urls: dict):
+    """Serve the given URLs from local files.
+
+    Requests go through :mod:`spirepy.scheduler` as usual, and
+    :func:`urllib.request.urlopen` answers them from the files, including
+    ``Range`` requests. Other URLs fail, so that no benchmark reaches the
+    network.
+
+    :param urls: Dictionary mapping remote URLs to local file paths.
+    :type urls: dict
+    """
+
+    def urlopen(request, *args, **kwargs):
+        if isinstance(request, urllib.request.Request):
+            url, byte_range = request.full_url, request.get_header("Range")
+        else:
+            url, byte_range = request, None
+        if url not in urls:
+            raise urllib.error.URLError(f"{url} is not recorded")
+        with open(urls[url], "rb") as f:
+            content = f.read()
+        status = 200
+        if byte_range is not None:
+            start, end = byte_range.removeprefix("bytes=").split("-")
+            content = content[int(start) : int(end) + 1]
+            status = 206
+        return _Response(content, status, {"Content-Length": str(len(content))})
+
+    with patch("urllib.request.urlopen", urlopen):
+        yield
@@ -0,0 +1,172 @@
+"""Run the SPIREpy benchmarks and compare them against a stored baseline.
+
+Usage::
+
+    python benchmarks/run.py                     # run and compare to baseline.json
+    python benchmarks/run.py --save baseline.json
+    python benchmarks/run.py -k mags --scale 0.1
+
+Each benchmark runs in its own process, so that the peak resident set size
+(RSS) reported is that of the benchmark alone. The reported time is the
+fastest of ``--repeat`` runs.
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os.path as path
+import queue
+import sys
+import tempfile
+import time
+
+from rich.console import Console
+from rich.table import Table
+
+sys.path.insert(0, path.dirname(path.abspath(__file__)))
+
+import fixtures  # noqa: E402
+import suite  # noqa: E402
+
+
+def _peak_rss() -> int:
+    """Peak RSS of this process and its children, in bytes."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    scale = 1 if sys.platform == "darwin" else 1024
+    return scale * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+def _setup(name: str, workdir: str, scale: float, queue):
+    setup, _ = suite.BENCHMARKS[name]
+    queue.put(setup(workdir, scale))
+
+
+def _child(name: str, workdir: str, params: dict, repeat: int, queue):
+    from unittest.mock import patch
+
+    _, run = suite.BENCHMARKS[name]
+    times = []
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(
+            patch("spirepy.data.cache_dir", path.join(workdir, "cache"))
+        )
+        stack.enter_context(patch("spirepy.data.check_interval", float("inf")))
+        stack.enter_context(fixtures.recorded(params.get("urls", {})))
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(params)
+            times.append(time.perf_counter() - start)
+    queue.put({"time": min(times), "peak_rss": _peak_rss()})
+
+
+def _in_process(target, *args, timeout: float = None):
+    # Both the setup and the benchmark run in fresh processes, as the peak RSS
+    # of a process is inherited by the processes it starts
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=target, args=args + (results,))
+    process.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                # A crashed or stuck child fails the run instead of hanging it
+                if not process.is_alive():
+                    raise RuntimeError(
+                        f"{target.__name__} exited with code {process.exitcode}"
+                    )
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"{target.__name__} took over {timeout}s")
+    finally:
+        if process.is_alive():
+            process.join(5)
+            process.terminate()
+        process.join()
+
+
+def run_benchmark(name: str, scale: float, repeat: int, timeout: float = None) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        params = _in_process(_setup, name, workdir, scale, timeout=timeout)
+        return _in_process(_child, name, workdir, params, repeat, timeout=timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the SPIREpy benchmarks")
+    parser.add_argument("-k", dest="pattern", help="only run benchmarks matching")
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="fixture size multiplier"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark")
+    parser.add_argument(
+        "--baseline",
+        default=path.join(path.dirname(path.abspath(__file__)), "baseline.json"),
+        help="baseline results to compare against",
+    )
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600,
+        help="seconds after which a benchmark is stopped and the run fails",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.5,
+        help="time or memory ratio over the baseline counted as a regression",
+    )
+    args = parser.parse_args()
+
+    baseline = {}
+    if path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("scale", 1.0) != args.scale:
+            baseline = {}
+    baseline = baseline.get("results", {})
+
+    table = Table("benchmark", "time (s)", "peak RSS (MiB)", "vs baseline")
+    results = {}
+    regressions = []
+    for name in suite.BENCHMARKS:
+        if args.pattern and args.pattern not in name:
+            continue
+        result = run_benchmark(name, args.scale, args.repeat, args.timeout)
+        results[name] = result
+        rss = result["peak_rss"]
+        comparison = ""
+        if name in baseline:
+            ratios = [result["time"] / baseline[name]["time"]]
+            if rss and baseline[name]["peak_rss"]:
+                ratios.append(rss / baseline[name]["peak_rss"])
+            comparison = " / ".join(f"{r:.2f}x" for r in ratios)
+            if max(ratios) > args.threshold:
+                regressions.append(name)
+                comparison = f"[red]{comparison}[/red]"
+        table.add_row(
+            name,
+            f"{result['time']:.3f}",
+            f"{rss / 2**20:.0f}" if rss else "-",
+            comparison,
+        )
+
+    Console().print(table)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"scale": args.scale, "results": results}, f, indent=2)
+    if regressions:
+        Console().print(f"[red]Regressions:[/red] {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
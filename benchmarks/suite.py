@@ -0,0 +1,103 @@
+"""Benchmarks of the SPIREpy hot paths.
+
+Each benchmark is a pair of functions: a setup, run once in the parent process
+to write the fixtures to a work directory, and the benchmark itself, run in a
+fresh process with the SPIREpy cache pointed to that directory and the remote
+URLs served from the fixtures (see :func:`fixtures.recorded`).
+"""
+
+import os.path as path
+import subprocess
+import sys
+
+import fixtures
+
+#: Registered benchmarks, mapping names to (setup, run) pairs.
+BENCHMARKS = {}
+
+STUDY = "Bench_2024_Study"
+
+
+def benchmark(setup):
+    def decorator(run):
+        BENCHMARKS[run.__name__] = (setup, run)
+        return run
+
+    return decorator
+
+
+def _metadata_cache(workdir: str, scale: float) -> dict:
+    fixtures.write_metadata_cache(
+        path.join(workdir, "cache"), int(2_000_000 * scale), int(20_000 * scale)
+    )
+    return {}
+
+
+def _study_cache(workdir: str, scale: float) -> dict:
+    _metadata_cache(workdir, scale)
+    fpath = path.join(workdir, "study.tsv")
+    fixtures.write_study_table(fpath, STUDY, int(2_000 * scale))
+    return {
+        "urls": {f"https://spire.embl.de/spire/api/study/{STUDY}?format=tsv": fpath}
+    }
+
+
+def _eggnog(workdir: str, scale: float) -> dict:
+    fpath = path.join(workdir, "eggnog.tsv.gz")
+    fixtures.write_eggnog(fpath, int(50_000 * scale))
+    sample_id = fixtures.sample_ids(1)[0]
+    return {"urls": {f"https://spire.embl.de/download_eggnog/{sample_id}": fpath}}
+
+
+def _mags_tar(workdir: str, scale: float) -> dict:
+    fpath = path.join(workdir, "mags.tar")
+    fixtures.write_mags_tar(fpath, int(200 * scale), 500_000)
+    url = f"https://swifter.embl.de/~fullam/spire/compiled/{STUDY}_spire_v1_MAGs.tar"
+    return {"urls": {url: fpath}, "output": path.join(workdir, "out")}
+
+
+def _nothing(workdir: str, scale: float) -> dict:
+    return {}
+
+
+@benchmark(_metadata_cache)
+def cache_load(params: dict):
+    from spirepy.data import genome_metadata
+
+    genome_metadata()
+
+
+@benchmark(_metadata_cache)
+def sample_get_mags(params: dict):
+    from spirepy import Sample
+
+    Sample(fixtures.sample_ids(1)[0]).get_mags()
+
+
+@benchmark(_study_cache)
+def study_get_mags(params: dict):
+    from spirepy import Study
+
+    Study(STUDY).get_mags()
+
+
+@benchmark(_eggnog)
+def eggnog_parse(params: dict):
+    from spirepy import Sample
+
+    Sample(fixtures.sample_ids(1)[0]).get_eggnog_data()
+
+
+@benchmark(_mags_tar)
+def tar_extract(params: dict):
+    from spirepy import Study
+
+    Study(STUDY).download_mags(params["output"])
+
+
+@benchmark(_nothing)
+def cli_startup(params: dict):
+    subprocess.run(
+        [sys.executable, "-c", "from spirepy.cli import main"],
+        check=True,
+    )
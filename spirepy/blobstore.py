@@ -0,0 +1,366 @@
+import hashlib
+import os
+import os.path as path
+import shutil
+import sqlite3
+import stat
+import sys
+import tarfile
+import tempfile
+
+from spirepy import data
+from spirepy.lock import FileLock
+from spirepy.logger import logger
+
+#: Whether downloads go through the blob store (see :func:`default_store`).
+enabled = os.environ.get("SPIREPY_DEDUP", "") not in ("", "0")
+
+_schema = """
+CREATE TABLE IF NOT EXISTS sources (
+    url TEXT NOT NULL,
+    member TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (url, member)
+);
+CREATE TABLE IF NOT EXISTS links (
+    path TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reflinks (
+    path TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+"""
+
+# ioctl request to clone a file on Linux filesystems with copy-on-write
+# (btrfs, XFS), see ioctl_ficlone(2)
+_FICLONE = 0x40049409
+
+
+def _digest(fpath: str) -> str:
+    digest = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _reflink(src: str, dst: str):
+    if not sys.platform.startswith("linux"):
+        raise OSError("reflinks are only supported on Linux")
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.unlink(dst)
+            raise
+
+
+def _member_path(name: str) -> str:
+    # Refuse archive members that would be written outside the output folder
+    name = path.normpath(name)
+    if path.isabs(name) or name.split(os.sep)[0] == "..":
+        raise ValueError(f"Unsafe path in archive: {name}")
+    return name
+
+
+class BlobStore:
+    """
+    A content-addressed store of downloaded files, shared by all output folders.
+
+    Each file is stored once under its SHA-256 digest, and the output folders
+    get a link to it: a reflink where the filesystem supports them, otherwise a
+    hardlink, a symlink, or a copy as a last resort. The store remembers which
+    digests each URL resolved to, so that downloading the same data to another
+    folder makes no request at all.
+
+    Stored files are read-only, since hardlinks share them with the output
+    folders. Adding and linking files, and removing them with :meth:`gc`,
+    are done under a lock on the store, so that files are not removed
+    between being added and linked.
+
+    :param root: Folder of the store, defaults to ``blobs`` in the cache directory.
+    :type root: str, optional
+    """
+
+    def __init__(self, root: str = None):
+        """Constructor method."""
+        self.root = root or path.join(data.cache_dir, "blobs")
+        self._connection = None
+
+    def __str__(self):
+        return f"Blob store: {self.root}"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._connection = sqlite3.connect(
+                path.join(self.root, "index.sqlite"), timeout=60
+            )
+            self._connection.executescript(_schema)
+        return self._connection
+
+    def _lock(self) -> FileLock:
+        return FileLock(path.join(self.root, "store.lock"))
+
+    def _tmpdir(self) -> str:
+        # Temporary files live in the store so that they can be moved in place
+        tmpdir = path.join(self.root, "tmp")
+        os.makedirs(tmpdir, exist_ok=True)
+        return tmpdir
+
+    def blob_path(self, digest: str) -> str:
+        """Get the path of a stored file.
+
+        :param digest: SHA-256 digest of the file.
+        :type digest: str
+
+        :return: Path of the file in the store.
+        :rtype: str
+        """
+        return path.join(self.root, digest[:2], digest)
+
+    def add(self, fpath: str) -> str:
+        """Move a file into the store.
+
+        If the store already has a file with the same content, ``fpath`` is
+        removed instead.
+
+        :param fpath: Path of the file, which must be on the same filesystem as the store.
+        :type fpath: str
+
+        :return: SHA-256 digest of the file.
+        :rtype: str
+        """
+        digest = _digest(fpath)
+        blob = self.blob_path(digest)
+        if path.exists(blob):
+            os.unlink(fpath)
+        else:
+            os.makedirs(path.dirname(blob), exist_ok=True)
+            os.chmod(fpath, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(fpath, blob)
+        return digest
+
+    def link(self, digest: str, dest: str) -> str:
+        """Link a stored file to an output path, replacing any existing file.
+
+        :param digest: SHA-256 digest of the file.
+        :type digest: str
+
+        :param dest: Output path.
+        :type dest: str
+
+        :return: Kind of link made: ``reflink``, ``hardlink``, ``symlink`` or ``copy``.
+        :rtype: str
+        """
+        blob = self.blob_path(digest)
+        os.makedirs(path.dirname(path.abspath(dest)), exist_ok=True)
+        if path.lexists(dest):
+            os.unlink(dest)
+        for kind, fn in [
+            ("reflink", _reflink),
+            ("hardlink", os.link),
+            ("symlink", os.symlink),
+        ]:
+            try:
+                fn(blob, dest)
+                break
+            except OSError:
+                continue
+        else:
+            kind = "copy"
+            shutil.copyfile(blob, dest)
+        dest = path.abspath(dest)
+        with self._connect() as connection:
+            connection.execute("DELETE FROM links WHERE path = ?", (dest,))
+            connection.execute("DELETE FROM reflinks WHERE path = ?", (dest,))
+            if kind in ("hardlink", "symlink"):
+                connection.execute(
+                    "INSERT INTO links (path, digest) VALUES (?, ?)", (dest, digest)
+                )
+            elif kind == "reflink":
+                # Reflinks share the blocks of the stored file, so keeping it
+                # costs no space while the output is unchanged
+                connection.execute(
+                    "INSERT INTO reflinks (path, digest, mtime_ns) VALUES (?, ?, ?)",
+                    (dest, digest, os.stat(dest).st_mtime_ns),
+                )
+        return kind
+
+    def _lookup(self, url: str) -> dict:
+        rows = (
+            self._connect()
+            .execute("SELECT member, digest FROM sources WHERE url = ?", (url,))
+            .fetchall()
+        )
+        return dict(rows)
+
+    def _record(self, url: str, members: dict):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM sources WHERE url = ?", (url,))
+            connection.executemany(
+                "INSERT INTO sources (url, member, digest) VALUES (?, ?, ?)",
+                [(url, member, digest) for member, digest in members.items()],
+            )
+
+    def _available(self, members: dict) -> bool:
+        return bool(members) and all(
+            path.exists(self.blob_path(digest)) for digest in members.values()
+        )
+
+    def fetch(self, url: str, dest: str, download) -> str:
+        """Make a remote file available at ``dest``, downloading it only if it is not stored yet.
+
+        :param url: URL of the file.
+        :type url: str
+
+        :param dest: Output path.
+        :type dest: str
+
+        :param download: Function called with the URL and a path to download the file to.
+        :type download: callable
+
+        :return: SHA-256 digest of the file.
+        :rtype: str
+        """
+        with self._lock():
+            members = self._lookup(url)
+            if self._available(members):
+                self.link(members[""], dest)
+                return members[""]
+        # Downloaded without holding the lock, so that other downloads proceed
+        fd, tmp = tempfile.mkstemp(dir=self._tmpdir(), suffix=".tmp")
+        os.close(fd)
+        try:
+            download(url, tmp)
+            with self._lock():
+                members = {"": self.add(tmp)}
+                self._record(url, members)
+                self.link(members[""], dest)
+        finally:
+            if path.exists(tmp):
+                os.unlink(tmp)
+        return members[""]
+
+    def fetch_tar(self, url: str, output: str, download) -> dict:
+        """Make the files of a remote tar archive available in ``output``, downloading it only if they are not stored yet.
+
+        :param url: URL of the archive.
+        :type url: str
+
+        :param output: Folder to extract the archive to.
+        :type output: str
+
+        :param download: Function called with the URL and a path to download the archive to.
+        :type download: callable
+
+        :return: Dictionary mapping the path of each file in the archive to its SHA-256 digest.
+        :rtype: dict
+        """
+        with self._lock():
+            members = self._lookup(url)
+            if self._available(members):
+                self._link_members(members, output)
+                return members
+        members = {}
+        with tempfile.TemporaryDirectory(dir=self._tmpdir()) as tmpdir:
+            tarfpath = path.join(tmpdir, "archive.tar")
+            download(url, tarfpath)
+            with tarfile.open(tarfpath) as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    name = _member_path(member.name)
+                    fpath = path.join(tmpdir, f"{len(members)}.member")
+                    with tar.extractfile(member) as src, open(fpath, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    members[name] = fpath
+            with self._lock():
+                members = {name: self.add(fpath) for name, fpath in members.items()}
+                self._record(url, members)
+                self._link_members(members, output)
+        return members
+
+    def _link_members(self, members: dict, output: str):
+        for member, digest in members.items():
+            self.link(digest, path.join(output, member))
+
+    def gc(self) -> tuple:
+        """Remove the stored files that are no longer linked from any output folder.
+
+        A link is dropped once its path was deleted or replaced by another
+        file, and a reflink once its path was deleted or modified. Files only
+        ever copied are removed as well, since the output folders do not
+        depend on them.
+
+        :return: Number of files removed and bytes freed.
+        :rtype: tuple
+        """
+        with self._lock():
+            return self._gc()
+
+    def _gc(self) -> tuple:
+        connection = self._connect()
+        stale = [
+            (fpath,)
+            for fpath, digest in connection.execute("SELECT path, digest FROM links")
+            if not (
+                path.exists(fpath)
+                and path.exists(self.blob_path(digest))
+                and path.samefile(fpath, self.blob_path(digest))
+            )
+        ]
+        stale_reflinks = [
+            (fpath,)
+            for fpath, mtime_ns in connection.execute(
+                "SELECT path, mtime_ns FROM reflinks"
+            )
+            if not (path.exists(fpath) and os.stat(fpath).st_mtime_ns == mtime_ns)
+        ]
+        with connection:
+            connection.executemany("DELETE FROM links WHERE path = ?", stale)
+            connection.executemany(
+                "DELETE FROM reflinks WHERE path = ?", stale_reflinks
+            )
+        linked = {
+            digest
+            for (digest,) in connection.execute(
+                "SELECT digest FROM links UNION SELECT digest FROM reflinks"
+            )
+        }
+        removed, freed = 0, 0
+        for folder in os.listdir(self.root):
+            if len(folder) != 2 or not path.isdir(path.join(self.root, folder)):
+                continue
+            for digest in os.listdir(path.join(self.root, folder)):
+                if digest in linked:
+                    continue
+                blob = self.blob_path(digest)
+                freed += path.getsize(blob)
+                os.unlink(blob)
+                removed += 1
+        with connection:
+            connection.execute(
+                "DELETE FROM sources WHERE url IN"
+                " (SELECT url FROM sources WHERE digest NOT IN"
+                " (SELECT digest FROM links UNION SELECT digest FROM reflinks))"
+            )
+        logger.info(f"Removed {removed} unreferenced files ({freed} bytes) from {self}")
+        return removed, freed
+
+
+def default_store() -> BlobStore:
+    """Get the blob store used for downloads.
+
+    :return: The store in the cache directory if :data:`enabled` is set (with ``spire --dedup`` or the ``SPIREPY_DEDUP`` environment variable), otherwise :class:`None`.
+    :rtype: :class:`BlobStore`
+    """
+    return BlobStore() if enabled else None
@@ -1,3 +1,5 @@
 from spirepy.cli.download import download
 from spirepy.cli.view import view
+from spirepy.cli.query import query
+from spirepy.cli.similar import similar, sketch
 from spirepy.cli.spire import main
@@ -2,12 +2,94 @@ import os
 import os.path as path
 from typing import Union
 
+import polars as pl
+
+from spirepy.journal import Journal
 from spirepy.sample import Sample
+from spirepy.shard import shard_name, write_manifest
 from spirepy.study import Study
 from spirepy.logger import logger
 
+_table_getters = {
+    "eggnog": "get_eggnog_data",
+    "amr": "get_amr_annotations",
+    "contig_depths": "get_contig_depths",
+}
+
+#: Download targets of a study that can be split into shards.
+SHARDED_TARGETS = ("mags", *_table_getters)
+
 
-def download(item: Union[Study, Sample], target: str, output: str):
+def download_shard(study: Study, target: str, output: str, shard: tuple):
+    """
+    Download the data of one shard of a study's samples.
+
+    MAGs are downloaded per sample into ``mags/``. Per-sample tables are
+    written, with an added ``sample_id`` column, to a single Parquet file per
+    shard in a folder named after the target, from per-sample parts kept in
+    ``parts/``. Each shard also writes a manifest of its files to
+    ``manifest/``. Use ``spire merge`` to combine the
+    outputs of all shards.
+
+    Downloads are recorded in the job journal (see
+    :class:`spirepy.journal.Journal`), so running the same download again
+    only retries what is missing or failed.
+
+    :param study: The study.
+    :type study: :class:`spirepy.study.Study`
+
+    :param target: What you want to download (mags, eggnog, amr, contig_depths).
+    :type target: str
+
+    :param output: The output folder shared by all shards.
+    :type output: str
+
+    :param shard: The index of the shard and the number of shards.
+    :type shard: tuple
+    """
+    index, count = shard
+    samples = study.shard_samples(index, count)
+    journal = Journal()
+    entries = []
+    if target == "mags":
+        folder = path.join(output, "mags")
+        for sample in samples:
+            sample.download_mags(folder, journal)
+            for mag in sample.get_mags(columns=["spire_id"])["spire_id"].to_list():
+                fpath = path.join(folder, f"{mag}.fa.gz")
+                if path.exists(fpath):
+                    entries.append((sample.id, fpath, path.getsize(fpath)))
+            sample.clear_cache()
+    elif target in _table_getters:
+        getter = _table_getters[target]
+        by_id = {sample.id: sample for sample in samples}
+
+        def write_part(sample_id: str, fpath: str):
+            sample = by_id[sample_id]
+            frame = getattr(sample, getter)()
+            frame.with_columns(sample_id=pl.lit(sample_id)).write_parquet(fpath)
+            sample.clear_cache()
+
+        # Each sample is written separately first, so that an interrupted
+        # download can be resumed. The parts are kept out of the target's
+        # folder, which is read as a dataset once merged
+        parts = path.join(output, "parts", target)
+        os.makedirs(parts, exist_ok=True)
+        units = {s: path.join(parts, f"{s}.parquet") for s in by_id}
+        failed = journal.execute(target, units, write_part)
+        frames = [pl.read_parquet(f) for s, f in units.items() if s not in failed]
+        if frames:
+            os.makedirs(path.join(output, target), exist_ok=True)
+            fpath = path.join(output, target, f"{shard_name(index, count)}.parquet")
+            pl.concat(frames, how="diagonal_relaxed").write_parquet(fpath)
+            entries.append((target, fpath, path.getsize(fpath)))
+    else:
+        logger.error("No matching item for sharded download")
+        return
+    write_manifest(output, index, count, entries)
+
+
+def download(item: Union[Study, Sample], target: str, output: str, shard: tuple = None):
     """
     Dowload data from a SPIRE item.
 
@@ -19,10 +101,15 @@ def download(item: Union[Study, Sample], target: str, output: str):
 
     :param output: The output folder where the items will be downloaded.
     :type output: str
+
+    :param shard: For studies, download only one shard of the samples, given as the index of the shard and the number of shards (see :func:`download_shard`).
+    :type shard: tuple, optional
     """
     os.makedirs(output, exist_ok=True)
     if type(item) is Study:
-        if target == "metadata":
+        if target in _table_getters or (shard is not None and target == "mags"):
+            download_shard(item, target, output, shard or (0, 1))
+        elif target == "metadata":
             item.get_metadata().write_csv(path.join(output, f"{item.name}.csv"))
         elif target == "mags":
             item.download_mags(output)
@@ -32,6 +119,7 @@ def download(item: Union[Study, Sample], target: str, output: str):
         if target == "metadata":
             item.get_metadata().write_csv(path.join(output, f"{item.id}.csv"))
         elif target == "mags":
-            item.download_mags(output)
+            # Recorded in the journal, so that running it again resumes it
+            item.download_mags(output, Journal())
         else:
             logger.error("No matching item")
@@ -0,0 +1,44 @@
+from spirepy.query import Query
+
+
+def query(
+    table: str,
+    where: list,
+    columns: str = None,
+    limit: int = None,
+    output: str = None,
+    sample_where: list = None,
+):
+    """
+    Query the SPIRE metadata tables.
+
+    :param table: The table to query (genomes, clusters, samples).
+    :type table: str
+
+    :param where: SQL predicates that the rows must match (e.g. "completeness > 90").
+    :type where: list
+
+    :param columns: Comma-separated list of columns to show; defaults to all columns.
+    :type columns: str, optional
+
+    :param limit: Maximum number of rows to show; defaults to all rows.
+    :type limit: int, optional
+
+    :param output: Path of a CSV file to write the results to instead of printing them.
+    :type output: str, optional
+
+    :param sample_where: SQL predicates on the sample metadata that the MAGs' samples must match (genomes table only).
+    :type sample_where: list, optional
+    """
+    q = Query(table).filter(*(where or []))
+    if sample_where:
+        q = q.from_samples(Query("samples").filter(*sample_where))
+    if columns:
+        q = q.select(*columns.split(","))
+    if limit is not None:
+        q = q.limit(limit)
+    result = q.collect()
+    if output:
+        result.write_csv(output)
+    else:
+        print(result)
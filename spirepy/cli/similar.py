@@ -0,0 +1,36 @@
+import polars as pl
+
+from spirepy.fasta import _fasta_files
+from spirepy.query import Query
+from spirepy.sketch import SketchIndex, sketch_files
+
+
+def sketch(folder: str, max_workers: int = None):
+    """
+    Sketch the genomes in a folder of FASTA files and add them to the sketch index.
+
+    :param folder: Folder with one FASTA file per genome (e.g. downloaded MAGs).
+    :type folder: str
+
+    :param max_workers: Number of processes; defaults to the number of CPUs.
+    :type max_workers: int, optional
+    """
+    sketches = sketch_files(_fasta_files(folder), max_workers)
+    SketchIndex().add(sketches)
+    print(f"Added {len(sketches)} genomes to the sketch index")
+
+
+def similar(spire_id: str, k: int = 10):
+    """
+    Show the genomes most similar to a SPIRE genome.
+
+    :param spire_id: SPIRE ID of the genome.
+    :type spire_id: str
+
+    :param k: Number of genomes to show.
+    :type k: int, optional
+    """
+    genomes = Query("genomes").filter(pl.col("spire_id") == spire_id).to_genomes()
+    if not genomes:
+        raise ValueError(f"Unknown genome: {spire_id}")
+    print(genomes[0].similar(k))
@@ -1,16 +1,71 @@
 import re
 import argparse
+import atexit
+import contextlib
 
+from rich.console import Console
+from rich.table import Table
+
+from spirepy import blobstore, metrics, scheduler
 from spirepy.study import Study
+from spirepy.journal import Journal
 from spirepy.sample import Sample
-from spirepy.cli import download, view
+from spirepy.shard import merge, parse_shard
+from spirepy.cli import download, query, similar, sketch, view
+from spirepy.cli.download import SHARDED_TARGETS
 
 
-def maincall(input, action: str, target: str, output: str = None):
+def maincall(
+    input,
+    action: str,
+    target: str,
+    output: str = None,
+    shard: tuple = None,
+    **options,
+):
     if action == "view":
-        view(input, target)
+        view(input, target, **options)
     else:
-        download(input, target, output)
+        download(input, target, output, shard)
+
+
+def _view_options(args) -> dict:
+    return {
+        "columns": args.columns,
+        "where": args.where,
+        "limit": args.limit,
+        "output_format": args.output_format,
+    }
+
+
+def _argument_type(parse):
+    # Report the parser's error message for invalid values
+    def convert(spec: str):
+        try:
+            return parse(spec)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+
+    return convert
+
+
+def print_profile(recorder: metrics.Recorder):
+    """Print a summary of the recorded instrumentation events to stderr."""
+    table = Table("event", "count", "time (s)", "bytes", "rows", "cache hits/misses")
+    for kind, entry in recorder.summary().items():
+        table.add_row(
+            kind,
+            str(entry["count"]),
+            f"{entry['seconds']:.3f}",
+            str(entry["bytes"]),
+            str(entry["rows"]),
+            (
+                f"{entry.get('hits', 0)}/{entry.get('misses', 0)}"
+                if kind == "cache"
+                else ""
+            ),
+        )
+    Console(stderr=True).print(table)
 
 
 def main():
@@ -49,15 +104,81 @@ D777–D783, https://doi.org/10.1093/nar/gkad943
         action="store_true",
         help="The item you want to interact with is a study",
     )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        help="print a summary of remote requests, parsing and cache use at exit",
+    )
+    parser.add_argument(
+        "--shard",
+        dest="shard",
+        type=_argument_type(parse_shard),
+        metavar="i/N",
+        help="only download the i-th of N deterministic shards of a study's samples (0 <= i < N)",
+    )
+    parser.add_argument(
+        "--dedup",
+        dest="dedup",
+        action="store_true",
+        help="store downloaded files once in the cache and link them into the output folder",
+    )
+    parser.add_argument(
+        "--limit-rate",
+        dest="limit_rate",
+        type=_argument_type(scheduler.parse_rate),
+        metavar="RATE",
+        help="cap the bandwidth shared by all downloads, in bytes per second (e.g. 500k, 10M)",
+    )
+    parser.add_argument(
+        "--max-connections",
+        dest="max_connections",
+        type=_argument_type(scheduler.parse_connections),
+        metavar="N",
+        help="largest number of concurrent connections to each host (default: 4)",
+    )
+    parser.add_argument(
+        "--progress",
+        dest="progress",
+        action="store_true",
+        help="show the downloads and their throughput on stderr",
+    )
     subparsers = parser.add_subparsers(help="subcommand help", dest="action")
     # create the parser for the "view" command
     parser_view = subparsers.add_parser("view", help="view the data from an object")
     parser_view.add_argument(
         dest="target",
-        choices=["metadata", "amr", "manifest", "eggnog", "mags"],
+        choices=["metadata", "amr", "manifest", "eggnog", "mags", "summary"],
         action="store",
         help="target item to view",
     )
+    parser_view.add_argument(
+        "-c",
+        "--columns",
+        dest="columns",
+        help="comma-separated list of columns to show",
+    )
+    parser_view.add_argument(
+        "-w",
+        "--filter",
+        dest="where",
+        action="append",
+        help='SQL predicate the rows must match (e.g. "completeness > 90"); can be repeated',
+    )
+    parser_view.add_argument(
+        "-n",
+        "--limit",
+        dest="limit",
+        type=int,
+        help="maximum number of rows to show",
+    )
+    parser_view.add_argument(
+        "-f",
+        "--output-format",
+        dest="output_format",
+        choices=["tsv", "ndjson", "table"],
+        help="output format; defaults to a table in a pager on a terminal, TSV otherwise",
+    )
     parser_view.add_argument(
         "input", metavar="INPUT", nargs="+", help="Input (study or sample ID)", type=str
     )
@@ -67,7 +188,15 @@ D777–D783, https://doi.org/10.1093/nar/gkad943
     )
     parser_download.add_argument(
         dest="target",
-        choices=["mags", "proteins", "genecalls", "metadata"],
+        choices=[
+            "mags",
+            "proteins",
+            "genecalls",
+            "metadata",
+            "eggnog",
+            "amr",
+            "contig_depths",
+        ],
         action="store",
         help="target item to dowload",
     )
@@ -82,20 +211,160 @@ D777–D783, https://doi.org/10.1093/nar/gkad943
         "input", metavar="INPUT", nargs="+", help="Input (study or sample ID)", type=str
     )
 
+    # create the parser for the "query" command
+    parser_query = subparsers.add_parser(
+        "query", help="query the metadata tables across all studies"
+    )
+    parser_query.add_argument(
+        dest="target",
+        choices=["genomes", "clusters", "samples"],
+        action="store",
+        help="table to query",
+    )
+    parser_query.add_argument(
+        "-w",
+        "--where",
+        dest="where",
+        action="append",
+        help='SQL predicate the rows must match (e.g. "completeness > 90"); can be repeated',
+    )
+    parser_query.add_argument(
+        "-c",
+        "--columns",
+        dest="columns",
+        help="comma-separated list of columns to show",
+    )
+    parser_query.add_argument(
+        "-n",
+        "--limit",
+        dest="limit",
+        type=int,
+        help="maximum number of rows to show",
+    )
+    parser_query.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        help="CSV file to write the results to instead of printing them",
+    )
+    parser_query.add_argument(
+        "-s",
+        "--sample-where",
+        dest="sample_where",
+        action="append",
+        help="SQL predicate on the sample metadata that the genomes' samples must match; can be repeated",
+    )
+
+    # create the parser for the "merge" command
+    parser_merge = subparsers.add_parser(
+        "merge", help="combine the outputs of sharded downloads"
+    )
+    parser_merge.add_argument(
+        "output", metavar="OUTPUT", help="output folder shared by the shards"
+    )
+
+    # create the parser for the "jobs" command
+    parser_jobs = subparsers.add_parser("jobs", help="inspect the batch job journal")
+    parser_jobs.add_argument(
+        dest="target",
+        choices=["status"],
+        action="store",
+        help="report the progress of batch downloads across runs",
+    )
+
+    # create the parser for the "sketch" command
+    parser_sketch = subparsers.add_parser(
+        "sketch", help="sketch downloaded genomes for similarity search"
+    )
+    parser_sketch.add_argument(
+        "folder", metavar="FOLDER", help="folder with one FASTA file per genome"
+    )
+    parser_sketch.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        help="number of processes; defaults to the number of CPUs",
+    )
+
+    # create the parser for the "similar" command
+    parser_similar = subparsers.add_parser(
+        "similar", help="find the sketched genomes most similar to a genome"
+    )
+    parser_similar.add_argument(
+        "spire_id", metavar="GENOME", help="SPIRE ID of the genome"
+    )
+    parser_similar.add_argument(
+        "-k",
+        dest="k",
+        type=int,
+        default=10,
+        help="number of genomes to show; defaults to 10",
+    )
+
+    # create the parser for the "gc" command
+    subparsers.add_parser(
+        "gc", help="remove stored files no longer linked from any output folder"
+    )
+
     args = parser.parse_args()
 
-    if args.is_sample:
-        input = Sample(id=args.input[0])
-        if args.action == "view":
-            maincall(input, args.action, args.target)
-        else:
-            maincall(input, args.action, args.target, args.output)
-    else:
-        input = Study(name=args.input[0])
-        if args.action == "view":
-            maincall(input, args.action, args.target)
+    if args.shard and (
+        args.action != "download"
+        or args.is_sample
+        or args.target not in SHARDED_TARGETS
+    ):
+        parser.error(
+            f"--shard only applies to downloading the {', '.join(SHARDED_TARGETS)} of a study"
+        )
+
+    if args.profile:
+        recorder = metrics.subscribe(metrics.Recorder())
+        atexit.register(print_profile, recorder)
+    if args.dedup:
+        blobstore.enabled = True
+    if args.limit_rate:
+        scheduler.bandwidth_limit = args.limit_rate
+    if args.max_connections:
+        scheduler.max_per_host = args.max_connections
+    progress = (
+        scheduler.default_scheduler().progress()
+        if args.progress
+        else contextlib.nullcontext()
+    )
+    with progress:
+        if args.action == "query":
+            query(
+                args.target,
+                args.where,
+                args.columns,
+                args.limit,
+                args.output,
+                args.sample_where,
+            )
+        elif args.action == "merge":
+            merge(args.output)
+        elif args.action == "jobs":
+            print(Journal().status())
+        elif args.action == "sketch":
+            sketch(args.folder, args.jobs)
+        elif args.action == "similar":
+            similar(args.spire_id, args.k)
+        elif args.action == "gc":
+            removed, freed = blobstore.BlobStore().gc()
+            print(f"Removed {removed} files, freeing {freed} bytes")
+        elif args.is_sample:
+            input = Sample(id=args.input[0])
+            if args.action == "view":
+                maincall(input, args.action, args.target, **_view_options(args))
+            else:
+                maincall(input, args.action, args.target, args.output)
         else:
-            maincall(input, args.action, args.target, args.output)
+            input = Study(name=args.input[0])
+            if args.action == "view":
+                maincall(input, args.action, args.target, **_view_options(args))
+            else:
+                maincall(input, args.action, args.target, args.output, args.shard)
 
 
 if __name__ == "__main__":
@@ -1,40 +1,147 @@
+import errno
+import os
+import sys
 from typing import Union
 
+import polars as pl
+from rich.console import Console
+from rich.table import Table
+
+from spirepy.data import scan_genome_metadata
 from spirepy.sample import Sample
 from spirepy.study import Study
 from spirepy.logger import logger
 
+#: Number of rows rendered at a time in the pager.
+PAGE_ROWS = 1000
+
+
+def _scan(item: Union[Study, Sample], target: str) -> Union[pl.LazyFrame, None]:
+    if target == "mags":
+        # Scan the cached genome metadata, so that the options are pushed down
+        # to the Parquet reader instead of loading the whole table
+        if isinstance(item, Study):
+            samples = item.get_metadata()["sample_id"].to_list()
+        else:
+            samples = [item.id]
+        return scan_genome_metadata().filter(
+            pl.col("derived_from_sample").is_in(samples)
+        )
+    if isinstance(item, Study):
+        getters = {"metadata": item.get_metadata, "summary": item.summary}
+    else:
+        getters = {
+            "metadata": item.get_metadata,
+            "eggnog": item.get_eggnog_data,
+            "amr": item.get_amr_annotations,
+        }
+    getter = getters.get(target)
+    if getter is None:
+        return None
+    frame = getter()
+    return frame.lazy() if frame is not None else pl.LazyFrame()
+
+
+def _as_text(expr: pl.Expr, dtype: pl.DataType) -> pl.Expr:
+    if isinstance(dtype, pl.Struct):
+        return pl.concat_str(
+            [_as_text(expr.struct.field(f.name), f.dtype) for f in dtype.fields],
+            separator=":",
+        )
+    if isinstance(dtype, (pl.List, pl.Array)):
+        expr = expr.cast(pl.List(dtype.inner))
+        return expr.list.eval(_as_text(pl.element(), dtype.inner)).list.join(";")
+    return expr.cast(pl.String)
+
+
+def _flatten(frame: pl.LazyFrame) -> pl.LazyFrame:
+    # Nested columns, which TSV cannot hold, are written as text: fields are
+    # separated by ":" and list items by ";" (e.g. the phyla of a study
+    # summary become "p__Bacillota:12;p__Bacteroidota:3")
+    schema = frame.collect_schema()
+    return frame.with_columns(
+        _as_text(pl.col(name), dtype).alias(name)
+        for name, dtype in schema.items()
+        if dtype.is_nested()
+    )
+
+
+def _is_broken_pipe(e: OSError) -> bool:
+    # The Polars sinks raise a plain OSError, with the message of the Rust error
+    return e.errno == errno.EPIPE or "Broken pipe" in str(e)
+
+
+def _page(frame: pl.LazyFrame):
+    console = Console()
+    with console.pager():
+        for batch in frame.collect_batches(chunk_size=PAGE_ROWS):
+            table = Table(*batch.columns)
+            for row in batch.iter_rows():
+                table.add_row(*("" if v is None else str(v) for v in row))
+            console.print(table)
 
-def view(item: Union[Study, Sample], target: str):
+
+def view(
+    item: Union[Study, Sample],
+    target: str,
+    columns: str = None,
+    where: list = None,
+    limit: int = None,
+    output_format: str = None,
+):
     """
     View a SPIRE item.
 
+    The options are applied to a lazy scan of the data, and the rows are
+    written out in batches as they are read.
+
     :param item: The item to be viewed (:class:`spirepy.sample.Sample` or :class:`spirepy.study.Study`).
     :type item: :class:`spirepy.sample.Sample` or :class:`spirepy.study.Study`
 
     :param target: What you want to view (metadata, antibiotic resistance annotations, manifest)
     :type target: str
-    """
 
-    if isinstance(item, Study):
-        study_match = {
-            "metadata": item.get_metadata,
-            "mags": item.get_mags,
-        }.get(target)
+    :param columns: Comma-separated list of columns to show; defaults to all columns.
+    :type columns: str, optional
 
-        if study_match:
-            print(study_match())
-        else:
-            logger.error("No matching item for Study type")
-    else: 
-        sample_match = {
-            "metadata": item.get_metadata,
-            "mags": item.get_mags,
-            "eggnog": item.get_eggnog_data,
-            "amr": item.get_amr_annotations,
-        }.get(target)
+    :param where: SQL predicates that the rows must match (e.g. "completeness > 90").
+    :type where: list, optional
 
-        if sample_match:
-            print(sample_match())
+    :param limit: Maximum number of rows to show; defaults to all rows.
+    :type limit: int, optional
+
+    :param output_format: One of ``tsv``, ``ndjson`` or ``table`` (in a pager); defaults to ``table`` on a terminal and ``tsv`` otherwise. In TSV and tables, nested columns are shown as text, with ``:`` between fields and ``;`` between list items.
+    :type output_format: str, optional
+    """
+    frame = _scan(item, target)
+    if frame is None:
+        if isinstance(item, Study):
+            logger.error("No matching item for Study type")
         else:
             logger.error("No matching item")
+        return
+
+    for predicate in where or []:
+        frame = frame.filter(pl.sql_expr(predicate))
+    if columns:
+        frame = frame.select(columns.split(","))
+    if limit is not None:
+        frame = frame.head(limit)
+
+    if output_format is None:
+        output_format = "table" if sys.stdout.isatty() else "tsv"
+    try:
+        if output_format == "tsv":
+            _flatten(frame).sink_csv(sys.stdout, separator="\t")
+        elif output_format == "ndjson":
+            frame.sink_ndjson(sys.stdout)
+        elif output_format == "table":
+            _page(_flatten(frame))
+        else:
+            raise ValueError(f"Unknown output format: {output_format}")
+        sys.stdout.flush()
+    except OSError as e:
+        if not _is_broken_pipe(e):
+            raise
+        # The reader stopped early (e.g. piped to head), so discard the rest
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
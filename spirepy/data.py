@@ -1,36 +1,682 @@
+import functools
+import glob
+import json
+import os
+import os.path as path
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from email.utils import parsedate_to_datetime
+from typing import Union
+
 import polars as pl
-from joblib import Memory
+import pyarrow as pa
 from platformdirs import user_cache_dir
 
+from spirepy import metrics, scheduler
+from spirepy.lock import FileLock
+from spirepy.logger import logger
+
 cache_dir = user_cache_dir("spirepy", "spirepy-dev")
-memory = Memory(cache_dir, verbose=0)
 
+#: The SPIRE release used when none is given.
+RELEASE = "spire_v1"
+
+#: Minimum number of seconds between two checks for updates of a cached table.
+check_interval = float(os.environ.get("SPIREPY_CHECK_INTERVAL", 7 * 24 * 60 * 60))
+
+_sample_index = None
+
+
+def _publish(fpath: str, write):
+    # Write to a temporary file first, so that readers never see a partial file
+    os.makedirs(path.dirname(fpath), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.dirname(fpath), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, fpath)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _write_parquet(frame: pl.DataFrame, fpath: str):
+    _publish(fpath, frame.write_parquet)
+
+
+def _write_ipc(frame: pl.DataFrame, fpath: str):
+    _publish(fpath, lambda tmp: frame.write_ipc(tmp, compression="uncompressed"))
+
+
+def _remote_validators(
+    url: str, etag: str = None, last_modified: str = None
+) -> Union[dict, None]:
+    """Issue a conditional HEAD request for ``url``.
+
+    :return: :class:`None` if the server reports the resource as not modified,
+        otherwise its current ``etag`` and ``last_modified`` validators.
+    """
+    request = urllib.request.Request(url, method="HEAD")
+    if etag:
+        request.add_header("If-None-Match", etag)
+    if last_modified:
+        request.add_header("If-Modified-Since", last_modified)
+    with metrics.fetch(url, method="HEAD") as event:
+        try:
+            with scheduler.urlopen(request, scheduler.METADATA, timeout=30) as response:
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                event["status"] = 304
+                return None
+            raise
+    return {
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+    }
+
+
+def _download_tsv(url: str) -> pl.DataFrame:
+    """Download a TSV file, which may be gzipped, through the scheduler and parse it."""
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        with metrics.fetch(url) as event:
+            scheduler.retrieve(url, tmp, scheduler.METADATA)
+            if metrics.enabled():
+                event["bytes"] = path.getsize(tmp)
+        with metrics.timed("parse", source=url, rows=None) as parsed:
+            frame = pl.read_csv(tmp, separator="\t")
+            parsed["rows"] = frame.height
+        return frame
+    finally:
+        os.unlink(tmp)
+
+
+class CachedTable:
+    """A remote SPIRE table cached on disk as Parquet.
+
+    Entries are kept per SPIRE release (``<cache_dir>/<release>/<name>.parquet``),
+    so several releases can be cached side by side. Once every
+    :data:`check_interval` seconds, a conditional request checks the
+    ``ETag``/``Last-Modified`` validators of the remote file and the table is
+    downloaded again if it has changed.
+
+    Use :func:`cached_table` to create instances.
+    """
+
+    def __init__(self, fetch, url: str):
+        self.fetch = fetch
+        self.url = url
+        self.name = fetch.__name__
+        functools.update_wrapper(self, fetch)
+
+    def __call__(self, release: str = RELEASE) -> pl.DataFrame:
+        with metrics.timed("cache", name=self.name, release=release) as event:
+            event["hit"] = self._ensure(release)
+            frame = self._load(release)
+            event["rows"] = frame.height
+        return frame
+
+    def path(self, release: str = RELEASE) -> str:
+        """Path of the cached table, downloading it first if needed.
+
+        :param release: SPIRE release, defaults to :data:`RELEASE`.
+        :type release: str
+
+        :return: Path to the Parquet file.
+        :rtype: str
+        """
+        self._ensure(release)
+        return self._path(release)
+
+    def scan(self, release: str = RELEASE) -> pl.LazyFrame:
+        """Lazily scan the cached table.
+
+        Filters and column selections on the returned frame are pushed down to
+        the Parquet scan.
+
+        :param release: SPIRE release, defaults to :data:`RELEASE`.
+        :type release: str
+
+        :return: A LazyFrame over the table.
+        :rtype: :class:`polars.LazyFrame`
+        """
+        with metrics.timed("cache", name=self.name, release=release) as event:
+            event["hit"] = self._ensure(release)
+            return pl.scan_parquet(self._path(release))
+
+    def fetched(self, release: str = RELEASE) -> float:
+        """Time the cached table was downloaded, as a Unix timestamp.
+
+        :param release: SPIRE release, defaults to :data:`RELEASE`.
+        :type release: str
+
+        :return: The download time, or 0 if the table is not cached.
+        :rtype: float
+        """
+        return self._read_state(release).get("fetched", 0)
+
+    def refresh(self, release: str = RELEASE):
+        """Download the table again, regardless of the cached copy.
+
+        :param release: SPIRE release, defaults to :data:`RELEASE`.
+        :type release: str
+        """
+        url = self.url.format(release=release)
+        try:
+            validators = _remote_validators(url) or {}
+        except (urllib.error.URLError, OSError):
+            validators = {}
+        frame = self.fetch(url)
+        with metrics.timed("write", source=url, rows=frame.height):
+            _write_parquet(frame, self._path(release))
+            _write_ipc(frame, self._ipc_path(release))
+        now = time.time()
+        self._write_state(release, dict(validators, fetched=now, checked=now))
+
+    def clear(self, release: str = None):
+        """Remove the cached table.
+
+        :param release: SPIRE release to remove; defaults to all releases.
+        :type release: str, optional
+        """
+        if not path.isdir(cache_dir):
+            return
+        releases = [release] if release else os.listdir(cache_dir)
+        for r in releases:
+            for fpath in (self._path(r), self._ipc_path(r), self._state_path(r)):
+                if path.isfile(fpath):
+                    os.unlink(fpath)
+
+    def _ensure(self, release: str) -> bool:
+        """Download the table if it is missing or stale.
+
+        :return: Whether the cached copy could be used.
+        """
+        started = time.time()
+        if path.exists(self._path(release)) and not self._is_stale(release):
+            return True
+        # Only one process downloads the table, the others wait for it
+        with FileLock(self._path(release) + ".lock"):
+            state = self._read_state(release)
+            if path.exists(self._path(release)) and state.get("fetched", 0) >= started:
+                return True
+            self.refresh(release)
+        return False
+
+    def _load(self, release: str) -> pl.DataFrame:
+        # Full loads use an uncompressed Arrow IPC copy of the table, which is
+        # memory-mapped, so that processes share the pages of the table
+        fpath = self._ipc_path(release)
+        if not self._has_ipc(release):
+            # Only one process converts the table, the others wait for it
+            with FileLock(self._path(release) + ".lock"):
+                if not self._has_ipc(release):
+                    _write_ipc(pl.read_parquet(self._path(release)), fpath)
+        return pl.from_arrow(pa.ipc.open_file(pa.memory_map(fpath)).read_all())
 
-@memory.cache
-def cluster_metadata():
+    def _has_ipc(self, release: str) -> bool:
+        fpath = self._ipc_path(release)
+        return path.exists(fpath) and path.getmtime(fpath) >= path.getmtime(
+            self._path(release)
+        )
+
+    def _path(self, release: str) -> str:
+        return path.join(cache_dir, release, f"{self.name}.parquet")
+
+    def _ipc_path(self, release: str) -> str:
+        return path.join(cache_dir, release, f"{self.name}.arrow")
+
+    def _state_path(self, release: str) -> str:
+        return path.join(cache_dir, release, f"{self.name}.json")
+
+    def _read_state(self, release: str) -> dict:
+        try:
+            with open(self._state_path(release)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_state(self, release: str, state: dict):
+        fpath = self._state_path(release)
+        fd, tmp = tempfile.mkstemp(dir=path.dirname(fpath), suffix=".json.tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, fpath)
+
+    def _is_stale(self, release: str) -> bool:
+        state = self._read_state(release)
+        if time.time() - state.get("checked", 0) < check_interval:
+            return False
+        try:
+            validators = _remote_validators(
+                self.url.format(release=release),
+                state.get("etag"),
+                state.get("last_modified"),
+            )
+        except (urllib.error.URLError, OSError) as e:
+            logger.warning(
+                f"Could not check {self.name} for updates ({e}), using cached copy"
+            )
+            return False
+        stale = False
+        if validators is not None:
+            if state.get("etag") or state.get("last_modified"):
+                stale = (validators["etag"], validators["last_modified"]) != (
+                    state.get("etag"),
+                    state.get("last_modified"),
+                )
+            elif validators["last_modified"]:
+                # No validators were recorded when the table was fetched, so
+                # compare against the time of the download instead
+                modified = parsedate_to_datetime(validators["last_modified"])
+                stale = modified.timestamp() > state.get("fetched", 0)
+        if not stale:
+            # The new validators are only recorded by refresh(), once the
+            # table has been downloaded, so a failed download is retried
+            state["checked"] = time.time()
+            self._write_state(release, state)
+        return stale
+
+
+def cached_table(url: str):
+    """Decorator to cache a remote SPIRE table on disk.
+
+    The decorated function receives the URL of the table, with ``{release}``
+    replaced by the requested release, and must return a DataFrame. It emits
+    the ``fetch`` and ``parse`` events of the download (see
+    :func:`spirepy.metrics.subscribe`). See
+    :class:`CachedTable`.
+
+    :param url: URL template of the table.
+    :type url: str
+    """
+
+    def decorator(fetch):
+        return CachedTable(fetch, url)
+
+    return decorator
+
+
+@cached_table(
+    "https://swifter.embl.de/~fullam/spire/metadata/{release}_cluster_metadata.tsv.gz"
+)
+def cluster_metadata(url: str) -> pl.DataFrame:
     """Fetches and caches the SPIRE cluster metadata from the remote server.
 
     This is slow for the first time, as it downloads a large file, but
-    subsequent calls will use the cached version.
+    subsequent calls will use the cached version until a new version of the
+    file is published.
+
+    Call as ``cluster_metadata(release="spire_v1")``; the release defaults to
+    :data:`RELEASE`.
 
     :return: A DataFrame with the SPIRE cluster metadata.
     """
-    return pl.read_csv(
-        "https://swifter.embl.de/~fullam/spire/metadata/spire_v1_cluster_metadata.tsv.gz",
-        separator="\t",
-    )
+    return _download_tsv(url)
 
 
-@memory.cache
-def genome_metadata():
+@cached_table(
+    "https://swifter.embl.de/~fullam/spire/metadata/{release}_genome_metadata.tsv.gz"
+)
+def genome_metadata(url: str) -> pl.DataFrame:
     """Fetches and caches the SPIRE genome metadata from the remote server.
 
     This is slow for the first time, as it downloads a large file, but
-    subsequent calls will use the cached version.
+    subsequent calls will use the cached version until a new version of the
+    file is published.
+
+    Call as ``genome_metadata(release="spire_v1")``; the release defaults to
+    :data:`RELEASE`.
 
     :return: A DataFrame with the SPIRE genome metadata.
     """
-    return pl.read_csv(
-        "https://swifter.embl.de/~fullam/spire/metadata/spire_v1_genome_metadata.tsv.gz",
-        separator="\t",
+    return _download_tsv(url)
+
+
+def scan_cluster_metadata(release: str = RELEASE) -> pl.LazyFrame:
+    """Lazily scan the SPIRE cluster metadata.
+
+    The table is kept as Parquet in the cache directory, so that filters and
+    column selections on the returned frame are pushed down to the file scan.
+
+    :param release: SPIRE release, defaults to :data:`RELEASE`.
+    :type release: str
+
+    :return: A LazyFrame over the SPIRE cluster metadata.
+    :rtype: :class:`polars.LazyFrame`
+    """
+    return cluster_metadata.scan(release)
+
+
+def scan_genome_metadata(release: str = RELEASE) -> pl.LazyFrame:
+    """Lazily scan the SPIRE genome metadata.
+
+    The table is kept as Parquet in the cache directory, so that filters and
+    column selections on the returned frame are pushed down to the file scan.
+
+    :param release: SPIRE release, defaults to :data:`RELEASE`.
+    :type release: str
+
+    :return: A LazyFrame over the SPIRE genome metadata.
+    :rtype: :class:`polars.LazyFrame`
+    """
+    return genome_metadata.scan(release)
+
+
+def _study_metadata_dir() -> str:
+    return path.join(cache_dir, "study_metadata")
+
+
+def cache_study_metadata(study: str, frame: pl.DataFrame):
+    """Keep the metadata of a study's samples in the cache directory.
+
+    The cached tables are queried together with :func:`scan_sample_metadata`.
+
+    :param study: Name of the study.
+    :type study: str
+
+    :param frame: The study's metadata, with a row per sample.
+    :type frame: :class:`polars.DataFrame`
+    """
+    _write_parquet(frame, path.join(_study_metadata_dir(), f"{study}.parquet"))
+
+
+def scan_sample_metadata() -> pl.LazyFrame:
+    """Lazily scan the metadata of the samples of all cached studies.
+
+    The studies' tables are concatenated, with missing columns filled with
+    nulls, and joined to the sample index (see :func:`sample_index`), so
+    that indexed samples of studies whose metadata is not cached have a row
+    with only their ``sample_id`` and ``study``.
+
+    :return: A LazyFrame with a row per sample.
+    :rtype: :class:`polars.LazyFrame`
+    """
+    index = sample_index().lazy()
+    fpaths = sorted(glob.glob(path.join(_study_metadata_dir(), "*.parquet")))
+    if not fpaths:
+        return index
+    metadata = pl.concat(
+        [pl.scan_parquet(f) for f in fpaths], how="diagonal_relaxed"
+    ).filter(pl.col("sample_id").is_not_null())
+    # The study column of the metadata, if any, is superseded by the index's
+    metadata = metadata.drop("study", strict=False)
+    return index.join(metadata, on="sample_id", how="left", maintain_order="left")
+
+
+def _predicate(filter: Union[str, pl.Expr]) -> pl.Expr:
+    return pl.sql_expr(filter) if isinstance(filter, str) else filter
+
+
+def needed_columns(
+    columns: Union[list, None], filter: Union[str, pl.Expr, None]
+) -> Union[list, None]:
+    """Columns to read to select ``columns`` and evaluate ``filter``.
+
+    :param columns: Columns to select, or :class:`None` for all columns.
+    :type columns: list
+
+    :param filter: Polars expression or SQL expression the rows must match, or :class:`None`.
+    :type filter: str or :class:`polars.Expr`
+
+    :return: The columns to read, or :class:`None` for all columns.
+    :rtype: list
+    """
+    if columns is None:
+        return None
+    needed = list(columns)
+    if filter is not None:
+        needed += [c for c in _predicate(filter).meta.root_names() if c not in needed]
+    return needed
+
+
+def project(
+    frame: Union[pl.DataFrame, pl.LazyFrame],
+    columns: Union[list, None],
+    filter: Union[str, pl.Expr, None],
+) -> Union[pl.DataFrame, pl.LazyFrame]:
+    """Filter the rows of a table and select some of its columns.
+
+    :param frame: The table.
+    :type frame: :class:`polars.DataFrame` or :class:`polars.LazyFrame`
+
+    :param columns: Columns to select, or :class:`None` for all columns.
+    :type columns: list
+
+    :param filter: Polars expression or SQL expression the rows must match, or :class:`None`.
+    :type filter: str or :class:`polars.Expr`
+
+    :return: The filtered and projected table.
+    :rtype: :class:`polars.DataFrame` or :class:`polars.LazyFrame`
+    """
+    if filter is not None:
+        frame = frame.filter(_predicate(filter))
+    if columns is not None:
+        frame = frame.select(columns)
+    return frame
+
+
+def cached_projection(
+    cached: Union[pl.DataFrame, None],
+    complete: bool,
+    fetch,
+    columns: Union[list, None],
+    filter: Union[str, pl.Expr, None],
+) -> tuple:
+    """Project a table held in memory, fetching it first if needed.
+
+    The table is fetched again only if the cached copy lacks some of the
+    needed columns, reading the union of both, so that the cache stays a
+    superset of all the projections requested.
+
+    :param cached: The cached table, or :class:`None` if it was not fetched yet.
+    :type cached: :class:`polars.DataFrame`
+
+    :param complete: Whether the cached table has all the columns.
+    :type complete: bool
+
+    :param fetch: Function called with the columns to read (:class:`None` for all), which returns the table.
+    :type fetch: callable
+
+    :param columns: Columns to select, or :class:`None` for all columns.
+    :type columns: list
+
+    :param filter: Polars expression or SQL expression the rows must match, or :class:`None`.
+    :type filter: str or :class:`polars.Expr`
+
+    :return: The table to cache, whether it has all the columns, and the projected table.
+    :rtype: tuple
+    """
+    needed = needed_columns(columns, filter)
+    if cached is None or (
+        not complete and (needed is None or not set(needed) <= set(cached.columns))
+    ):
+        if needed is not None and cached is not None:
+            needed = list(dict.fromkeys(cached.columns + needed))
+        cached = fetch(needed)
+        complete = needed is None
+    return cached, complete, project(cached, columns, filter)
+
+
+#: Number of appended parts after which the sample index is merged into one file.
+SAMPLE_INDEX_PARTS = 32
+
+#: Columns that may hold the study of a sample, in order of preference.
+STUDY_COLUMNS = ("study", "study_id", "study_name")
+
+_index_schema = {"sample_id": pl.String, "study": pl.String}
+
+
+def _sample_index_dir() -> str:
+    return path.join(cache_dir, "sample_index")
+
+
+def _sample_index_parts() -> list:
+    # Part names sort in the order they were written
+    return sorted(glob.glob(path.join(_sample_index_dir(), "*.parquet")))
+
+
+def _read_sample_index() -> pl.DataFrame:
+    parts = _sample_index_parts()
+    if not parts:
+        return pl.DataFrame(schema=_index_schema)
+    return (
+        pl.scan_parquet(parts, include_file_paths="part")
+        # Later parts take precedence
+        .sort("part")
+        .unique("sample_id", keep="last")
+        .select("sample_id", "study")
+        .sort("sample_id")
+        .collect()
+    )
+
+
+def _new_part_path() -> str:
+    return path.join(
+        _sample_index_dir(), f"{time.time_ns():020d}-{uuid.uuid4().hex}.parquet"
+    )
+
+
+def study_column(columns: list) -> Union[str, None]:
+    """Find the column holding the study of each sample in a table.
+
+    :param columns: Names of the columns of the table.
+    :type columns: list
+
+    :return: The first of :data:`STUDY_COLUMNS` in the table, or :class:`None`.
+    :rtype: str
+    """
+    return next((c for c in STUDY_COLUMNS if c in columns), None)
+
+
+def sample_index() -> pl.DataFrame:
+    """Load the cached sample to study index.
+
+    The index is a two column table (``sample_id``, ``study``) sorted by
+    ``sample_id``, so that lookups can use a binary search. It is filled in
+    from the study metadata tables as they are downloaded (see
+    :func:`index_samples`), or in bulk with :func:`build_sample_index`.
+
+    :return: A DataFrame with the sample to study index.
+    :rtype: :class:`polars.DataFrame`
+    """
+    global _sample_index
+    if _sample_index is None:
+        # Parts are merged while the lock is held, so they are read under it
+        with FileLock(_sample_index_dir() + ".lock"):
+            _sample_index = _read_sample_index()
+    return _sample_index
+
+
+def _add_to_index(new: pl.DataFrame):
+    """Append pairs of ``sample_id`` and ``study`` to the sample index."""
+    global _sample_index
+    new = new.select(pl.col(name).cast(dtype) for name, dtype in _index_schema.items())
+    new = new.unique("sample_id", keep="last")
+    if new.join(sample_index(), on=["sample_id", "study"], how="anti").is_empty():
+        return
+    with FileLock(_sample_index_dir() + ".lock"):
+        # Only the new pairs are written, as a part of their own
+        _write_parquet(new, _new_part_path())
+        parts = _sample_index_parts()
+        # Reload the index, as other processes may have updated it
+        index = _read_sample_index()
+        if len(parts) > SAMPLE_INDEX_PARTS:
+            _write_parquet(index, _new_part_path())
+            for part in parts:
+                os.unlink(part)
+        _sample_index = index
+
+
+def index_samples(study: str, sample_ids: list):
+    """Record the samples belonging to a study in the sample index.
+
+    :param study: Name of the study.
+    :type study: str
+
+    :param sample_ids: IDs of the samples that belong to the study.
+    :type sample_ids: list
+    """
+    _add_to_index(
+        pl.DataFrame(
+            {"sample_id": sample_ids, "study": [study] * len(sample_ids)},
+            schema=_index_schema,
+        )
+    )
+
+
+def build_sample_index(studies: list = None, release: str = RELEASE):
+    """Add samples to the sample index in bulk.
+
+    This only needs to be done once, as the index is kept on disk.
+
+    :param studies: Names of studies whose metadata is fetched to index their
+        samples. By default, all the samples with MAGs are indexed in one pass
+        over the genome metadata, if it has a study column (see
+        :data:`STUDY_COLUMNS`).
+    :type studies: list, optional
+
+    :param release: SPIRE release of the genome metadata, defaults to :data:`RELEASE`.
+    :type release: str, optional
+    """
+    if studies is None:
+        genomes = scan_genome_metadata(release)
+        column = study_column(genomes.collect_schema().names())
+        if column is None:
+            raise ValueError(
+                "The genome metadata has no study column, give the studies to index"
+            )
+        _add_to_index(
+            genomes.select(sample_id="derived_from_sample", study=column)
+            .unique()
+            .collect()
+        )
+        return
+
+    from spirepy.study import Study
+
+    for name in studies:
+        # Study.get_metadata() updates the index as a side effect
+        Study(name).get_metadata()
+
+
+def lookup_study(sample_id: str) -> Union[str, None]:
+    """Find the study a sample belongs to using the sample index.
+
+    :param sample_id: ID of the sample.
+    :type sample_id: str
+
+    :return: The name of the study, or :class:`None` if the sample is not indexed.
+    :rtype: str
+    """
+    index = sample_index()
+    ix = index["sample_id"].search_sorted(sample_id)
+    if ix < index.height and index["sample_id"][ix] == sample_id:
+        return index["study"][ix]
+    return None
+
+
+def group_by_study(sample_ids: list) -> dict:
+    """Group sample IDs by the study they belong to.
+
+    Samples that are not in the index are grouped under :class:`None`.
+
+    :param sample_ids: IDs of the samples to group.
+    :type sample_ids: list
+
+    :return: A dictionary mapping study names to lists of sample IDs.
+    :rtype: dict
+    """
+    grouped = (
+        pl.DataFrame({"sample_id": sample_ids}, schema={"sample_id": pl.String})
+        .join(sample_index(), on="sample_id", how="left", maintain_order="left")
+        .group_by("study", maintain_order=True)
+        .agg("sample_id")
     )
+    return dict(zip(grouped["study"].to_list(), grouped["sample_id"].to_list()))
@@ -0,0 +1,190 @@
+import gzip
+import os
+import os.path as path
+
+import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from spirepy import data
+from spirepy.seqindex import is_fasta
+
+#: Number of sequences written to Parquet at a time.
+BATCH_SIZE = 10_000
+
+_schema = pa.schema(
+    [
+        ("id", pa.string()),
+        ("sample", pa.string()),
+        ("genome", pa.string()),
+        ("sequence", pa.large_string()),
+    ]
+)
+
+# Lookup tables from byte value to whether it is a G/C, or any nucleotide
+_GC = np.zeros(256, dtype=np.uint8)
+_GC[list(b"GCgc")] = 1
+_ACGT = np.zeros(256, dtype=np.uint8)
+_ACGT[list(b"ACGTacgt")] = 1
+
+
+def read_fasta(fpath: str):
+    """Read the records of a FASTA file, which may be gzipped.
+
+    :param fpath: Path of the file.
+    :type fpath: str
+
+    :return: Iterator over the ID and sequence of each record.
+    :rtype: iterator
+    """
+    opener = gzip.open if fpath.endswith(".gz") else open
+    with opener(fpath, "rb") as f:
+        for id, sequence in _records(f):
+            yield id, sequence.decode()
+
+
+def _records(f):
+    # Yield the ID and sequence (as bytes) of each record in a binary file
+    id, chunks = None, []
+    for line in f:
+        if line.startswith(b">"):
+            if id is not None:
+                yield id, b"".join(chunks)
+            id, chunks = line[1:].split(None, 1)[0].decode(), []
+        else:
+            chunks.append(line.rstrip())
+    if id is not None:
+        yield id, b"".join(chunks)
+
+
+def _fasta_files(folder: str) -> list:
+    files = []
+    for root, _, fnames in os.walk(folder):
+        files.extend(path.join(root, fname) for fname in fnames if is_fasta(fname))
+    return sorted(files)
+
+
+def to_parquet(folder: str, output: str, samples: dict = None) -> str:
+    """Convert a folder of FASTA files to a single Parquet file.
+
+    The files are read and written in batches of :data:`BATCH_SIZE`
+    sequences, so that they never need to fit in memory. The file has an
+    ``id``, ``sample``, ``genome`` and ``sequence`` column. The genome is the
+    file name without directories or extensions (the SPIRE ID of a MAG).
+
+    :param folder: Folder with the FASTA files (e.g. the ``mags`` folder of :meth:`spirepy.study.Study.download_mags`).
+    :type folder: str
+
+    :param output: Path of the Parquet file.
+    :type output: str
+
+    :param samples: Dictionary mapping each genome to its sample, defaults to :class:`None`.
+    :type samples: dict, optional
+
+    :return: The path of the Parquet file.
+    :rtype: str
+    """
+    samples = samples or {}
+
+    def write(tmp: str):
+        with pq.ParquetWriter(tmp, _schema) as writer:
+            batch = {name: [] for name in _schema.names}
+            for fpath in _fasta_files(folder):
+                genome = path.basename(fpath).split(".")[0]
+                for id, sequence in read_fasta(fpath):
+                    batch["id"].append(id)
+                    batch["sample"].append(samples.get(genome))
+                    batch["genome"].append(genome)
+                    batch["sequence"].append(sequence)
+                    if len(batch["id"]) >= BATCH_SIZE:
+                        writer.write_table(pa.table(batch, schema=_schema))
+                        batch = {name: [] for name in _schema.names}
+            if batch["id"]:
+                writer.write_table(pa.table(batch, schema=_schema))
+
+    data._publish(output, write)
+    return output
+
+
+def _base_counts(sequences: pa.Array) -> tuple:
+    # Look up the bytes of all the sequences at once, then sum them between
+    # the offsets of each sequence
+    sequences = sequences.cast(pa.large_string())
+    if isinstance(sequences, pa.ChunkedArray):
+        sequences = sequences.combine_chunks()
+    offsets = np.frombuffer(sequences.buffers()[1], dtype=np.int64)[
+        sequences.offset : sequences.offset + len(sequences) + 1
+    ]
+    content = sequences.buffers()[2]
+    content = (
+        np.frombuffer(content, dtype=np.uint8) if content else np.empty(0, np.uint8)
+    )[offsets[0] : offsets[-1]]
+    lengths = np.diff(offsets)
+    # reduceat() needs increasing starts within the content, so empty
+    # sequences are left at 0
+    nonempty = lengths > 0
+    starts = offsets[:-1][nonempty] - offsets[0]
+
+    def count(table: np.ndarray) -> np.ndarray:
+        counts = np.zeros(len(lengths), dtype=np.int64)
+        if len(starts):
+            counts[nonempty] = np.add.reduceat(table[content], starts, dtype=np.int64)
+        return counts
+
+    return lengths, count(_GC), count(_ACGT)
+
+
+def sequence_stats(fpath: str) -> pl.DataFrame:
+    """Compute the length and GC content of each sequence in a Parquet file from :func:`to_parquet`.
+
+    :param fpath: Path of the Parquet file.
+    :type fpath: str
+
+    :return: A DataFrame with the ``id``, ``sample`` and ``genome`` of each sequence, its ``length``, and number of ``gc`` and ``acgt`` bases.
+    :rtype: :class:`polars.DataFrame`
+    """
+    frames = []
+    for batch in pq.ParquetFile(fpath).iter_batches(batch_size=BATCH_SIZE):
+        length, gc, acgt = _base_counts(batch.column("sequence"))
+        frames.append(
+            pl.from_arrow(batch.select(["id", "sample", "genome"])).with_columns(
+                length=pl.Series(length), gc=pl.Series(gc), acgt=pl.Series(acgt)
+            )
+        )
+    if not frames:
+        return pl.DataFrame(
+            schema={
+                "id": pl.String,
+                "sample": pl.String,
+                "genome": pl.String,
+                "length": pl.Int64,
+                "gc": pl.Int64,
+                "acgt": pl.Int64,
+            }
+        )
+    return pl.concat(frames)
+
+
+def genome_stats(stats: pl.DataFrame) -> pl.DataFrame:
+    """Summarise the sequence statistics of each genome.
+
+    :param stats: Statistics of each sequence, from :func:`sequence_stats`.
+    :type stats: :class:`polars.DataFrame`
+
+    :return: A DataFrame with, for each ``genome``, its ``sample``, number of ``contigs``, total ``length``, ``gc`` content (fraction of the A, C, G and T bases) and ``n50``.
+    :rtype: :class:`polars.DataFrame`
+    """
+    length = pl.col("length")
+    return (
+        stats.sort("genome", "length", descending=[False, True])
+        .group_by("genome", maintain_order=True)
+        .agg(
+            sample=pl.col("sample").first(),
+            contigs=pl.len(),
+            length=length.sum(),
+            gc=pl.col("gc").sum() / pl.col("acgt").sum(),
+            # Length of the longest contigs making up half of the genome
+            n50=length.filter(length.cum_sum() >= length.sum() / 2).first(),
+        )
+    )
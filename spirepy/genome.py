@@ -1,4 +1,7 @@
+import polars as pl
+
 from spirepy.sample import Sample
+from spirepy.sketch import SketchIndex, sketch
 
 
 class Genome:
@@ -13,3 +16,29 @@ class Genome:
         self.id = id
         self.sample = sample
         self._abundance = None
+
+    def similar(self, k: int = 10, index: SketchIndex = None) -> pl.DataFrame:
+        """Find the most similar genomes in a sketch index.
+
+        If the genome is not in the index yet, its MAG is read from the
+        study's archive (see :meth:`spirepy.study.Study.open_mag`), sketched,
+        and added to the index.
+
+        :param k: Number of genomes to return, defaults to 10.
+        :type k: int, optional
+
+        :param index: Index to search, defaults to the index in the cache directory.
+        :type index: :class:`spirepy.sketch.SketchIndex`, optional
+
+        :return: A DataFrame with the most similar genomes (see :meth:`spirepy.sketch.SketchIndex.query`).
+        :rtype: :class:`polars.DataFrame`
+        """
+        index = index or SketchIndex()
+        hashes = index.get(self.id)
+        if hashes is None:
+            study = self.sample.study
+            if study is None:
+                raise ValueError(f"Unknown study of sample {self.sample.id}")
+            hashes = sketch(study.open_mag(self.id))
+            index.add({self.id: hashes})
+        return index.query(hashes, k, exclude=self.id)
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import os.path as path
+import sqlite3
+import time
+
+import polars as pl
+
+from spirepy import data
+from spirepy.logger import logger
+
+_schema = """
+CREATE TABLE IF NOT EXISTS units (
+    item TEXT NOT NULL,
+    target TEXT NOT NULL,
+    output TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER,
+    checksum TEXT,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (item, target, output)
+)
+"""
+
+
+def _checksum(fpath: str) -> str:
+    digest = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Journal:
+    """
+    A journal of batch download units, kept in SQLite.
+
+    A unit is an item (e.g. a sample or a MAG) and a target (e.g. ``eggnog``)
+    written to an output file. The journal records the status, number of
+    attempts, size, SHA-256 checksum and last error of each unit, so that an
+    interrupted batch can be run again and only does the missing work.
+
+    :param fpath: Path of the SQLite database, defaults to ``jobs.sqlite`` in the cache directory.
+    :type fpath: str, optional
+    """
+
+    def __init__(self, fpath: str = None):
+        """Constructor method."""
+        self.fpath = fpath or path.join(data.cache_dir, "jobs.sqlite")
+        self._connection = None
+
+    def __str__(self):
+        return f"Journal path: {self.fpath}"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(path.dirname(path.abspath(self.fpath)), exist_ok=True)
+            self._connection = sqlite3.connect(self.fpath, timeout=60)
+            self._connection.execute(_schema)
+        return self._connection
+
+    def _update(self, item: str, target: str, output: str, **fields):
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        with self._connect() as connection:
+            connection.execute(
+                f"UPDATE units SET {columns} WHERE item = ? AND target = ? AND output = ?",
+                (*fields.values(), item, target, output),
+            )
+
+    def execute(
+        self, target: str, units: dict, fn, retries: int = 3, backoff: float = 1.0
+    ) -> list:
+        """Run the units of a batch that are not done yet.
+
+        A unit is skipped if the journal records it as done and its output
+        file still exists. Otherwise ``fn`` is called to produce it, and retried
+        with exponential backoff if it fails. A unit that still fails is
+        recorded as failed, and the batch carries on.
+
+        :param target: Target of the batch (e.g. ``eggnog``).
+        :type target: str
+
+        :param units: Dictionary mapping each item to its output file.
+        :type units: dict
+
+        :param fn: Function called with an item and its output file, which writes the file.
+        :type fn: callable
+
+        :param retries: Number of attempts per unit in this run, at least 1; defaults to 3.
+        :type retries: int, optional
+
+        :param backoff: Seconds to wait before the first retry, doubling at each retry; defaults to 1.
+        :type backoff: float, optional
+
+        :return: List of the items that failed.
+        :rtype: list
+        """
+        if retries < 1:
+            raise ValueError(f"retries must be at least 1, not {retries}")
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO units (item, target, output, status, updated)"
+                " VALUES (?, ?, ?, 'pending', ?)",
+                [(item, target, output, time.time()) for item, output in units.items()],
+            )
+            done = {
+                (item, output)
+                for item, output in connection.execute(
+                    "SELECT item, output FROM units WHERE target = ? AND status = 'done'",
+                    (target,),
+                )
+            }
+        failed = []
+        for item, output in units.items():
+            if (item, output) in done and path.exists(output):
+                continue
+            (attempts,) = (
+                self._connect()
+                .execute(
+                    "SELECT attempts FROM units WHERE item = ? AND target = ? AND output = ?",
+                    (item, target, output),
+                )
+                .fetchone()
+            )
+            for attempt in range(retries):
+                if attempt:
+                    time.sleep(backoff * 2 ** (attempt - 1))
+                attempts += 1
+                try:
+                    fn(item, output)
+                except Exception as e:
+                    error = repr(e)
+                    self._update(
+                        item,
+                        target,
+                        output,
+                        status="failed",
+                        attempts=attempts,
+                        error=error,
+                    )
+                    continue
+                self._update(
+                    item,
+                    target,
+                    output,
+                    status="done",
+                    attempts=attempts,
+                    bytes=path.getsize(output),
+                    checksum=_checksum(output),
+                    error=None,
+                )
+                break
+            else:
+                logger.warning(
+                    f"{target} {item} failed after {retries} attempts: {error}"
+                )
+                failed.append(item)
+        return failed
+
+    def status(self) -> pl.DataFrame:
+        """Summarise the progress of all batches recorded in the journal.
+
+        :return: A DataFrame with, for each target and output folder, the number of units done, failed and pending, and the bytes written.
+        :rtype: :class:`polars.DataFrame`
+        """
+        rows = (
+            self._connect()
+            .execute("SELECT item, target, output, status, bytes, updated FROM units")
+            .fetchall()
+        )
+        units = pl.DataFrame(
+            rows,
+            schema={
+                "item": pl.String,
+                "target": pl.String,
+                "output": pl.String,
+                "status": pl.String,
+                "bytes": pl.Int64,
+                "updated": pl.Float64,
+            },
+            orient="row",
+        )
+        return (
+            units.with_columns(
+                folder=pl.col("output").map_elements(path.dirname, pl.String)
+            )
+            .group_by("target", "folder", maintain_order=True)
+            .agg(
+                done=(pl.col("status") == "done").sum(),
+                failed=(pl.col("status") == "failed").sum(),
+                pending=(pl.col("status") == "pending").sum(),
+                bytes=pl.col("bytes").sum(),
+                updated=pl.from_epoch(pl.col("updated").max(), time_unit="s"),
+            )
+        )
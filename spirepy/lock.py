@@ -0,0 +1,148 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill() cannot be used to probe processes on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _snapshot(fpath: str) -> tuple:
+    # Identifies a version of a lock file: its inode, the time of its last
+    # heartbeat and the details of its owner
+    with open(fpath, "rb") as f:
+        st = os.fstat(f.fileno())
+        return st.st_ino, st.st_mtime_ns, f.read()
+
+
+class FileLock:
+    """
+    A lock shared between processes, including across machines sharing a
+    filesystem.
+
+    The lock is a file created with ``O_EXCL``, holding the host and process
+    ID of its owner. While the lock is held, a background thread keeps
+    updating its modification time. A lock is considered stale, and is
+    removed, if its owner is a process on this host that no longer exists, or
+    if it has not been updated for ``stale_after`` seconds (e.g. because its
+    owner crashed on another host). A stale lock is only removed if it has
+    not been updated or taken again since it was found stale.
+
+    .. code-block:: python
+
+        with FileLock("table.parquet.lock"):
+            ...
+
+    :param fpath: Path of the lock file.
+    :type fpath: str
+
+    :param stale_after: Seconds without updates after which the lock is considered stale, defaults to 120.
+    :type stale_after: float, optional
+
+    :param poll_interval: Seconds between attempts to take the lock, defaults to 0.5.
+    :type poll_interval: float, optional
+    """
+
+    def __init__(
+        self, fpath: str, stale_after: float = 120, poll_interval: float = 0.5
+    ):
+        """Constructor method."""
+        self.fpath = fpath
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self._stop = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def acquire(self):
+        """Take the lock, waiting for it to be released if needed."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.fpath)), exist_ok=True)
+        while True:
+            try:
+                fd = os.open(self.fpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._break_if_stale():
+                    time.sleep(self.poll_interval)
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {
+                        "host": socket.gethostname(),
+                        "pid": os.getpid(),
+                        "token": uuid.uuid4().hex,
+                    },
+                    f,
+                )
+            break
+        self._stop = threading.Event()
+        threading.Thread(
+            target=self._heartbeat, args=(self._stop,), daemon=True
+        ).start()
+
+    def release(self):
+        """Release the lock."""
+        self._stop.set()
+        try:
+            os.unlink(self.fpath)
+        except FileNotFoundError:
+            pass
+
+    def _heartbeat(self, stop: threading.Event):
+        while not stop.wait(self.stale_after / 4):
+            try:
+                os.utime(self.fpath)
+            except OSError:
+                return
+
+    def _break_if_stale(self) -> bool:
+        try:
+            seen = _snapshot(self.fpath)
+        except FileNotFoundError:
+            # Released in the meantime
+            return True
+        try:
+            owner = json.loads(seen[2])
+        except ValueError:
+            # The owner has not written its details yet
+            owner = {}
+        dead = owner.get("host") == socket.gethostname() and not _pid_alive(
+            owner["pid"]
+        )
+        if not dead and time.time() - seen[1] / 1e9 < self.stale_after:
+            return False
+        # Move the lock out of the way before removing it, so that only one of
+        # the processes finding it stale removes it
+        moved = f"{self.fpath}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(self.fpath, moved)
+        except FileNotFoundError:
+            return True
+        try:
+            if _snapshot(moved) == seen:
+                return True
+            # The lock was refreshed or taken again since it was found stale:
+            # put it back, unless yet another process has taken the lock
+            try:
+                os.link(moved, self.fpath)
+            except OSError:
+                pass
+            return False
+        finally:
+            os.unlink(moved)
@@ -0,0 +1,168 @@
+import json
+import time
+import urllib.error
+from contextlib import contextmanager
+
+_callbacks = []
+
+
+def subscribe(callback):
+    """Register a callback to receive instrumentation events.
+
+    Events are dictionaries with a ``kind`` key and the time taken in
+    ``seconds``. The kinds and their other keys are:
+
+    - ``fetch``: a remote request, with ``url``, ``status`` and, when known,
+      ``bytes`` transferred and their content ``encoding``. When the file is read and parsed in one step, the
+      number of parsed ``rows`` is included and the time covers both.
+    - ``parse``: parsing of downloaded data, with its ``source`` URL and the
+      number of ``rows``.
+    - ``write``: writing of a downloaded table to the on-disk cache, with its
+      ``source`` URL and the number of ``rows``.
+    - ``cache``: a lookup in the on-disk cache, with ``name``, ``release`` and
+      whether it was a ``hit``. The time is that of loading the cached table.
+
+    Can be used as a decorator.
+
+    :param callback: Function called with each event.
+    :type callback: callable
+
+    :return: The callback.
+    :rtype: callable
+    """
+    _callbacks.append(callback)
+    return callback
+
+
+def unsubscribe(callback):
+    """Stop sending instrumentation events to a callback.
+
+    :param callback: A callback previously passed to :func:`subscribe`.
+    :type callback: callable
+    """
+    _callbacks.remove(callback)
+
+
+def enabled() -> bool:
+    """Whether any callback is subscribed.
+
+    Can be used to skip collecting expensive details of an event.
+
+    :rtype: bool
+    """
+    return bool(_callbacks)
+
+
+def emit(event: dict):
+    """Send an event to all subscribed callbacks.
+
+    :param event: The event.
+    :type event: dict
+    """
+    for callback in list(_callbacks):
+        callback(event)
+
+
+@contextmanager
+def timed(kind: str, **fields):
+    """Time a block of code and emit it as an event.
+
+    The block can add fields to the yielded event. If the block raises, the
+    error is recorded in the event before it is emitted.
+
+    :param kind: Kind of event.
+    :type kind: str
+    """
+    event = dict(kind=kind, **fields)
+    start = time.perf_counter()
+    try:
+        yield event
+    except Exception as e:
+        event["error"] = repr(e)
+        if isinstance(e, urllib.error.HTTPError):
+            event["status"] = e.code
+        raise
+    finally:
+        event["seconds"] = time.perf_counter() - start
+        if _callbacks:
+            emit(event)
+
+
+@contextmanager
+def fetch(url: str, **fields):
+    """Time a remote request and emit it as a ``fetch`` event.
+
+    The status is set to 200 if the block does not raise or set it.
+
+    :param url: The URL requested.
+    :type url: str
+    """
+    with timed("fetch", url=url, status=None, bytes=None, **fields) as event:
+        yield event
+        if event["status"] is None:
+            event["status"] = 200
+
+
+class Recorder:
+    """
+    Collects instrumentation events and summarises them.
+
+    .. code-block:: python
+
+        from spirepy import metrics
+
+        recorder = metrics.subscribe(metrics.Recorder())
+        study.get_mags()
+        print(recorder.to_prometheus())
+    """
+
+    def __init__(self):
+        """Constructor method."""
+        self.events = []
+
+    def __call__(self, event: dict):
+        self.events.append(event)
+
+    def summary(self) -> dict:
+        """Aggregate the recorded events by kind.
+
+        :return: For each kind of event, the number of events, total time, and
+            total bytes and rows where known. Cache events also count hits and
+            misses.
+        :rtype: dict
+        """
+        summary = {}
+        for event in self.events:
+            entry = summary.setdefault(
+                event["kind"], {"count": 0, "seconds": 0.0, "bytes": 0, "rows": 0}
+            )
+            entry["count"] += 1
+            entry["seconds"] += event["seconds"]
+            entry["bytes"] += event.get("bytes") or 0
+            entry["rows"] += event.get("rows") or 0
+            if event["kind"] == "cache":
+                key = "hits" if event.get("hit") else "misses"
+                entry[key] = entry.get(key, 0) + 1
+            if event.get("error"):
+                entry["errors"] = entry.get("errors", 0) + 1
+        return summary
+
+    def to_json(self) -> str:
+        """Export the recorded events and their summary as JSON.
+
+        :rtype: str
+        """
+        return json.dumps({"summary": self.summary(), "events": self.events})
+
+    def to_prometheus(self) -> str:
+        """Export the summary in the Prometheus text exposition format.
+
+        :rtype: str
+        """
+        lines = []
+        for kind, entry in self.summary().items():
+            for key, value in entry.items():
+                name = f"spirepy_{kind}_{'total' if key == 'count' else key + '_total'}"
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
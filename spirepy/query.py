@@ -0,0 +1,228 @@
+from typing import Union
+
+import polars as pl
+
+from spirepy.data import (
+    sample_index,
+    scan_cluster_metadata,
+    scan_genome_metadata,
+    scan_sample_metadata,
+)
+
+_tables = {
+    "genomes": scan_genome_metadata,
+    "clusters": scan_cluster_metadata,
+    "samples": scan_sample_metadata,
+}
+
+
+class Query:
+    """
+    A lazy query over the SPIRE metadata tables.
+
+    Queries are built by chaining :meth:`filter`, :meth:`select` and
+    :meth:`limit`, each of which returns a new query. Nothing is read until
+    the query is collected, and filters and column selections are pushed down
+    to the Parquet scan of the cached metadata.
+
+    The ``samples`` table has the sample index joined with the metadata of
+    the studies fetched so far (see :func:`spirepy.data.scan_sample_metadata`),
+    so sample attributes can only be queried for those studies. Genomes are
+    restricted to matching samples with :meth:`from_samples`:
+
+    .. code-block:: python
+
+        from spirepy.query import Query
+
+        gut = Query("samples").filter("environment = 'gut'")
+        mags = (
+            Query("genomes")
+            .filter("completeness > 90", "contamination < 5")
+            .from_samples(gut)
+            .to_genomes()
+        )
+
+    :param table: Table to query, one of ``genomes``, ``clusters`` or ``samples``; defaults to ``genomes``.
+    :type table: str
+    """
+
+    def __init__(self, table: str = "genomes"):
+        """Constructor method."""
+        if table not in _tables:
+            raise ValueError(
+                f"Unknown table '{table}', please choose one of the following: {', '.join(_tables)}"
+            )
+        self.table = table
+        self._predicates = []
+        self._columns = None
+        self._limit = None
+        self._samples = None
+
+    def __str__(self):
+        return f"Query table: {self.table} \tFilters: {len(self._predicates)}"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def _copy(self) -> "Query":
+        query = Query(self.table)
+        query._predicates = list(self._predicates)
+        query._columns = self._columns
+        query._limit = self._limit
+        query._samples = self._samples
+        return query
+
+    def filter(self, *predicates: Union[str, pl.Expr]) -> "Query":
+        """Restrict the query to rows matching all the predicates.
+
+        :param predicates: Polars expressions or SQL expressions (e.g. ``"completeness > 90"``).
+        :type predicates: str or :class:`polars.Expr`
+
+        :return: A new query with the added predicates.
+        :rtype: :class:`spirepy.query.Query`
+        """
+        query = self._copy()
+        for predicate in predicates:
+            if isinstance(predicate, str):
+                predicate = pl.sql_expr(predicate)
+            query._predicates.append(predicate)
+        return query
+
+    def select(self, *columns: str) -> "Query":
+        """Restrict the query to the given columns.
+
+        :param columns: Names of the columns to keep.
+        :type columns: str
+
+        :return: A new query with the column selection.
+        :rtype: :class:`spirepy.query.Query`
+        """
+        query = self._copy()
+        query._columns = list(columns)
+        return query
+
+    def limit(self, n: int) -> "Query":
+        """Restrict the query to the first ``n`` matching rows.
+
+        :param n: Maximum number of rows.
+        :type n: int
+
+        :return: A new query with the row limit.
+        :rtype: :class:`spirepy.query.Query`
+        """
+        query = self._copy()
+        query._limit = n
+        return query
+
+    def from_samples(self, samples: "Query") -> "Query":
+        """Restrict a query of the ``genomes`` table to MAGs of matching samples.
+
+        :param samples: A query of the ``samples`` table.
+        :type samples: :class:`spirepy.query.Query`
+
+        :return: A new query restricted to the MAGs derived from the samples.
+        :rtype: :class:`spirepy.query.Query`
+        """
+        if self.table != "genomes" or samples.table != "samples":
+            raise ValueError("Only genomes can be restricted to a samples query")
+        query = self._copy()
+        query._samples = samples
+        return query
+
+    def lazy(self, columns: list = None) -> pl.LazyFrame:
+        """Build the query plan without running it.
+
+        :param columns: Columns to select, overriding those given to :meth:`select`; defaults to :class:`None`.
+        :type columns: list, optional
+
+        :return: A LazyFrame with the query plan.
+        :rtype: :class:`polars.LazyFrame`
+        """
+        frame = _tables[self.table]()
+        if self._predicates:
+            frame = frame.filter(*self._predicates)
+        if self._samples is not None:
+            frame = frame.join(
+                self._samples.lazy(["sample_id"]),
+                left_on="derived_from_sample",
+                right_on="sample_id",
+                how="semi",
+            )
+        columns = columns if columns is not None else self._columns
+        if columns is not None:
+            frame = frame.select(columns)
+        if self._limit is not None:
+            frame = frame.head(self._limit)
+        return frame
+
+    def collect(self) -> pl.DataFrame:
+        """Run the query.
+
+        :return: A DataFrame with the matching rows.
+        :rtype: :class:`polars.DataFrame`
+        """
+        return self.lazy().collect()
+
+    def _sample_ids(self) -> list:
+        column = "sample_id" if self.table == "samples" else "derived_from_sample"
+        frame = self.lazy([column]).unique(maintain_order=True).collect()
+        return frame[column].to_list()
+
+    def to_genomes(self) -> list:
+        """Run the query and return the matching genomes.
+
+        Only valid for the ``genomes`` table.
+
+        :return: List of :class:`spirepy.genome.Genome`.
+        :rtype: list
+        """
+        from spirepy.genome import Genome
+        from spirepy.sample import Sample
+
+        if self.table != "genomes":
+            raise ValueError("Genomes can only be obtained from the genomes table")
+        frame = self.lazy(["spire_id", "derived_from_sample"]).collect()
+        samples = {}
+        genomes = []
+        for genome_id, sample_id in frame.iter_rows():
+            if sample_id not in samples:
+                samples[sample_id] = Sample(sample_id)
+            genomes.append(Genome(genome_id, samples[sample_id]))
+        return genomes
+
+    def to_samples(self) -> list:
+        """Run the query and return the matching samples.
+
+        Only valid for the ``genomes`` and ``samples`` tables.
+
+        :return: List of :class:`spirepy.sample.Sample`.
+        :rtype: list
+        """
+        from spirepy.sample import Sample
+
+        if self.table == "clusters":
+            raise ValueError("Samples cannot be obtained from the clusters table")
+        return [Sample(s) for s in self._sample_ids()]
+
+    def to_studies(self) -> list:
+        """Run the query and return the studies of the matching samples.
+
+        Only valid for the ``genomes`` and ``samples`` tables. Studies are
+        resolved through the sample index (see :func:`spirepy.data.sample_index`),
+        so samples of studies that were never indexed are left out.
+
+        :return: List of :class:`spirepy.study.Study`.
+        :rtype: list
+        """
+        from spirepy.study import Study
+
+        if self.table == "clusters":
+            raise ValueError("Studies cannot be obtained from the clusters table")
+        studies = (
+            pl.DataFrame(
+                {"sample_id": self._sample_ids()}, schema={"sample_id": pl.String}
+            )
+            .join(sample_index(), on="sample_id", how="inner", maintain_order="left")
+            .select(pl.col("study").unique(maintain_order=True))
+        )
+        return [Study(s) for s in studies["study"].to_list()]
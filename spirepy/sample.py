@@ -1,11 +1,21 @@
 from typing import Union
+import io
 import os
 import os.path as path
-import urllib.request
+import urllib.error
 
 import polars as pl
 
-from spirepy.data import genome_metadata
+from spirepy import blobstore, metrics, scheduler, transfer
+from spirepy.data import (
+    cached_projection,
+    genome_metadata,
+    index_samples,
+    lookup_study,
+    scan_genome_metadata,
+    study_column,
+)
+from spirepy.journal import Journal
 from spirepy.logger import logger
 from spirepy.study import Study
 
@@ -21,22 +31,70 @@ class Sample:
     :param id: Internal ID for the sample.
     :type id: str
 
-    :param study: The :class:`spirepy.study.Study` to which the sample belongs to, defaults to :class:`None`.
+    :param study: The :class:`spirepy.study.Study` to which the sample belongs to, defaults to :class:`None`. If not given, it is looked up in the sample index (see :func:`spirepy.data.sample_index`) when first accessed, or else in the sample's metadata.
     :type study: :class:`spirepy.study.Study`, optional
     """
 
     def __init__(self, id: str, study: Study = None):
         """Constructor method."""
         self.id = id
-        self.study = study
+        self._study = study
+        # Row of the sample in the study metadata, set by Study.get_samples()
+        self._study_row = None
+        self.clear_cache()
+
+    def clear_cache(self):
+        """Drop the data downloaded for the sample, to free memory.
+
+        It is downloaded again if needed.
+        """
         self._metadata = None
         self._mags = None
         self._eggnog_data = None
         self._amr_annotations = {}
         self._contig_depths = None
+        # Tables cached with only some of their columns
+        self._partial = set()
+
+    @property
+    def study(self) -> Union[Study, None]:
+        """The study the sample belongs to.
+
+        :return: The sample's study, or :class:`None` if it cannot be resolved.
+        :rtype: :class:`spirepy.study.Study`
+        """
+        if self._study is None:
+            name = lookup_study(self.id)
+            if name is None:
+                name = self._fetch_study()
+            if name is not None:
+                self._study = Study(name)
+        return self._study
+
+    def _fetch_study(self) -> Union[str, None]:
+        # Not indexed yet: the sample's own metadata names its study, which is
+        # a single small request rather than one per study
+        try:
+            metadata = self.get_metadata()
+        except (urllib.error.URLError, OSError, pl.exceptions.PolarsError) as e:
+            logger.warning(f"Could not look up the study of {self.id} ({e})")
+            return None
+        column = study_column(metadata.columns)
+        if column is None or metadata.is_empty():
+            return None
+        name = metadata[column][0]
+        index_samples(name, [self.id])
+        return name
+
+    @study.setter
+    def study(self, study: Study):
+        self._study = study
 
     def __str__(self):
-        study_name = self.study.name if isinstance(self.study, Study) else None
+        # Only the index is used, so that printing a sample makes no requests
+        study_name = (
+            self._study.name if self._study is not None else lookup_study(self.id)
+        )
         return f"Sample id: {self.id} 	Study: {study_name}"
 
     def __repr__(self):
@@ -48,96 +106,190 @@ class Sample:
         :return: A Dataframe with the sample's metadata.
         :rtype: :class:`polars.DataFrame`
         """
+        if self._metadata is None and self._study_row is not None:
+            # The study metadata has a row per sample, so slice it instead of
+            # making a request for each sample
+            self._metadata = self.study.get_metadata().slice(self._study_row, 1)
         if self._metadata is None:
-            sample_meta = pl.read_csv(
-                f"https://spire.embl.de/spire/api/sample/{self.id}?format=tsv",
-                separator="\t",
-            )
-            self._metadata = sample_meta
+            url = f"https://spire.embl.de/spire/api/sample/{self.id}?format=tsv"
+            self._metadata = transfer.read_tsv(url)
         return self._metadata
 
-    def get_mags(self) -> pl.DataFrame:
+    def get_mags(
+        self, columns: list = None, filter: Union[str, pl.Expr] = None
+    ) -> pl.DataFrame:
         """Retrieve the MAGs for a sample.
 
+        :param columns: Columns to return, defaults to all columns. Only these columns (and those used by ``filter``) are read, and they are kept for later calls.
+        :type columns: list, optional
+
+        :param filter: Polars expression or SQL expression (e.g. ``"completeness > 90"``) the rows must match, defaults to :class:`None`.
+        :type filter: str or :class:`polars.Expr`, optional
+
         :return: A Dataframe with the sample's MAGs.
         :rtype: :class:`polars.DataFrame`
         """
-        if self._mags is None:
-            genome_meta = genome_metadata()
-            mags = genome_meta.filter(pl.col("derived_from_sample") == self.id)
-            self._mags = mags
-        return self._mags
 
-    def get_eggnog_data(self) -> pl.DataFrame:
+        def fetch(columns: list) -> pl.DataFrame:
+            sample = pl.col("derived_from_sample") == self.id
+            if columns is None:
+                return genome_metadata().filter(sample)
+            # Only the needed columns are read from the cached genome metadata
+            return scan_genome_metadata().filter(sample).select(columns).collect()
+
+        self._mags, mags = self._table("mags", self._mags, fetch, columns, filter)
+        return mags
+
+    def _table(self, name: str, cached, fetch, columns: list, filter) -> tuple:
+        # See cached_projection(), the tables cached with only some of their
+        # columns are tracked in self._partial
+        cached, complete, table = cached_projection(
+            cached, name not in self._partial, fetch, columns, filter
+        )
+        if complete:
+            self._partial.discard(name)
+        else:
+            self._partial.add(name)
+        return cached, table
+
+    def get_eggnog_data(
+        self, columns: list = None, filter: Union[str, pl.Expr] = None
+    ) -> pl.DataFrame:
         """Retrive the EggNOG-mapper data for a sample.
 
+        :param columns: Columns to return, defaults to all columns. Only these columns (and those used by ``filter``) are parsed.
+        :type columns: list, optional
+
+        :param filter: Polars expression or SQL expression the rows must match, defaults to :class:`None`.
+        :type filter: str or :class:`polars.Expr`, optional
+
         :return: A Dataframe with the sample's EggNOG-mapper data.
         :rtype: :class:`polars.DataFrame`
         """
-        if self._eggnog_data is None:
+
+        def fetch(columns: list) -> pl.DataFrame:
             # We need to use pandas because polars does not support reading
             # files with a footer
             import pandas as pd
 
-            egg = pd.read_csv(
-                f"https://spire.embl.de/download_eggnog/{self.id}",
-                sep="\t",
-                skiprows=4,
-                skipfooter=3,
-                compression="gzip",
-                engine="python",
-            )
-            eggnog_data = pl.from_pandas(egg)
-            self._eggnog_data = eggnog_data
-        return self._eggnog_data
+            url = f"https://spire.embl.de/download_eggnog/{self.id}"
+            options = {} if columns is None else {"usecols": columns}
+            with metrics.fetch(url) as event:
+                with scheduler.urlopen(url, scheduler.FILE) as response:
+                    event["status"] = response.status
+                    content = response.read()
+                event["bytes"] = len(content)
+                egg = pd.read_csv(
+                    io.BytesIO(content),
+                    sep="\t",
+                    skiprows=4,
+                    skipfooter=3,
+                    compression="gzip",
+                    engine="python",
+                    **options,
+                )
+                event["rows"] = len(egg)
+            return pl.from_pandas(egg)
+
+        self._eggnog_data, eggnog_data = self._table(
+            "eggnog", self._eggnog_data, fetch, columns, filter
+        )
+        return eggnog_data
 
-    def get_amr_annotations(self, mode: str = "deeparg") -> Union[None, pl.DataFrame]:
+    def get_amr_annotations(
+        self,
+        mode: str = "deeparg",
+        columns: list = None,
+        filter: Union[str, pl.Expr] = None,
+    ) -> Union[None, pl.DataFrame]:
         """Obtain the anti-microbial resistance annotations for the sample.
 
         :param mode: Tool to select the AMR data from. Options are deepARG (deeparg), abricate-megares (megares) and abricate-vfdb (vfdb); defaults to deepARG.
         :type mode: str, optional
 
+        :param columns: Columns to return, defaults to all columns. Only these columns (and those used by ``filter``) are parsed.
+        :type columns: list, optional
+
+        :param filter: Polars expression or SQL expression the rows must match, defaults to :class:`None`.
+        :type filter: str or :class:`polars.Expr`, optional
+
         :return: A Dataframe with the sample's AMR data.
         :rtype: :class:`polars.DataFrame`
         """
-        if mode not in self._amr_annotations:
-            url = {
-                "deeparg": f"https://spire.embl.de/download_deeparg/{self.id}",
-                "megares": f"https://spire.embl.de/download_abricate_megares/{self.id}",
-                "vfdb": f"https://spire.embl.de/download_abricate_vfdb/{self.id}",
-            }.get(mode)
-            if url is None:
-                logger.error(
-                    "Invalid option, please choose one of the following: deeparg, megares, vfdb"
-                )
-                return None
-            amr = pl.read_csv(url, separator="\t")
-            self._amr_annotations[mode] = amr
-        return self._amr_annotations[mode]
+        url = {
+            "deeparg": f"https://spire.embl.de/download_deeparg/{self.id}",
+            "megares": f"https://spire.embl.de/download_abricate_megares/{self.id}",
+            "vfdb": f"https://spire.embl.de/download_abricate_vfdb/{self.id}",
+        }.get(mode)
+        if url is None:
+            logger.error(
+                "Invalid option, please choose one of the following: deeparg, megares, vfdb"
+            )
+            return None
+        self._amr_annotations[mode], amr = self._table(
+            f"amr_{mode}",
+            self._amr_annotations.get(mode),
+            lambda columns: transfer.read_tsv(url, columns=columns),
+            columns,
+            filter,
+        )
+        return amr
 
-    def get_contig_depths(self) -> pl.DataFrame:
+    def get_contig_depths(
+        self, columns: list = None, filter: Union[str, pl.Expr] = None
+    ) -> pl.DataFrame:
         """Obtain the contig depth data for the sample.
 
+        :param columns: Columns to return, defaults to all columns. Only these columns (and those used by ``filter``) are parsed.
+        :type columns: list, optional
+
+        :param filter: Polars expression or SQL expression the rows must match, defaults to :class:`None`.
+        :type filter: str or :class:`polars.Expr`, optional
+
         :return: A Dataframe with the sample's contig depth data.
         :rtype: :class:`polars.DataFrame`
         """
-        if self._contig_depths is None:
-            cont_depths = pl.read_csv(
-                f"https://spire.embl.de/download_contig_depths/{self.id}",
-                separator="\t",
-            )
-            self._contig_depths = cont_depths
-        return self._contig_depths
+        url = f"https://spire.embl.de/download_contig_depths/{self.id}"
+        self._contig_depths, contig_depths = self._table(
+            "contig_depths",
+            self._contig_depths,
+            lambda columns: transfer.read_tsv(url, columns=columns),
+            columns,
+            filter,
+        )
+        return contig_depths
 
-    def download_mags(self, out_folder: str):
+    def download_mags(self, out_folder: str, journal: Journal = None):
         """Download the MAGs into a specified folder.
 
         :param output: Output folder to download the MAGs to.
         :type output: str
+
+        :param journal: Journal to record the downloads in, so that MAGs already downloaded are skipped and failed downloads retried; defaults to :class:`None`.
+        :type journal: :class:`spirepy.journal.Journal`, optional
         """
         os.makedirs(out_folder, exist_ok=True)
-        for mag in self.get_mags()["spire_id"].to_list():
-            urllib.request.urlretrieve(
-                f"https://spire.embl.de/download_file/{mag}",
-                path.join(out_folder, f"{mag}.fa.gz"),
-            )
+        units = {
+            mag: path.join(out_folder, f"{mag}.fa.gz")
+            for mag in self.get_mags()["spire_id"].to_list()
+        }
+        if journal is not None:
+            journal.execute("mags", units, self._download_mag)
+        else:
+            for mag, fpath in units.items():
+                self._download_mag(mag, fpath)
+
+    def _download_mag(self, mag: str, fpath: str):
+        url = f"https://spire.embl.de/download_file/{mag}"
+        store = blobstore.default_store()
+        if store is not None:
+            store.fetch(url, fpath, self._retrieve)
+        else:
+            self._retrieve(url, fpath)
+
+    @staticmethod
+    def _retrieve(url: str, fpath: str):
+        with metrics.fetch(url) as event:
+            scheduler.retrieve(url, fpath, priority=scheduler.FILE)
+            if metrics.enabled():
+                event["bytes"] = path.getsize(fpath)
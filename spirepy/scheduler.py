@@ -0,0 +1,315 @@
+import os
+import os.path as path
+import re
+import threading
+import time
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+
+from rich.console import Console
+from rich.progress import (
+    BarColumn,
+    DownloadColumn,
+    Progress,
+    TextColumn,
+    TimeRemainingColumn,
+    TransferSpeedColumn,
+)
+
+from spirepy.logger import logger
+
+#: Priority of metadata tables and other small requests, which go first.
+METADATA = 0
+
+#: Priority of single files (e.g. MAGs and archive members).
+FILE = 1
+
+#: Priority of bulk downloads (e.g. study tarballs), which go last.
+BULK = 2
+
+#: Bytes read at a time, the unit in which bandwidth is shared between transfers.
+CHUNK_SIZE = 64 * 1024
+
+_UNITS = {"": 1, "k": 1000, "m": 1000**2, "g": 1000**3}
+
+
+def parse_rate(spec: str) -> float:
+    """Parse a bandwidth such as ``500k``, ``10M`` or ``1.5G`` (bytes per second).
+
+    :param spec: The bandwidth, as a number with an optional unit.
+    :type spec: str
+
+    :return: The bandwidth in bytes per second.
+    :rtype: float
+    """
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([kmg]?)b?", spec.strip().lower())
+    if match is None or float(match[1]) <= 0:
+        raise ValueError(f"Invalid bandwidth '{spec}', expected e.g. 500k or 10M")
+    return float(match[1]) * _UNITS[match[2]]
+
+
+def parse_connections(spec: str) -> int:
+    """Parse a number of connections, which must be a positive integer.
+
+    :param spec: The number of connections.
+    :type spec: str
+
+    :rtype: int
+    """
+    try:
+        connections = int(spec)
+    except ValueError:
+        connections = 0
+    if connections < 1:
+        raise ValueError(f"Invalid number of connections '{spec}', expected e.g. 4")
+    return connections
+
+
+def _from_environment(name: str, parse, default):
+    spec = os.environ.get(name)
+    if not spec:
+        return default
+    try:
+        return parse(spec)
+    except ValueError as e:
+        logger.error(f"Ignoring {name}: {e}")
+        return default
+
+
+#: Bandwidth shared by all downloads of the process, in bytes per second;
+#: :class:`None` to take it from ``SPIREPY_BANDWIDTH_LIMIT``, with no cap if unset.
+bandwidth_limit = None
+
+#: Largest number of concurrent connections to each host; :class:`None` to
+#: take it from ``SPIREPY_MAX_PER_HOST``, or 4 if unset.
+max_per_host = None
+
+_default = None
+
+
+class _Transfer:
+    """A response whose reads are throttled and shown in the progress display."""
+
+    def __init__(self, scheduler: "Scheduler", response, url: str):
+        self._scheduler = scheduler
+        self._response = response
+        self._task = None
+        if scheduler._display is not None:
+            length = response.headers.get("Content-Length")
+            self._task = scheduler._display.add_task(
+                path.basename(urllib.parse.urlsplit(url).path) or url,
+                total=int(length) if length else None,
+            )
+
+    def __getattr__(self, name: str):
+        return getattr(self._response, name)
+
+    def read(self, size: int = -1) -> bytes:
+        if 0 <= size <= CHUNK_SIZE:
+            return self._read(size)
+        parts = []
+        while size < 0 or size > 0:
+            part = self._read(CHUNK_SIZE if size < 0 else min(size, CHUNK_SIZE))
+            if not part:
+                break
+            parts.append(part)
+            size -= len(part) if size > 0 else 0
+        return b"".join(parts)
+
+    def _read(self, size: int) -> bytes:
+        content = self._response.read(size)
+        self._scheduler._throttle(len(content))
+        display = self._scheduler._display
+        if display is not None and self._task is not None:
+            display.advance(self._task, len(content))
+            display.advance(self._scheduler._total, len(content))
+        return content
+
+    def _finish(self):
+        display = self._scheduler._display
+        if display is not None and self._task is not None:
+            display.remove_task(self._task)
+
+
+class Scheduler:
+    """
+    Schedules the downloads of a process.
+
+    Each request waits for a free connection to its host. Waiting requests
+    are started by priority (see :data:`METADATA`, :data:`FILE` and
+    :data:`BULK`), then by taking turns between the threads making them, so
+    that a thread queueing many downloads does not hold up the others. The
+    bytes read by all transfers go through a shared token bucket, in chunks
+    of :data:`CHUNK_SIZE`, so that they split the bandwidth evenly.
+
+    :param bandwidth: Bandwidth shared by all transfers, in bytes per second; defaults to no cap.
+    :type bandwidth: float, optional
+
+    :param max_per_host: Largest number of concurrent connections to each host, defaults to 4.
+    :type max_per_host: int, optional
+    """
+
+    def __init__(self, bandwidth: float = None, max_per_host: int = 4):
+        """Constructor method."""
+        if max_per_host < 1:
+            raise ValueError(f"max_per_host must be at least 1, not {max_per_host}")
+        self.bandwidth = bandwidth
+        self.max_per_host = max_per_host
+        self._condition = threading.Condition()
+        self._active = {}
+        self._waiting = []
+        self._turns = {}
+        self._seq = 0
+        self._bucket = threading.Lock()
+        self._tokens = bandwidth or 0
+        self._refilled = time.monotonic()
+        self._display = None
+        self._total = None
+
+    def __str__(self):
+        return (
+            f"Scheduler bandwidth: {self.bandwidth}, max per host: {self.max_per_host}"
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+    def _acquire(self, host: str, priority: int):
+        owner = threading.get_ident()
+        with self._condition:
+            # Threads that were granted fewer connections go first
+            entry = (priority, self._turns.get(owner, 0), self._seq, host)
+            self._seq += 1
+            self._waiting.append(entry)
+            while (
+                self._active.get(host, 0) >= self.max_per_host
+                or min(e for e in self._waiting if e[3] == host) != entry
+            ):
+                self._condition.wait()
+            self._waiting.remove(entry)
+            self._active[host] = self._active.get(host, 0) + 1
+            self._turns[owner] = self._turns.get(owner, 0) + 1
+            # Another waiting request for the host may start too
+            self._condition.notify_all()
+
+    def _release(self, host: str):
+        with self._condition:
+            self._active[host] -= 1
+            self._condition.notify_all()
+
+    def _throttle(self, size: int):
+        if not self.bandwidth:
+            return
+        with self._bucket:
+            now = time.monotonic()
+            self._tokens = min(
+                self.bandwidth,
+                self._tokens + (now - self._refilled) * self.bandwidth,
+            )
+            self._refilled = now
+            # Reserve the bytes, waiting until the bucket has refilled enough
+            self._tokens -= size
+            delay = -self._tokens / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    @contextmanager
+    def urlopen(self, request, priority: int = FILE, timeout: float = 60):
+        """Open a URL once a connection to its host is free.
+
+        Used like :func:`urllib.request.urlopen`. The connection is held until
+        the response is closed.
+
+        :param request: URL or :class:`urllib.request.Request`.
+        :type request: str or :class:`urllib.request.Request`
+
+        :param priority: Priority of the request, defaults to :data:`FILE`.
+        :type priority: int, optional
+
+        :param timeout: Timeout of the connection in seconds, defaults to 60.
+        :type timeout: float, optional
+        """
+        url = (
+            request.full_url if isinstance(request, urllib.request.Request) else request
+        )
+        host = urllib.parse.urlsplit(url).netloc
+        self._acquire(host, priority)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                transfer = _Transfer(self, response, url)
+                try:
+                    yield transfer
+                finally:
+                    transfer._finish()
+        finally:
+            self._release(host)
+
+    def retrieve(self, url: str, fpath: str, priority: int = BULK):
+        """Download a URL to a file, like :func:`urllib.request.urlretrieve`.
+
+        :param url: URL of the file.
+        :type url: str
+
+        :param fpath: Output path.
+        :type fpath: str
+
+        :param priority: Priority of the download, defaults to :data:`BULK`.
+        :type priority: int, optional
+        """
+        with self.urlopen(url, priority) as response, open(fpath, "wb") as f:
+            while chunk := response.read(CHUNK_SIZE):
+                f.write(chunk)
+
+    @contextmanager
+    def progress(self):
+        """Show the transfers and their throughput on stderr while in the block."""
+        display = Progress(
+            TextColumn("{task.description}"),
+            BarColumn(),
+            DownloadColumn(),
+            TransferSpeedColumn(),
+            TimeRemainingColumn(),
+            console=Console(stderr=True),
+        )
+        with display:
+            self._total = display.add_task("total", total=None)
+            self._display = display
+            try:
+                yield display
+            finally:
+                self._display = None
+
+
+def default_scheduler() -> Scheduler:
+    """Get the scheduler shared by all downloads.
+
+    It is created again when :data:`bandwidth_limit` or :data:`max_per_host`
+    have changed. Invalid values in the environment are logged and ignored.
+
+    :rtype: :class:`Scheduler`
+    """
+    global _default
+    bandwidth = bandwidth_limit
+    if bandwidth is None:
+        bandwidth = _from_environment("SPIREPY_BANDWIDTH_LIMIT", parse_rate, None)
+    per_host = max_per_host
+    if per_host is None:
+        per_host = _from_environment("SPIREPY_MAX_PER_HOST", parse_connections, 4)
+    if (
+        _default is None
+        or _default.bandwidth != bandwidth
+        or _default.max_per_host != per_host
+    ):
+        _default = Scheduler(bandwidth, per_host)
+    return _default
+
+
+def urlopen(request, priority: int = FILE, timeout: float = 60):
+    """Open a URL with the default scheduler (see :meth:`Scheduler.urlopen`)."""
+    return default_scheduler().urlopen(request, priority, timeout)
+
+
+def retrieve(url: str, fpath: str, priority: int = BULK):
+    """Download a URL with the default scheduler (see :meth:`Scheduler.retrieve`)."""
+    default_scheduler().retrieve(url, fpath, priority)
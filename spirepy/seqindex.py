@@ -0,0 +1,326 @@
+import gzip
+import hashlib
+import os
+import os.path as path
+import struct
+import tempfile
+import zlib
+
+import polars as pl
+
+from spirepy import data
+from spirepy.lock import FileLock
+
+#: File extensions recognised as FASTA, possibly followed by ``.gz``.
+FASTA_EXTENSIONS = (".fa", ".fna", ".faa", ".fasta", ".ffn")
+
+#: Uncompressed bytes per BGZF block (as written by ``bgzip``).
+BGZF_BLOCK_SIZE = 0xFF00
+
+# Empty block that terminates a BGZF file
+_BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+_schema = {"id": pl.String, "file": pl.String, "offset": pl.Int64, "length": pl.Int64}
+
+_files_schema = {"file": pl.String, "size": pl.Int64, "mtime_ns": pl.Int64}
+
+
+def is_fasta(fname: str) -> bool:
+    """Whether a file name has a FASTA extension (see :data:`FASTA_EXTENSIONS`).
+
+    :param fname: File name.
+    :type fname: str
+
+    :rtype: bool
+    """
+    if fname.endswith(".gz"):
+        fname = fname[:-3]
+    return fname.endswith(FASTA_EXTENSIONS)
+
+
+class _BgzfWriter:
+    """Write a BGZF file: a gzip file made of independent blocks of at most 64 KiB.
+
+    Positions are virtual offsets: the offset of a block in the file shifted
+    left by 16 bits, plus the offset in the uncompressed block.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = bytearray()
+
+    def tell(self) -> int:
+        return (self.f.tell() << 16) | len(self.buffer)
+
+    def write(self, content: bytes):
+        self.buffer += content
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            self._flush_block(self.buffer[:BGZF_BLOCK_SIZE])
+            del self.buffer[:BGZF_BLOCK_SIZE]
+
+    def _flush_block(self, block: bytes):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        cdata = compressor.compress(block) + compressor.flush()
+        header = struct.pack(
+            "<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25
+        )
+        trailer = struct.pack("<II", zlib.crc32(block), len(block))
+        self.f.write(header + cdata + trailer)
+
+    def close(self):
+        if self.buffer:
+            self._flush_block(bytes(self.buffer))
+            self.buffer.clear()
+        self.f.write(_BGZF_EOF)
+
+
+def _read_bgzf(f, voffset: int, length: int) -> bytes:
+    """Read ``length`` uncompressed bytes from a BGZF file, starting at a virtual offset."""
+    f.seek(voffset >> 16)
+    skip = voffset & 0xFFFF
+    content = bytearray()
+    while len(content) < skip + length:
+        header = f.read(18)
+        if len(header) < 18:
+            break
+        bsize = struct.unpack("<H", header[16:18])[0] + 1
+        block = f.read(bsize - 18)
+        content += zlib.decompress(block[:-8], -15)
+    return bytes(content[skip : skip + length])
+
+
+def _parse_record(record: bytes) -> str:
+    return b"".join(record.split(b"\n")[1:]).decode().replace("\r", "")
+
+
+class SequenceIndex:
+    """
+    An index of the sequences in a folder of FASTA files, for random access by ID.
+
+    The index maps each sequence ID to its file, and the offset and length
+    of its record, like ``samtools faidx``. It is built in one pass over the
+    files in the folder and saved in the cache directory, along with a BGZF
+    copy of each gzipped file, so that their records can be read without
+    decompressing the whole file. The files in the folder are left as they
+    are. When files are added, removed, or change size or modification time,
+    only those files are indexed again.
+
+    :param folder: Folder with the FASTA files (e.g. the ``genecalls`` folder of :meth:`spirepy.study.Study.download_genecalls`).
+    :type folder: str
+    """
+
+    def __init__(self, folder: str):
+        """Constructor method."""
+        self.folder = folder
+        self._entries = None
+
+    def __str__(self):
+        return f"SequenceIndex folder: {self.folder}"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def _root(self) -> str:
+        key = hashlib.sha256(path.abspath(self.folder).encode()).hexdigest()[:16]
+        return path.join(data.cache_dir, "sequence_index", key)
+
+    def _path(self) -> str:
+        return path.join(self._root(), "entries.parquet")
+
+    def _files_path(self) -> str:
+        return path.join(self._root(), "files.parquet")
+
+    def bgzf_path(self, fname: str) -> str:
+        """Path of the BGZF copy of a gzipped file of the folder.
+
+        :param fname: Path of the file, relative to the folder.
+        :type fname: str
+
+        :rtype: str
+        """
+        return path.join(self._root(), "bgzf", fname)
+
+    def _files(self) -> pl.DataFrame:
+        files = []
+        for root, _, fnames in os.walk(self.folder):
+            for fname in fnames:
+                if is_fasta(fname):
+                    st = os.stat(path.join(root, fname))
+                    files.append(
+                        (
+                            path.relpath(path.join(root, fname), self.folder),
+                            st.st_size,
+                            st.st_mtime_ns,
+                        )
+                    )
+        return pl.DataFrame(files, schema=_files_schema, orient="row").sort("file")
+
+    def _unchanged(self, files: pl.DataFrame) -> list:
+        # Files indexed before that have not changed since
+        if not (path.exists(self._path()) and path.exists(self._files_path())):
+            return []
+        indexed = files.join(
+            pl.read_parquet(self._files_path()), on=list(_files_schema), how="semi"
+        )["file"].to_list()
+        return [
+            fname
+            for fname in indexed
+            if not fname.endswith(".gz") or path.exists(self.bgzf_path(fname))
+        ]
+
+    def _is_stale(self) -> bool:
+        if not path.exists(self._files_path()):
+            return True
+        files = self._files()
+        recorded = pl.read_parquet(self._files_path())
+        # Stale if any file was added, changed or removed
+        return not len(self._unchanged(files)) == files.height == recorded.height
+
+    def entries(self) -> pl.DataFrame:
+        """Load the index, building it first if needed.
+
+        :return: A DataFrame with the ``id`` of each sequence, the ``file`` it is in (relative to the folder), and the ``offset`` and ``length`` of its record.
+        :rtype: :class:`polars.DataFrame`
+        """
+        if self._entries is None:
+            os.makedirs(self._root(), exist_ok=True)
+            with FileLock(path.join(self._root(), "index.lock")):
+                if self._is_stale():
+                    self._update()
+                self._entries = pl.read_parquet(self._path())
+        return self._entries
+
+    def _update(self):
+        files = self._files()
+        if path.exists(self._files_path()):
+            # Drop the copies of files removed from the folder
+            recorded = pl.read_parquet(self._files_path())["file"].to_list()
+            for fname in set(recorded) - set(files["file"].to_list()):
+                if path.exists(self.bgzf_path(fname)):
+                    os.unlink(self.bgzf_path(fname))
+        unchanged = self._unchanged(files)
+        frames = []
+        if unchanged:
+            frames.append(
+                pl.read_parquet(self._path()).filter(pl.col("file").is_in(unchanged))
+            )
+        unchanged = set(unchanged)
+        changed = [f for f in files["file"].to_list() if f not in unchanged]
+        frames.append(self.build(changed))
+        data._write_parquet(pl.concat(frames), self._path())
+        data._write_parquet(files, self._files_path())
+
+    def build(self, fnames: list = None) -> pl.DataFrame:
+        """Index files of the folder, writing BGZF copies of the gzipped ones.
+
+        :param fnames: Paths of the files, relative to the folder; defaults to all FASTA files in it.
+        :type fnames: list, optional
+
+        :return: A DataFrame with the index (see :meth:`entries`).
+        :rtype: :class:`polars.DataFrame`
+        """
+        if fnames is None:
+            fnames = self._files()["file"].to_list()
+        frames = []
+        for fname in fnames:
+            fpath = path.join(self.folder, fname)
+            if fname.endswith(".gz"):
+                ids, offsets, lengths = self._index_gzip(fpath, self.bgzf_path(fname))
+            else:
+                ids, offsets, lengths = self._index_plain(fpath)
+            frames.append(
+                pl.DataFrame(
+                    {"id": ids, "file": fname, "offset": offsets, "length": lengths},
+                    schema=_schema,
+                )
+            )
+        if not frames:
+            return pl.DataFrame(schema=_schema)
+        return pl.concat(frames)
+
+    @staticmethod
+    def _records(lines, tell):
+        # Yield the ID, start position and length of each record
+        current, start, length = None, 0, 0
+        for line in lines:
+            if line.startswith(b">"):
+                if current is not None:
+                    yield current, start, length
+                current, start, length = line[1:].split(None, 1)[0].decode(), tell(), 0
+            length += len(line)
+        if current is not None:
+            yield current, start, length
+
+    def _index_plain(self, fpath: str) -> tuple:
+        ids, offsets, lengths = [], [], []
+        with open(fpath, "rb") as f:
+            position = 0
+
+            def lines():
+                nonlocal position
+                for line in f:
+                    yield line
+                    position += len(line)
+
+            for record in self._records(lines(), lambda: position):
+                ids.append(record[0])
+                offsets.append(record[1])
+                lengths.append(record[2])
+        return ids, offsets, lengths
+
+    def _index_gzip(self, fpath: str, bgzf: str) -> tuple:
+        ids, offsets, lengths = [], [], []
+        os.makedirs(path.dirname(bgzf), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.dirname(bgzf), suffix=".tmp")
+        try:
+            with gzip.open(fpath, "rb") as src, os.fdopen(fd, "wb") as dst:
+                writer = _BgzfWriter(dst)
+
+                def lines():
+                    for line in src:
+                        yield line
+                        writer.write(line)
+
+                for record in self._records(lines(), writer.tell):
+                    ids.append(record[0])
+                    offsets.append(record[1])
+                    lengths.append(record[2])
+                writer.close()
+            os.replace(tmp, bgzf)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return ids, offsets, lengths
+
+    def get(self, ids: list) -> dict:
+        """Read sequences by ID.
+
+        :param ids: IDs of the sequences.
+        :type ids: list
+
+        :return: Dictionary mapping each ID to its sequence.
+        :rtype: dict
+        """
+        wanted = pl.DataFrame({"id": ids}, schema={"id": pl.String})
+        found = wanted.join(self.entries(), on="id").sort("file", "offset")
+        missing = set(ids) - set(found["id"].to_list())
+        if missing:
+            raise KeyError(f"Not in {self.folder}: {', '.join(sorted(missing))}")
+
+        sequences = {}
+        for (fname,), group in found.group_by("file", maintain_order=True):
+            if fname.endswith(".gz"):
+                fpath = self.bgzf_path(fname)
+            else:
+                fpath = path.join(self.folder, fname)
+            with open(fpath, "rb") as f:
+                for id, offset, length in group.select(
+                    "id", "offset", "length"
+                ).iter_rows():
+                    if fname.endswith(".gz"):
+                        record = _read_bgzf(f, offset, length)
+                    else:
+                        f.seek(offset)
+                        record = f.read(length)
+                    sequences[id] = _parse_record(record)
+        return sequences
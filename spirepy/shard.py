@@ -0,0 +1,178 @@
+import glob
+import hashlib
+import heapq
+import os
+import os.path as path
+import re
+
+import polars as pl
+
+from spirepy.logger import logger
+
+
+def parse_shard(spec: str) -> tuple:
+    """Parse a shard specification of the form ``i/N``.
+
+    Shards are numbered from 0, so ``i`` must be lower than ``N``.
+
+    :param spec: The shard specification (e.g. ``3/10``).
+    :type spec: str
+
+    :return: The shard index and the number of shards.
+    :rtype: tuple
+    """
+    match = re.fullmatch(r"(\d+)/(\d+)", spec.strip())
+    if match is None or int(match[1]) >= int(match[2]):
+        raise ValueError(f"Invalid shard '{spec}', expected i/N with 0 <= i < N")
+    return int(match[1]), int(match[2])
+
+
+def shard_name(index: int, count: int) -> str:
+    """File name stem for the output of a shard.
+
+    :rtype: str
+    """
+    return f"shard-{index:05d}-of-{count:05d}"
+
+
+def _hash(key: str) -> int:
+    # Unlike hash(), this does not change between Python processes
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def partition(keys: list, count: int, weights: list = None) -> list:
+    """Split keys deterministically into ``count`` shards.
+
+    Without weights, each key goes to the shard given by its hash. With
+    weights (e.g. the expected download size of each sample), keys are
+    assigned from the heaviest to the lightest to the shard with the lowest
+    total weight so far, ties being broken by the hash of the keys. Either
+    way, the same keys and weights always give the same shards, on any
+    machine.
+
+    :param keys: Keys to split (e.g. sample IDs).
+    :type keys: list
+
+    :param count: Number of shards.
+    :type count: int
+
+    :param weights: Weight of each key, defaults to :class:`None`.
+    :type weights: list, optional
+
+    :return: List of ``count`` lists of keys, each in the original order.
+    :rtype: list
+    """
+    assignment = {}
+    if weights is None:
+        for key in keys:
+            assignment[key] = _hash(key) % count
+    else:
+        shards = [(0, i) for i in range(count)]
+        order = sorted(zip(keys, weights), key=lambda kw: (-kw[1], _hash(kw[0]), kw[0]))
+        for key, weight in order:
+            total, i = heapq.heappop(shards)
+            assignment[key] = i
+            heapq.heappush(shards, (total + weight, i))
+    result = [[] for _ in range(count)]
+    for key in keys:
+        result[assignment[key]].append(key)
+    return result
+
+
+def write_manifest(output: str, index: int, count: int, entries: list):
+    """Write the download manifest of a shard.
+
+    :param output: Output folder.
+    :type output: str
+
+    :param index: Shard index.
+    :type index: int
+
+    :param count: Number of shards.
+    :type count: int
+
+    :param entries: List of ``(item, path, bytes)`` tuples for the files written.
+    :type entries: list
+    """
+    os.makedirs(path.join(output, "manifest"), exist_ok=True)
+    pl.DataFrame(
+        entries,
+        schema={"item": pl.String, "path": pl.String, "bytes": pl.Int64},
+        orient="row",
+    ).write_csv(
+        path.join(output, "manifest", f"{shard_name(index, count)}.tsv"),
+        separator="\t",
+    )
+
+
+def _shard_files(folder: str, suffix: str) -> dict:
+    """Find the shard outputs in a folder, grouped by number of shards."""
+    found = {}
+    for fpath in glob.glob(path.join(folder, f"shard-*-of-*{suffix}")):
+        match = re.fullmatch(
+            r"shard-(\d+)-of-(\d+)" + re.escape(suffix), path.basename(fpath)
+        )
+        if match:
+            found.setdefault(int(match[2]), {})[int(match[1])] = fpath
+    return found
+
+
+def _check_complete(folder: str, found: dict) -> list:
+    files = []
+    for count, shards in sorted(found.items()):
+        missing = sorted(set(range(count)) - set(shards))
+        if missing:
+            logger.warning(
+                f"{folder}: missing shards {', '.join(map(str, missing))} of {count}"
+            )
+        files.extend(shards[i] for i in sorted(shards))
+    return files
+
+
+def merge(output: str):
+    """Combine the outputs of all shards in a folder.
+
+    Shard manifests are concatenated into ``manifest.tsv``. For each folder of
+    Parquet shard outputs, a ``_metadata`` file is written from the footers of
+    the shard files, so the folder can be read as a single dataset without
+    the data being read or copied, e.g. with
+    ``pyarrow.dataset.parquet_dataset(folder + "/_metadata")``, or with
+    ``polars.scan_parquet(folder + "/shard-*.parquet")``, which does not use
+    ``_metadata``.
+
+    :param output: Output folder shared by the shards.
+    :type output: str
+    """
+    import pyarrow.parquet as pq
+
+    manifest_dir = path.join(output, "manifest")
+    manifests = _check_complete(manifest_dir, _shard_files(manifest_dir, ".tsv"))
+    if manifests:
+        pl.concat(
+            [
+                pl.read_csv(f, separator="\t", schema_overrides={"bytes": pl.Int64})
+                for f in manifests
+            ]
+        ).write_csv(path.join(output, "manifest.tsv"), separator="\t")
+
+    for folder in sorted(glob.glob(path.join(output, "*", ""))):
+        parts = _check_complete(folder, _shard_files(folder, ".parquet"))
+        if not parts:
+            continue
+        metadata = None
+        for fpath in parts:
+            part = pq.read_metadata(fpath)
+            part.set_file_path(path.basename(fpath))
+            if metadata is None:
+                metadata = part
+            else:
+                try:
+                    metadata.append_row_groups(part)
+                except RuntimeError as e:
+                    logger.error(
+                        f"{fpath}: cannot be merged with the other shards ({e})"
+                    )
+                    metadata = None
+                    break
+        if metadata is not None:
+            metadata.write_metadata_file(path.join(folder, "_metadata"))
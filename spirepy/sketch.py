@@ -0,0 +1,323 @@
+import glob
+import gzip
+import multiprocessing
+import os
+import os.path as path
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import polars as pl
+import pyarrow as pa
+
+from spirepy import data, fasta
+from spirepy.lock import FileLock
+
+#: Length of the k-mers.
+K = 21
+
+#: One in ``SCALED`` k-mers is kept in a sketch (FracMinHash).
+SCALED = 1000
+
+#: Bases of a sequence hashed at a time, bounding the memory used by long contigs.
+CHUNK_SIZE = 1024 * 1024
+
+# 2-bit codes of the bases, with 4 for anything else (e.g. N)
+_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _bases in enumerate([b"Aa", b"Cc", b"Gg", b"Tt"]):
+    _CODES[list(_bases)] = _code
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    # splitmix64 finaliser, so that hashes are uniform over 64 bits
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _kmer_hashes(sequence: bytes) -> np.ndarray:
+    """Hash the canonical k-mers of a sequence, skipping those with ambiguous bases."""
+    codes = _CODES[np.frombuffer(sequence, dtype=np.uint8)]
+    n = len(codes) - K + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint64)
+    ambiguous = np.concatenate([[0], np.cumsum(codes == 4)])
+    valid = ambiguous[K:] == ambiguous[:-K]
+    codes = (codes & 3).astype(np.uint64)
+    forward = np.zeros(n, dtype=np.uint64)
+    reverse = np.zeros(n, dtype=np.uint64)
+    for j in range(K):
+        window = codes[j : j + n]
+        forward = (forward << np.uint64(2)) | window
+        reverse |= (np.uint64(3) - window) << np.uint64(2 * j)
+    return _mix(np.minimum(forward, reverse)[valid])
+
+
+def sketch(source) -> np.ndarray:
+    """Compute the FracMinHash sketch of a FASTA file, which may be gzipped.
+
+    The file is read one record at a time, and long records in chunks of
+    :data:`CHUNK_SIZE` bases, so that it is never fully held in memory.
+
+    :param source: Path of the file, or a binary file object.
+    :type source: str or file object
+
+    :return: Sorted array of the hashes of the sketch.
+    :rtype: :class:`numpy.ndarray`
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return sketch(f)
+    start = source.tell()
+    magic = source.read(2)
+    source.seek(start)
+    if magic == b"\x1f\x8b":
+        source = gzip.GzipFile(fileobj=source)
+    max_hash = np.uint64(min(2**64 // SCALED, 2**64 - 1))
+    kept = [np.empty(0, dtype=np.uint64)]
+    for _, sequence in fasta._records(source):
+        for i in range(0, max(len(sequence) - K + 1, 1), CHUNK_SIZE):
+            hashes = _kmer_hashes(sequence[i : i + CHUNK_SIZE + K - 1])
+            kept.append(np.unique(hashes[hashes < max_hash]))
+    return np.unique(np.concatenate(kept))
+
+
+def _write_table(table: pa.Table, fpath: str):
+    # Written as a single record batch, so that columns are read without copies
+    def write(tmp: str):
+        with pa.OSFile(tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table.combine_chunks())
+
+    data._publish(fpath, write)
+
+
+def _column(table: pa.Table, name: str) -> np.ndarray:
+    # Without copying the memory-mapped column, unless it has several chunks
+    column = table.column(name)
+    if column.num_chunks == 1:
+        return column.chunk(0).to_numpy()
+    return column.to_numpy()
+
+
+def _genome_name(fpath: str) -> str:
+    return path.basename(fpath).split(".")[0]
+
+
+def sketch_files(fpaths: list, max_workers: int = None) -> dict:
+    """Sketch FASTA files in parallel, in a process pool.
+
+    :param fpaths: Paths of the files, each holding a genome (e.g. the MAGs from :meth:`spirepy.study.Study.download_mags`).
+    :type fpaths: list
+
+    :param max_workers: Number of processes, defaults to the number of CPUs.
+    :type max_workers: int, optional
+
+    :return: Dictionary mapping each genome (the file name without directories or extensions) to its sketch.
+    :rtype: dict
+    """
+    # Forking once the Polars thread pool is running can deadlock
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        sketches = pool.map(sketch, fpaths)
+        return {_genome_name(f): s for f, s in zip(fpaths, sketches)}
+
+
+class SketchIndex:
+    """
+    A persistent index of genome sketches, for similarity search.
+
+    Sketches are added as Parquet files in ``parts``, so that several
+    processes can add to the index. On the first query after a change, they
+    are compiled to memory-mapped Arrow tables: the hashes of each genome,
+    and all hashes sorted with the genome they belong to. A query then looks
+    up each of its hashes with a binary search, and counts the hashes shared
+    with each genome.
+
+    :param root: Folder of the index, defaults to ``sketches`` in the cache directory.
+    :type root: str, optional
+    """
+
+    def __init__(self, root: str = None):
+        """Constructor method."""
+        self.root = root or path.join(data.cache_dir, "sketches")
+        self._tables = None
+        self._built = None
+
+    def __str__(self):
+        return f"SketchIndex root: {self.root}"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def _parts(self) -> list:
+        return sorted(glob.glob(path.join(self.root, "parts", "*.parquet")))
+
+    def _table_path(self, name: str) -> str:
+        return path.join(self.root, f"{name}.arrow")
+
+    def add(self, sketches: dict):
+        """Add sketches to the index, replacing those of the same genomes.
+
+        :param sketches: Dictionary mapping each genome to its sketch (see :func:`sketch`).
+        :type sketches: dict
+        """
+        if not sketches:
+            return
+        values = [np.asarray(s, dtype=np.uint64) for s in sketches.values()]
+        offsets = np.concatenate([[0], np.cumsum([len(v) for v in values])])
+        frame = pl.from_arrow(
+            pa.table(
+                {
+                    "genome": pa.array(list(sketches), pa.string()),
+                    "hashes": pa.LargeListArray.from_arrays(
+                        pa.array(offsets, pa.int64()),
+                        pa.array(np.concatenate(values), pa.uint64()),
+                    ),
+                }
+            )
+        )
+        # Part names sort in the order they were added
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex}.parquet"
+        data._write_parquet(frame, path.join(self.root, "parts", name))
+
+    def _is_stale(self) -> bool:
+        parts = self._parts()
+        fpath = self._table_path("genomes")
+        return bool(parts) and (
+            not path.exists(fpath)
+            or max(path.getmtime(p) for p in parts) > path.getmtime(fpath)
+        )
+
+    def build(self):
+        """Compile the sketches added to the index, for queries."""
+        sketches = (
+            pl.scan_parquet(self._parts(), include_file_paths="part")
+            # Keep the latest sketch of each genome
+            .sort("part")
+            .unique("genome", keep="last")
+            .sort("genome")
+            .collect()
+        )
+        genomes = sketches.select(
+            "genome", size=pl.col("hashes").list.len().cast(pl.Int64)
+        ).with_columns(start=pl.col("size").cum_sum() - pl.col("size"))
+        hashes = sketches["hashes"].explode().to_numpy()
+        del sketches
+        owners = np.repeat(
+            np.arange(genomes.height, dtype=np.uint32), genomes["size"].to_numpy()
+        )
+        order = np.argsort(hashes, kind="stable")
+        _write_table(pa.table({"hash": hashes}), self._table_path("hashes"))
+        _write_table(
+            pa.table({"hash": hashes[order], "genome": owners[order]}),
+            self._table_path("inverted"),
+        )
+        # Written last, as its modification time marks the build as done
+        _write_table(genomes.to_arrow(), self._table_path("genomes"))
+
+    def _load(self) -> dict:
+        if self._is_stale():
+            os.makedirs(self.root, exist_ok=True)
+            with FileLock(path.join(self.root, "index.lock")):
+                if self._is_stale():
+                    self.build()
+        if not path.exists(self._table_path("genomes")):
+            raise KeyError(f"No sketches in {self}")
+        built = path.getmtime(self._table_path("genomes"))
+        if self._tables is None or built != self._built:
+            self._tables = {
+                name: pa.ipc.open_file(pa.memory_map(self._table_path(name))).read_all()
+                for name in ["genomes", "hashes", "inverted"]
+            }
+            self._built = built
+        return self._tables
+
+    def genomes(self) -> pl.DataFrame:
+        """List the genomes in the index.
+
+        :return: A DataFrame with the ``genome`` and ``size`` (number of hashes) of each sketch.
+        :rtype: :class:`polars.DataFrame`
+        """
+        return pl.from_arrow(self._load()["genomes"]).select("genome", "size")
+
+    def get(self, genome: str) -> np.ndarray:
+        """Get the sketch of a genome.
+
+        :param genome: Name of the genome.
+        :type genome: str
+
+        :return: The sketch, or :class:`None` if the genome is not in the index.
+        :rtype: :class:`numpy.ndarray`
+        """
+        if not self._parts():
+            return None
+        tables = self._load()
+        names = pl.from_arrow(tables["genomes"].column("genome"))
+        i = names.search_sorted(genome)
+        if i >= len(names) or names[i] != genome:
+            return None
+        start = tables["genomes"].column("start")[i].as_py()
+        size = tables["genomes"].column("size")[i].as_py()
+        return tables["hashes"].column("hash").slice(start, size).to_numpy()
+
+    def query(
+        self, hashes: np.ndarray, k: int = 10, exclude: str = None
+    ) -> pl.DataFrame:
+        """Find the genomes most similar to a sketch.
+
+        :param hashes: The sketch (see :func:`sketch`).
+        :type hashes: :class:`numpy.ndarray`
+
+        :param k: Number of genomes to return, defaults to 10.
+        :type k: int, optional
+
+        :param exclude: Genome to leave out of the results (e.g. the genome of the sketch), defaults to :class:`None`.
+        :type exclude: str, optional
+
+        :return: A DataFrame with, for the ``k`` genomes with the highest Jaccard index (and at least one hash in common), the number of ``shared`` hashes, the ``jaccard`` index, the ``containment`` of the sketch in the genome, and the ``ani`` estimated from it; sorted by decreasing similarity.
+        :rtype: :class:`polars.DataFrame`
+        """
+        tables = self._load()
+        inverted = tables["inverted"]
+        keys = _column(inverted, "hash")
+        owners = _column(inverted, "genome")
+        sizes = _column(tables["genomes"], "size")
+
+        left = np.searchsorted(keys, hashes, side="left")
+        right = np.searchsorted(keys, hashes, side="right")
+        counts = right - left
+        # Positions of all the matching entries of the inverted index
+        positions = np.repeat(left - np.cumsum(counts) + counts, counts) + np.arange(
+            counts.sum()
+        )
+        shared = np.bincount(owners[positions], minlength=len(sizes))
+        jaccard = shared / np.maximum(len(hashes) + sizes - shared, 1)
+
+        candidates = np.nonzero(shared)[0]
+        names = pl.from_arrow(tables["genomes"].column("genome"))
+        if exclude is not None:
+            i = names.search_sorted(exclude)
+            if i < len(names) and names[i] == exclude:
+                candidates = candidates[candidates != i]
+        top = candidates[np.argsort(-jaccard[candidates], kind="stable")[:k]]
+        containment = shared[top] / max(len(hashes), 1)
+        return pl.DataFrame(
+            {
+                "genome": names.gather(top),
+                "shared": shared[top],
+                "jaccard": jaccard[top],
+                "containment": containment,
+                "ani": containment ** (1 / K),
+            },
+            schema={
+                "genome": pl.String,
+                "shared": pl.Int64,
+                "jaccard": pl.Float64,
+                "containment": pl.Float64,
+                "ani": pl.Float64,
+            },
+        )
@@ -1,12 +1,47 @@
+import io
+import multiprocessing
 import os
 import os.path as path
+import queue
 import tarfile
 import tempfile
-import urllib
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Union
 
 import polars as pl
 
-from spirepy.data import genome_metadata
+from spirepy import blobstore, fasta, metrics, scheduler, transfer
+from spirepy.data import (
+    cache_study_metadata,
+    cached_projection,
+    genome_metadata,
+    index_samples,
+    scan_genome_metadata,
+)
+from spirepy.seqindex import SequenceIndex
+from spirepy.shard import partition
+from spirepy.sketch import SketchIndex, sketch_files
+from spirepy.tarindex import TarIndex
+
+
+def _map_chunk(fn, study, rows: pl.DataFrame) -> list:
+    if isinstance(study, str):
+        # In worker processes, the study only holds the metadata of the chunk,
+        # so that it is not downloaded again
+        study = Study(study)
+        study._metadata = rows
+    samples = {s.id: s for s in study.get_samples()}
+    results = []
+    for sample_id in rows["sample_id"].to_list():
+        sample = samples[sample_id]
+        try:
+            results.append((sample_id, fn(sample), None))
+        except Exception as e:
+            results.append((sample_id, None, e))
+        finally:
+            sample.clear_cache()
+    return results
 
 
 class Study:
@@ -27,6 +62,10 @@ class Study:
         self._metadata = None
         self._samples = None
         self._mags = None
+        # Whether the cached MAGs have all the columns
+        self._mags_complete = False
+        self._mags_index = None
+        self._sequence_indexes = {}
 
     def get_metadata(self) -> pl.DataFrame:
         """Retrieve metadata for the study.
@@ -35,16 +74,35 @@ class Study:
         :rtype: :class:`polars.DataFrame`
         """
         if self._metadata is None:
-            study_meta = pl.read_csv(
-                f"https://spire.embl.de/spire/api/study/{self.name}?format=tsv",
-                separator="\t",
-            )
+            url = f"https://spire.embl.de/spire/api/study/{self.name}?format=tsv"
+            study_meta = transfer.read_tsv(url)
+            if "sample_id" in study_meta.columns:
+                index_samples(self.name, study_meta["sample_id"].to_list())
+                cache_study_metadata(self.name, study_meta)
             self._metadata = study_meta
         return self._metadata
 
+    def summary(self) -> pl.DataFrame:
+        """Get the precomputed summary of the study.
+
+        The summaries of all indexed studies are computed together and kept
+        in the cache directory (see :func:`spirepy.summary.study_summaries`).
+
+        :return: A DataFrame with the study's row of the summaries.
+        :rtype: :class:`polars.DataFrame`
+        """
+        from spirepy.summary import study_summaries
+
+        # Fetching the metadata adds the study's samples to the sample index
+        self.get_metadata()
+        return study_summaries().filter(pl.col("study") == self.name)
+
     def get_samples(self) -> list:
         """Retrive a list of samples for the study.
 
+        The metadata of each sample is taken from the study's metadata when
+        first accessed, without further requests.
+
         :return: List of :class:`spirepy.sample.Sample` that belong to the study.
         :rtype: list
         """
@@ -52,26 +110,232 @@ class Study:
 
         if self._samples is None:
             sample_list = []
-            for s in self.get_metadata()["sample_id"].to_list():
+            for row, s in enumerate(self.get_metadata()["sample_id"].to_list()):
                 sample = Sample(s, self)
+                sample._study_row = row
                 sample_list.append(sample)
             self._samples = sample_list
         return self._samples
 
-    def get_mags(self) -> pl.DataFrame:
+    def iter_samples(
+        self, methods: list = ("get_metadata",), prefetch: int = 2, samples: list = None
+    ):
+        """Iterate over the samples, downloading their data in the background.
+
+        While a sample is being processed, the data of the next ``prefetch``
+        samples is downloaded by a background thread, by calling the given
+        methods of each sample. Once processing of a sample is done (i.e. the
+        next one is requested), its downloaded data is dropped (see
+        :meth:`spirepy.sample.Sample.clear_cache`), so memory use does not grow
+        with the number of samples.
+
+        .. code-block:: python
+
+            for sample in study.iter_samples(["get_eggnog_data"], prefetch=4):
+                process(sample.get_eggnog_data())
+
+        If downloading the data of a sample fails, the error is raised when
+        that sample is reached.
+
+        :param methods: Names of the :class:`spirepy.sample.Sample` methods to call in advance, defaults to ``get_metadata``.
+        :type methods: list, optional
+
+        :param prefetch: Number of samples to download in advance, defaults to 2.
+        :type prefetch: int, optional
+
+        :param samples: Samples to iterate over, defaults to all the samples of the study.
+        :type samples: list, optional
+
+        :return: A generator of :class:`spirepy.sample.Sample`.
+        """
+        if samples is None:
+            samples = self.get_samples()
+        ready = queue.Queue(maxsize=max(prefetch, 1))
+        stop = threading.Event()
+
+        def produce():
+            for sample in samples:
+                error = None
+                try:
+                    for method in methods:
+                        getattr(sample, method)()
+                except Exception as e:
+                    error = e
+                while not stop.is_set():
+                    try:
+                        ready.put((sample, error), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            for _ in samples:
+                sample, error = ready.get()
+                if error is not None:
+                    raise error
+                yield sample
+                sample.clear_cache()
+        finally:
+            stop.set()
+
+    def shard_samples(self, index: int, count: int, weighted: bool = True) -> list:
+        """Get the samples of one shard of the study.
+
+        The samples are split deterministically into ``count`` shards, so
+        that independent jobs (e.g. the tasks of a cluster job array) can each
+        process one shard. See :func:`spirepy.shard.partition`.
+
+        :param index: Index of the shard, from 0 to ``count - 1``.
+        :type index: int
+
+        :param count: Number of shards.
+        :type count: int
+
+        :param weighted: Whether to balance the shards by the number of MAGs of each sample, as a proxy for the size of its data; defaults to :class:`True`.
+        :type weighted: bool, optional
+
+        :return: List of :class:`spirepy.sample.Sample` in the shard.
+        :rtype: list
+        """
+        samples = self.get_samples()
+        weights = None
+        if weighted:
+            mags = dict(
+                self.get_mags(columns=["derived_from_sample"])
+                .group_by("derived_from_sample")
+                .len()
+                .rows()
+            )
+            weights = [mags.get(s.id, 0) + 1 for s in samples]
+        keys = set(partition([s.id for s in samples], count, weights)[index])
+        return [s for s in samples if s.id in keys]
+
+    def map_samples(
+        self,
+        fn,
+        executor: str = "process",
+        max_workers: int = None,
+        chunksize: int = 1,
+        ordered: bool = True,
+    ):
+        """Apply a function to each sample of the study in parallel.
+
+        With the ``process`` executor, each chunk of samples is sent to a worker
+        process with their rows of the study metadata, from which the worker
+        creates its own :class:`spirepy.sample.Sample` objects. Workers are
+        started with the ``spawn`` method, so ``fn`` must be importable by them.
+        The metadata tables loaded from the cache (e.g.
+        :func:`spirepy.data.genome_metadata`) are memory-mapped, so workers
+        share them rather than each holding a copy. The ``thread`` executor is
+        better suited to functions that mostly wait for downloads.
+
+        An error raised by ``fn`` for a sample is returned along with that
+        sample, instead of stopping the whole run. When a whole chunk fails
+        (e.g. its worker process dies, or its results cannot be pickled), the
+        error is returned for each of its samples.
+
+        .. code-block:: python
+
+            for sample_id, n_genes, error in study.map_samples(count_genes):
+                ...
+
+        :param fn: Function called with each :class:`spirepy.sample.Sample`. With the ``process`` executor, it must be picklable (e.g. defined at the top level of a module), as must its results.
+        :type fn: callable
+
+        :param executor: Either ``process`` or ``thread``, defaults to ``process``.
+        :type executor: str, optional
+
+        :param max_workers: Number of workers, defaults to the executor's default.
+        :type max_workers: int, optional
+
+        :param chunksize: Number of samples sent to a worker at once, defaults to 1.
+        :type chunksize: int, optional
+
+        :param ordered: Whether results are returned in the order of the samples, rather than as they complete; defaults to :class:`True`.
+        :type ordered: bool, optional
+
+        :return: A generator of ``(sample_id, result, error)`` tuples, where ``error`` is the exception raised for the sample or :class:`None`.
+        """
+        if executor == "process":
+            # Forking once the Polars thread pool is running can deadlock
+            pool = ProcessPoolExecutor(
+                max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            study = self.name
+        elif executor == "thread":
+            pool = ThreadPoolExecutor(max_workers)
+            study = self
+        else:
+            raise ValueError(
+                f"Unknown executor '{executor}', please choose one of the following: process, thread"
+            )
+        metadata = self.get_metadata()
+        try:
+            futures = {}
+            for i in range(0, metadata.height, chunksize):
+                rows = metadata.slice(i, chunksize)
+                future = pool.submit(_map_chunk, fn, study, rows)
+                futures[future] = rows["sample_id"].to_list()
+            for future in futures if ordered else as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    results = [(sample_id, None, e) for sample_id in futures[future]]
+                yield from results
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+    def get_mags(
+        self, columns: list = None, filter: Union[str, pl.Expr] = None
+    ) -> pl.DataFrame:
         """Get a DataFrame with information regarding the MAGs.
 
+        :param columns: Columns to return, defaults to all columns. Only these columns (and those used by ``filter``) are read, and they are kept for later calls.
+        :type columns: list, optional
+
+        :param filter: Polars expression or SQL expression (e.g. ``"completeness > 90"``) the rows must match, defaults to :class:`None`.
+        :type filter: str or :class:`polars.Expr`, optional
+
         :return: A Dataframe with the study's MAGs.
         :rtype: :class:`polars.DataFrame`
         """
-        if self._mags is None:
-            genomes = genome_metadata()
-            self._mags = genomes.filter(
-                pl.col("derived_from_sample").is_in(
-                    self.get_metadata()["sample_id"].to_list()
-                )
+
+        def fetch(columns: list) -> pl.DataFrame:
+            samples = pl.col("derived_from_sample").is_in(
+                self.get_metadata()["sample_id"].to_list()
             )
-        return self._mags
+            if columns is None:
+                return genome_metadata().filter(samples)
+            # Only the needed columns are read from the cached genome metadata
+            return scan_genome_metadata().filter(samples).select(columns).collect()
+
+        self._mags, self._mags_complete, mags = cached_projection(
+            self._mags, self._mags_complete, fetch, columns, filter
+        )
+        return mags
+
+    @staticmethod
+    def _retrieve(url: str, fpath: str):
+        with metrics.fetch(url) as event:
+            scheduler.retrieve(url, fpath, priority=scheduler.BULK)
+            if metrics.enabled():
+                event["bytes"] = path.getsize(fpath)
+
+    def _download_tar(self, url: str, tarname: str, output: str, folder: str):
+        store = blobstore.default_store()
+        if store is not None:
+            store.fetch_tar(url, path.join(output, folder), self._retrieve)
+            return
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tarfpath = path.join(tmpdir, tarname)
+            self._retrieve(url, tarfpath)
+            os.makedirs(output, exist_ok=True)
+            with tarfile.open(tarfpath) as tar:
+                tar.extractall(path.join(output, folder))
 
     def download_assemblies(self, output: str):
         """Download the assemblies into a specified folder.
@@ -79,15 +343,12 @@ class Study:
         :param output: Output folder to download the assemblies to.
         :type output: str
         """
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tarfpath = path.join(tmpdir, f"{self.name}_assemblies.tar")
-            urllib.request.urlretrieve(
-                f"https://swifter.embl.de/~fullam/spire/compiled/{self.name}_spire_v1_assemblies.tar",
-                tarfpath,
-            )
-            os.makedirs(output, exist_ok=True)
-            with tarfile.open(tarfpath) as tar:
-                tar.extractall(path.join(output, "assemblies"))
+        self._download_tar(
+            f"https://swifter.embl.de/~fullam/spire/compiled/{self.name}_spire_v1_assemblies.tar",
+            f"{self.name}_assemblies.tar",
+            output,
+            "assemblies",
+        )
 
     def download_mags(self, output: str):
         """Download the MAGs into a specified folder.
@@ -95,15 +356,51 @@ class Study:
         :param output: Output folder to download the MAGs to.
         :type output: str
         """
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tarfpath = path.join(tmpdir, f"{self.name}_mags.tar")
-            urllib.request.urlretrieve(
-                f"https://swifter.embl.de/~fullam/spire/compiled/{self.name}_spire_v1_MAGs.tar",
-                tarfpath,
-            )
-            os.makedirs(output, exist_ok=True)
-            with tarfile.open(tarfpath) as tar:
-                tar.extractall(path.join(output, "mags"))
+        self._download_tar(self._mags_url(), f"{self.name}_mags.tar", output, "mags")
+
+    def _mags_url(self) -> str:
+        return f"https://swifter.embl.de/~fullam/spire/compiled/{self.name}_spire_v1_MAGs.tar"
+
+    def mags_index(self) -> TarIndex:
+        """Get the index of the study's MAGs archive.
+
+        :return: The index of the archive downloaded by :meth:`download_mags`.
+        :rtype: :class:`spirepy.tarindex.TarIndex`
+        """
+        if self._mags_index is None:
+            self._mags_index = TarIndex(self._mags_url())
+        return self._mags_index
+
+    def fetch_members(self, names: list, tarball: str = None) -> dict:
+        """Fetch individual files from the study's MAGs archive.
+
+        Only the bytes of the requested files are downloaded, using the cached
+        index of the archive (see :meth:`mags_index`).
+
+        :param names: Names of the files in the archive, or the SPIRE IDs of the MAGs.
+        :type names: list
+
+        :param tarball: Path to a local copy of the archive to read from instead, defaults to :class:`None`.
+        :type tarball: str, optional
+
+        :return: Dictionary mapping each name to the (gzipped FASTA) file content.
+        :rtype: dict
+        """
+        return self.mags_index().read(names, tarball)
+
+    def open_mag(self, spire_id: str, tarball: str = None) -> io.BytesIO:
+        """Open a single MAG without downloading the whole archive.
+
+        :param spire_id: SPIRE ID of the MAG.
+        :type spire_id: str
+
+        :param tarball: Path to a local copy of the archive to read from instead, defaults to :class:`None`.
+        :type tarball: str, optional
+
+        :return: The gzipped FASTA file of the MAG.
+        :rtype: :class:`io.BytesIO`
+        """
+        return io.BytesIO(self.fetch_members([spire_id], tarball)[spire_id])
 
     def download_genecalls(self, output: str):
         """Download the genecalls into a specified folder.
@@ -111,15 +408,12 @@ class Study:
         :param output: Output folder to download the genecalls to.
         :type output: str
         """
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tarfpath = path.join(tmpdir, f"{self.name}_genecalls.tar")
-            urllib.request.urlretrieve(
-                f"https://swifter.embl.de/~fullam/spire/genes_per_study/{self.name}_spire_v1_genecalls_fna.tar",
-                tarfpath,
-            )
-            os.makedirs(output, exist_ok=True)
-            with tarfile.open(tarfpath) as tar:
-                tar.extractall(path.join(output, "genecalls"))
+        self._download_tar(
+            f"https://swifter.embl.de/~fullam/spire/genes_per_study/{self.name}_spire_v1_genecalls_fna.tar",
+            f"{self.name}_genecalls.tar",
+            output,
+            "genecalls",
+        )
 
     def download_proteins(self, output: str):
         """Download the proteins into a specified folder.
@@ -127,12 +421,94 @@ class Study:
         :param output: Output folder to download the proteins to.
         :type output: str
         """
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tarfpath = path.join(tmpdir, f"{self.name}_genecalls.tar")
-            urllib.request.urlretrieve(
-                f"https://swifter.embl.de/~fullam/spire/genes_per_study/{self.name}_spire_v1_proteins_faa.tar",
-                tarfpath,
+        self._download_tar(
+            f"https://swifter.embl.de/~fullam/spire/genes_per_study/{self.name}_spire_v1_proteins_faa.tar",
+            f"{self.name}_genecalls.tar",
+            output,
+            "proteins",
+        )
+
+    def get_sequences(self, ids: list, output: str, kind: str = "genecalls") -> dict:
+        """Look up gene or protein sequences by ID in the downloaded files.
+
+        The files are indexed the first time (see
+        :class:`spirepy.seqindex.SequenceIndex`), so that each sequence is then
+        read directly from its file.
+
+        :param ids: IDs of the sequences.
+        :type ids: list
+
+        :param output: Output folder given to :meth:`download_genecalls` or :meth:`download_proteins`.
+        :type output: str
+
+        :param kind: Either ``genecalls`` or ``proteins``, defaults to ``genecalls``.
+        :type kind: str, optional
+
+        :return: Dictionary mapping each ID to its sequence.
+        :rtype: dict
+        """
+        if kind not in ("genecalls", "proteins"):
+            raise ValueError(f"Unknown kind of sequences: {kind}")
+        folder = path.join(output, kind)
+        if folder not in self._sequence_indexes:
+            self._sequence_indexes[folder] = SequenceIndex(folder)
+        return self._sequence_indexes[folder].get(ids)
+
+    def sequences_to_parquet(self, output: str, kind: str = "mags") -> str:
+        """Convert downloaded FASTA files to Parquet (see :func:`spirepy.fasta.to_parquet`).
+
+        :param output: Output folder given to :meth:`download_mags`, :meth:`download_genecalls` or :meth:`download_proteins`.
+        :type output: str
+
+        :param kind: Either ``mags``, ``genecalls`` or ``proteins``, defaults to ``mags``.
+        :type kind: str, optional
+
+        :return: The path of the Parquet file, ``<kind>.parquet`` in the output folder.
+        :rtype: str
+        """
+        if kind not in ("mags", "genecalls", "proteins"):
+            raise ValueError(f"Unknown kind of sequences: {kind}")
+        samples = {s: s for s in self.get_metadata()["sample_id"].to_list()}
+        if kind == "mags":
+            samples.update(
+                self.get_mags().select("spire_id", "derived_from_sample").iter_rows()
             )
-            os.makedirs(output, exist_ok=True)
-            with tarfile.open(tarfpath) as tar:
-                tar.extractall(path.join(output, "proteins"))
+        return fasta.to_parquet(
+            path.join(output, kind), path.join(output, f"{kind}.parquet"), samples
+        )
+
+    def get_mag_stats(self, output: str) -> pl.DataFrame:
+        """Compute the length, GC content and N50 of the downloaded MAGs.
+
+        The MAGs are converted to Parquet first if needed (see :meth:`sequences_to_parquet`).
+
+        :param output: Output folder given to :meth:`download_mags`.
+        :type output: str
+
+        :return: A Dataframe with the study's MAGs (see :meth:`get_mags`) and their statistics (see :func:`spirepy.fasta.genome_stats`).
+        :rtype: :class:`polars.DataFrame`
+        """
+        fpath = path.join(output, "mags.parquet")
+        if not path.exists(fpath):
+            self.sequences_to_parquet(output, "mags")
+        stats = fasta.genome_stats(fasta.sequence_stats(fpath)).drop("sample")
+        return self.get_mags().join(
+            stats, left_on="spire_id", right_on="genome", how="left"
+        )
+
+    def sketch_mags(
+        self, output: str, index: SketchIndex = None, max_workers: int = None
+    ):
+        """Sketch the downloaded MAGs in parallel and add them to a sketch index.
+
+        :param output: Output folder given to :meth:`download_mags`.
+        :type output: str
+
+        :param index: Index to add the sketches to, defaults to the index in the cache directory.
+        :type index: :class:`spirepy.sketch.SketchIndex`, optional
+
+        :param max_workers: Number of processes, defaults to the number of CPUs.
+        :type max_workers: int, optional
+        """
+        fpaths = fasta._fasta_files(path.join(output, "mags"))
+        (index or SketchIndex()).add(sketch_files(fpaths, max_workers))
@@ -0,0 +1,207 @@
+import json
+import os.path as path
+
+import polars as pl
+
+from spirepy import data
+from spirepy.lock import FileLock
+
+#: Column with the GTDB classification (``d__...;p__...;...``) of genomes or clusters.
+TAXONOMY_COLUMN = "classification"
+
+#: Number of phyla kept in the taxonomic composition of each study.
+TOP_PHYLA = 10
+
+_schema = {
+    "study": pl.String,
+    "samples": pl.UInt32,
+    "samples_with_mags": pl.UInt32,
+    "mags": pl.UInt32,
+    "clusters": pl.UInt32,
+    "high_quality": pl.UInt32,
+    "medium_quality": pl.UInt32,
+    "completeness_mean": pl.Float64,
+    "completeness_q25": pl.Float64,
+    "completeness_median": pl.Float64,
+    "completeness_q75": pl.Float64,
+    "contamination_mean": pl.Float64,
+    "contamination_median": pl.Float64,
+    "phyla": pl.List(pl.Struct({"phylum": pl.String, "mags": pl.UInt32})),
+}
+
+
+def _summary_path(release: str) -> str:
+    return path.join(data.cache_dir, release, "study_summary.parquet")
+
+
+def _state_path(release: str) -> str:
+    return path.join(data.cache_dir, release, "study_summary.json")
+
+
+def _write_state(fpath: str, fetched: float):
+    with open(fpath, "w") as f:
+        json.dump({"genome_metadata": fetched}, f)
+
+
+def _scan_genomes(release: str) -> pl.LazyFrame:
+    genomes = data.scan_genome_metadata(release)
+    if TAXONOMY_COLUMN not in genomes.collect_schema().names():
+        # Take the classification of the genome's cluster instead
+        clusters = data.scan_cluster_metadata(release)
+        if {"spire_cluster", TAXONOMY_COLUMN} <= set(clusters.collect_schema().names()):
+            genomes = genomes.join(
+                clusters.select("spire_cluster", TAXONOMY_COLUMN),
+                on="spire_cluster",
+                how="left",
+            )
+    return genomes
+
+
+def compute_summaries(
+    studies: list = None, release: str = data.RELEASE
+) -> pl.DataFrame:
+    """Compute the per-study aggregates in one pass over the cached metadata.
+
+    MAGs are attributed to studies with the sample index (see
+    :func:`spirepy.data.sample_index`), so only indexed studies are
+    summarised.
+
+    :param studies: Names of the studies to summarise, defaults to all indexed studies.
+    :type studies: list, optional
+
+    :param release: SPIRE release, defaults to :data:`spirepy.data.RELEASE`.
+    :type release: str, optional
+
+    :return: A DataFrame with a row per study (see :func:`study_summaries`).
+    :rtype: :class:`polars.DataFrame`
+    """
+    index = data.sample_index()
+    if studies is not None:
+        index = index.filter(pl.col("study").is_in(studies))
+    genomes = _scan_genomes(release)
+    names = genomes.collect_schema().names()
+    genomes = genomes.join(
+        index.lazy(), left_on="derived_from_sample", right_on="sample_id"
+    )
+
+    completeness, contamination = pl.col("completeness"), pl.col("contamination")
+    aggregates = [
+        pl.len().alias("mags"),
+        pl.col("derived_from_sample").n_unique().alias("samples_with_mags"),
+    ]
+    if "spire_cluster" in names:
+        aggregates.append(pl.col("spire_cluster").n_unique().alias("clusters"))
+    if {"completeness", "contamination"} <= set(names):
+        high = (completeness > 90) & (contamination < 5)
+        medium = (completeness >= 50) & (contamination < 10) & ~high
+        aggregates += [
+            high.sum().alias("high_quality"),
+            medium.sum().alias("medium_quality"),
+            completeness.mean().alias("completeness_mean"),
+            completeness.quantile(0.25).alias("completeness_q25"),
+            completeness.median().alias("completeness_median"),
+            completeness.quantile(0.75).alias("completeness_q75"),
+            contamination.mean().alias("contamination_mean"),
+            contamination.median().alias("contamination_median"),
+        ]
+    queries = [genomes.group_by("study").agg(aggregates)]
+    if TAXONOMY_COLUMN in genomes.collect_schema().names():
+        queries.append(
+            genomes.with_columns(
+                phylum=pl.col(TAXONOMY_COLUMN).str.extract(r"(?:^|;)\s*(p__[^;]*)")
+            )
+            .group_by("study", "phylum")
+            .agg(mags=pl.len())
+            .sort("mags", "phylum", descending=[True, False])
+            .group_by("study")
+            .agg(phyla=pl.struct("phylum", "mags").head(TOP_PHYLA))
+        )
+    # Both queries share the scan and join, which are only run once
+    frames = pl.collect_all(queries)
+
+    summary = index.group_by("study").agg(samples=pl.len())
+    for frame in frames:
+        summary = summary.join(frame, on="study", how="left")
+    return (
+        summary.with_columns(
+            pl.lit(None, dtype).alias(name)
+            for name, dtype in _schema.items()
+            if name not in summary.columns
+        )
+        .select(pl.col(name).cast(dtype) for name, dtype in _schema.items())
+        .with_columns(
+            pl.col(
+                "samples_with_mags", "mags", "high_quality", "medium_quality"
+            ).fill_null(0)
+        )
+        .sort("study")
+    )
+
+
+def study_summaries(release: str = data.RELEASE) -> pl.DataFrame:
+    """Load the per-study summaries, updating them first if needed.
+
+    The summaries are kept as Parquet in the cache directory. They are
+    computed again for all studies when the cached genome metadata has been
+    downloaded again, and otherwise only for the studies whose samples have
+    changed in the sample index, as told by a hash of their sample IDs.
+
+    :param release: SPIRE release, defaults to :data:`spirepy.data.RELEASE`.
+    :type release: str, optional
+
+    :return: A DataFrame with, for each study, its number of ``samples``,
+        ``samples_with_mags``, ``mags`` and ``clusters``, its number of
+        ``high_quality`` and ``medium_quality`` MAGs, the distribution of their
+        ``completeness`` and ``contamination``, and its most common ``phyla``.
+    :rtype: :class:`polars.DataFrame`
+    """
+    fpath = _summary_path(release)
+    # Make sure the genome metadata is cached, to know when it was fetched
+    data.genome_metadata.path(release)
+    fetched = data.genome_metadata.fetched(release)
+    samples = (
+        data.sample_index()
+        .group_by("study")
+        .agg(
+            # Changes when samples are added, removed or replaced
+            samples_hash=pl.col("sample_id")
+            .sort()
+            .str.join("\n")
+            .hash(seed=0)
+        )
+    )
+    with FileLock(fpath + ".lock"):
+        try:
+            with open(_state_path(release)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        if (
+            path.exists(fpath)
+            and state.get("genome_metadata") == fetched
+            and "samples_hash" in pl.read_parquet_schema(fpath)
+        ):
+            summary = pl.read_parquet(fpath)
+            changed = (
+                samples.join(summary, on=["study", "samples_hash"], how="anti")
+                .get_column("study")
+                .sort()
+                .to_list()
+            )
+            if not changed:
+                return summary.drop("samples_hash")
+            summary = pl.concat(
+                [
+                    summary.filter(~pl.col("study").is_in(changed)),
+                    compute_summaries(changed, release).join(
+                        samples, on="study", maintain_order="left"
+                    ),
+                ]
+            ).sort("study")
+        else:
+            summary = compute_summaries(release=release).join(
+                samples, on="study", maintain_order="left"
+            )
+        data._write_parquet(summary, fpath)
+        data._publish(_state_path(release), lambda tmp: _write_state(tmp, fetched))
+    return summary.drop("samples_hash")
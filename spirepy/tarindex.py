@@ -0,0 +1,216 @@
+import io
+import os.path as path
+import tarfile
+import urllib.error
+import urllib.request
+
+import polars as pl
+
+from spirepy import data, metrics, scheduler
+from spirepy.lock import FileLock
+
+#: Bytes read ahead by each range request while walking the archive headers.
+BLOCK_SIZE = 64 * 1024
+
+#: Largest gap between requested members that is fetched rather than skipped.
+MAX_GAP = 1024 * 1024
+
+
+def _read_range(url: str, start: int, end: int) -> bytes:
+    """Fetch bytes ``start`` to ``end`` (exclusive) of a remote file."""
+    request = urllib.request.Request(url, headers={"Range": f"bytes={start}-{end - 1}"})
+    with metrics.fetch(url, range=(start, end)) as event:
+        try:
+            with scheduler.urlopen(request, timeout=60) as response:
+                if response.status != 206:
+                    raise OSError(f"{url} does not support range requests")
+                content = response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 416:
+                # Range starts past the end of the file
+                event["status"] = 416
+                return b""
+            raise
+        event["status"] = 206
+        event["bytes"] = len(content)
+    return content
+
+
+class _RangeReader(io.RawIOBase):
+    """
+    A seekable, read-only file over a remote file, using range requests.
+
+    Each request reads at least :data:`BLOCK_SIZE` bytes ahead, and reads that
+    fall in the bytes already fetched, such as the headers of consecutive
+    small members, are served from them, whether or not the file was sought
+    in between.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.pos = 0
+        self._start = 0
+        self._block = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        else:
+            raise io.UnsupportedOperation("cannot seek from the end of a remote file")
+        return self.pos
+
+    def readinto(self, b) -> int:
+        read = 0
+        while read < len(b):
+            offset = self.pos - self._start
+            if not 0 <= offset < len(self._block):
+                end = self.pos + max(len(b) - read, BLOCK_SIZE)
+                self._start, self._block = self.pos, _read_range(
+                    self.url, self.pos, end
+                )
+                offset = 0
+                if not self._block:
+                    break
+            chunk = self._block[offset : offset + len(b) - read]
+            b[read : read + len(chunk)] = chunk
+            read += len(chunk)
+            self.pos += len(chunk)
+        return read
+
+
+class TarIndex:
+    """
+    An index of the members of a remote, uncompressed tar archive.
+
+    The index maps each member to the offset and size of its data in the
+    archive. It is built once by walking the archive headers with HTTP range
+    requests, reading ahead so that consecutive headers are fetched together,
+    and is then cached as Parquet. Members can then be read without
+    downloading the whole archive, either with range requests or by seeking
+    in a local copy of the archive.
+
+    :param url: URL of the tar archive.
+    :type url: str
+    """
+
+    def __init__(self, url: str):
+        """Constructor method."""
+        self.url = url
+        self._members = None
+
+    def __str__(self):
+        return f"TarIndex url: {self.url}"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def _path(self) -> str:
+        return path.join(
+            data.cache_dir, "tar_index", f"{path.basename(self.url)}.parquet"
+        )
+
+    def members(self) -> pl.DataFrame:
+        """Load the index, building it first if needed.
+
+        :return: A DataFrame with the ``name``, ``key`` (file name without
+            directories or extensions), ``offset`` and ``size`` of each member.
+        :rtype: :class:`polars.DataFrame`
+        """
+        if self._members is None:
+            if not path.exists(self._path()):
+                # Only one process walks the archive, the others wait for its index
+                with FileLock(self._path() + ".lock"):
+                    if not path.exists(self._path()):
+                        index = self.build(_RangeReader(self.url))
+                        data._write_parquet(index, self._path())
+            self._members = pl.read_parquet(self._path())
+        return self._members
+
+    @staticmethod
+    def build(fileobj) -> pl.DataFrame:
+        """Build the index of a tar archive.
+
+        :param fileobj: The seekable tar archive.
+        :type fileobj: file object
+
+        :return: A DataFrame with the index (see :meth:`members`).
+        :rtype: :class:`polars.DataFrame`
+        """
+        names, offsets, sizes = [], [], []
+        with tarfile.open(fileobj=fileobj, mode="r:") as tar:
+            for member in tar:
+                if member.isfile():
+                    names.append(member.name)
+                    offsets.append(member.offset_data)
+                    sizes.append(member.size)
+        return pl.DataFrame(
+            {"name": names, "offset": offsets, "size": sizes},
+            schema={"name": pl.String, "offset": pl.Int64, "size": pl.Int64},
+        ).with_columns(
+            key=pl.col("name").str.split("/").list.last().str.split(".").list.first()
+        )
+
+    def read(self, names: list, tarball: str = None) -> dict:
+        """Read members of the archive.
+
+        Members that are close together in the archive are fetched with a
+        single range request.
+
+        :param names: Names of the members, or their keys (file names without directories or extensions).
+        :type names: list
+
+        :param tarball: Path to a local copy of the archive to read from instead of the remote one, defaults to :class:`None`.
+        :type tarball: str, optional
+
+        :return: Dictionary mapping each of the given names to the member's content.
+        :rtype: dict
+        """
+        members = self.members()
+        wanted = pl.DataFrame({"wanted": names}, schema={"wanted": pl.String})
+        found = pl.concat(
+            [
+                wanted.join(members, left_on="wanted", right_on="name").with_columns(
+                    name=pl.col("wanted")
+                ),
+                wanted.join(members, left_on="wanted", right_on="key"),
+            ],
+            how="diagonal",
+        ).sort("offset")
+        missing = set(names) - set(found["wanted"].to_list())
+        if missing:
+            raise KeyError(f"Not in {self.url}: {', '.join(sorted(missing))}")
+
+        contents = {}
+        if tarball is not None:
+            with open(tarball, "rb") as f:
+                for wanted_name, offset, size in found.select(
+                    "wanted", "offset", "size"
+                ).iter_rows():
+                    f.seek(offset)
+                    contents[wanted_name] = f.read(size)
+            return contents
+
+        rows = found.select("wanted", "offset", "size").rows()
+        start = 0
+        while start < len(rows):
+            end = start + 1
+            while end < len(rows) and rows[end][1] - sum(rows[end - 1][1:]) <= MAX_GAP:
+                end += 1
+            group = rows[start:end]
+            first = group[0][1]
+            content = _read_range(self.url, first, sum(group[-1][1:]))
+            for wanted_name, offset, size in group:
+                contents[wanted_name] = content[offset - first : offset - first + size]
+            start = end
+        return contents
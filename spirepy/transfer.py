@@ -0,0 +1,166 @@
+import queue
+import threading
+import urllib.request
+import zlib
+
+import polars as pl
+
+from spirepy import metrics, scheduler
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#: Bytes of the response read from the connection at a time.
+READ_SIZE = 256 * 1024
+
+#: Bytes of decoded text parsed at a time.
+BATCH_SIZE = 8 * 1024 * 1024
+
+# Decoded chunks waiting to be parsed, bounding the memory held ahead of the parser
+_QUEUE_SIZE = 64
+
+
+def accept_encoding() -> str:
+    """The content encodings that can be decoded, for ``Accept-Encoding``.
+
+    zstd is only offered when the ``zstandard`` package is installed.
+
+    :rtype: str
+    """
+    return "zstd, gzip" if zstandard is not None else "gzip"
+
+
+class _Identity:
+    def decompress(self, chunk: bytes) -> bytes:
+        return chunk
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _decoder(encoding: str):
+    encoding = (encoding or "identity").strip().lower()
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    if encoding == "identity":
+        return _Identity()
+    raise OSError(f"Unsupported content encoding: {encoding}")
+
+
+def _produce(response, out: queue.Queue, event: dict):
+    # Runs in a thread, so that the next bytes are received and decoded while
+    # the previous ones are parsed
+    try:
+        decoder = _decoder(response.headers.get("Content-Encoding"))
+        received = 0
+        while chunk := response.read(READ_SIZE):
+            received += len(chunk)
+            out.put(decoder.decompress(chunk))
+        out.put(decoder.flush())
+        event["bytes"] = received
+        out.put(None)
+    except BaseException as e:
+        out.put(e)
+
+
+def _batches(chunks):
+    """Split a stream of text into batches of whole lines, each with the header."""
+    buffer = bytearray()
+    header = None
+    first = True
+    for chunk in chunks:
+        buffer += chunk
+        if header is None:
+            end = buffer.find(b"\n")
+            if end < 0:
+                continue
+            header = bytes(buffer[: end + 1])
+            del buffer[: end + 1]
+        if len(buffer) >= BATCH_SIZE:
+            end = buffer.rfind(b"\n")
+            if end >= 0:
+                yield header + buffer[: end + 1]
+                del buffer[: end + 1]
+                first = False
+    if header is None:
+        yield bytes(buffer)
+    elif buffer or first:
+        yield header + buffer
+
+
+def _parse(batches, options: dict):
+    schema = None
+    for batch in batches:
+        if schema is None:
+            frame = pl.read_csv(batch, separator="\t", **options)
+            schema = frame.schema
+        else:
+            try:
+                # Keep the types inferred from the first batch
+                frame = pl.read_csv(
+                    batch, separator="\t", schema_overrides=schema, **options
+                )
+            except pl.exceptions.ComputeError:
+                # They do not fit this batch, so they are widened when concatenated
+                frame = pl.read_csv(batch, separator="\t", **options)
+        yield frame
+
+
+def read_tsv(url: str, columns: list = None) -> pl.DataFrame:
+    """Download a TSV file and parse it as it is received.
+
+    The file is requested compressed (see :func:`accept_encoding`) and decoded
+    in a background thread, while the decoded lines are parsed in batches of
+    about :data:`BATCH_SIZE` bytes. Column types are inferred from the first
+    batch, and widened when a later batch does not fit them.
+
+    :param url: URL of the file.
+    :type url: str
+
+    :param columns: Columns to parse, defaults to all columns.
+    :type columns: list, optional
+
+    :return: A DataFrame with the content of the file.
+    :rtype: :class:`polars.DataFrame`
+    """
+    request = urllib.request.Request(
+        url, headers={"Accept-Encoding": accept_encoding()}
+    )
+    options = {} if columns is None else {"columns": columns}
+    with metrics.fetch(url) as event:
+        with scheduler.urlopen(request, scheduler.METADATA) as response:
+            event["status"] = response.status
+            event["encoding"] = response.headers.get("Content-Encoding", "identity")
+            chunks = queue.Queue(maxsize=_QUEUE_SIZE)
+            producer = threading.Thread(
+                target=_produce, args=(response, chunks, event), daemon=True
+            )
+            producer.start()
+
+            def received():
+                while (chunk := chunks.get()) is not None:
+                    if isinstance(chunk, BaseException):
+                        raise chunk
+                    yield chunk
+
+            try:
+                with metrics.timed("parse", source=url, rows=None) as parsed:
+                    frames = list(_parse(_batches(received()), options))
+                    frame = pl.concat(frames, how="vertical_relaxed")
+                    parsed["rows"] = frame.height
+            finally:
+                # Unblock the producer if parsing failed
+                while producer.is_alive():
+                    try:
+                        chunks.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                producer.join()
+        event["rows"] = frame.height
+    return frame
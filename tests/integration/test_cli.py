@@ -1,7 +1,20 @@
+import contextlib
+import io
+import json
+import shlex
+import subprocess
+import sys
+import tempfile
+import textwrap
 import unittest
 from unittest.mock import patch, MagicMock
 
+import polars as pl
+
+from spirepy import Sample, Study
 from spirepy.cli.spire import main
+from spirepy.cli.download import download
+from spirepy.cli.view import view
 
 
 class TestSpireCliMain(unittest.TestCase):
@@ -19,6 +32,16 @@ class TestSpireCliMain(unittest.TestCase):
         mock_args = MagicMock()
         mock_args.is_sample = True
         mock_args.is_study = False
+        mock_args.profile = False
+        mock_args.shard = None
+        mock_args.dedup = False
+        mock_args.limit_rate = None
+        mock_args.max_connections = None
+        mock_args.progress = False
+        mock_args.columns = None
+        mock_args.where = None
+        mock_args.limit = None
+        mock_args.output_format = None
         mock_args.action = "view"
         mock_args.target = "metadata"
         mock_args.input = [sample_id]
@@ -30,7 +53,15 @@ class TestSpireCliMain(unittest.TestCase):
         main()
 
         MockSample.assert_called_once_with(id=sample_id)
-        mock_maincall.assert_called_once_with(mock_sample_instance, "view", "metadata")
+        mock_maincall.assert_called_once_with(
+            mock_sample_instance,
+            "view",
+            "metadata",
+            columns=None,
+            where=None,
+            limit=None,
+            output_format=None,
+        )
 
     @patch("spirepy.cli.spire.maincall")
     @patch("spirepy.cli.spire.argparse.ArgumentParser.parse_args")
@@ -47,6 +78,16 @@ class TestSpireCliMain(unittest.TestCase):
         mock_args = MagicMock()
         mock_args.is_sample = False
         mock_args.is_study = True
+        mock_args.profile = False
+        mock_args.shard = None
+        mock_args.dedup = False
+        mock_args.limit_rate = None
+        mock_args.max_connections = None
+        mock_args.progress = False
+        mock_args.columns = None
+        mock_args.where = None
+        mock_args.limit = None
+        mock_args.output_format = None
         mock_args.action = "download"
         mock_args.target = "mags"
         mock_args.input = [study_name]
@@ -60,7 +101,7 @@ class TestSpireCliMain(unittest.TestCase):
 
         MockStudy.assert_called_once_with(name=study_name)
         mock_maincall.assert_called_once_with(
-            mock_study_instance, "download", "mags", output_dir
+            mock_study_instance, "download", "mags", output_dir, None
         )
 
     @patch("spirepy.cli.spire.maincall")
@@ -74,6 +115,16 @@ class TestSpireCliMain(unittest.TestCase):
         mock_args = MagicMock()
         mock_args.is_sample = False
         mock_args.is_study = False
+        mock_args.profile = False
+        mock_args.shard = None
+        mock_args.dedup = False
+        mock_args.limit_rate = None
+        mock_args.max_connections = None
+        mock_args.progress = False
+        mock_args.columns = None
+        mock_args.where = None
+        mock_args.limit = None
+        mock_args.output_format = None
         mock_args.action = "view"
         mock_args.target = "mags"
         mock_args.input = [study_name]
@@ -85,7 +136,170 @@ class TestSpireCliMain(unittest.TestCase):
         main()
 
         MockStudy.assert_called_once_with(name=study_name)
-        mock_maincall.assert_called_once_with(mock_study_instance, "view", "mags")
+        mock_maincall.assert_called_once_with(
+            mock_study_instance,
+            "view",
+            "mags",
+            columns=None,
+            where=None,
+            limit=None,
+            output_format=None,
+        )
+
+    @patch("spirepy.cli.spire.maincall")
+    def test_main_rejects_unsupported_shard(self, mock_maincall):
+        """
+        Tests that `--shard` is rejected for samples, views and targets that
+        are not sharded.
+        """
+        for argv in (
+            ["--shard", "0/2", "--sample", "download", "mags", "SAMPLE_ID_1"],
+            ["--shard", "0/2", "view", "metadata", "STUDY_ID_X"],
+            ["--shard", "0/2", "download", "metadata", "STUDY_ID_X"],
+        ):
+            with self.subTest(argv=argv):
+                stderr = io.StringIO()
+                with patch("sys.argv", ["spire", *argv]):
+                    with contextlib.redirect_stderr(stderr):
+                        with self.assertRaises(SystemExit):
+                            main()
+                self.assertIn("--shard only applies", stderr.getvalue())
+        mock_maincall.assert_not_called()
+
+    @patch("spirepy.cli.spire.maincall")
+    def test_main_rejects_invalid_shard(self, mock_maincall):
+        """Tests that an invalid `--shard` is reported as a usage error."""
+        stderr = io.StringIO()
+        argv = ["spire", "--shard", "5/2", "download", "eggnog", "STUDY_ID_X"]
+        with patch("sys.argv", argv):
+            with contextlib.redirect_stderr(stderr):
+                with self.assertRaises(SystemExit):
+                    main()
+        self.assertIn("Invalid shard '5/2'", stderr.getvalue())
+        mock_maincall.assert_not_called()
+
+    @patch("spirepy.cli.spire.maincall")
+    def test_main_rejects_invalid_max_connections(self, mock_maincall):
+        """Tests that `--max-connections` must be a positive integer."""
+        for value in ("0", "-1"):
+            with self.subTest(value=value):
+                stderr = io.StringIO()
+                argv = ["spire", "--max-connections", value, "view", "metadata", "X"]
+                with patch("sys.argv", argv):
+                    with contextlib.redirect_stderr(stderr):
+                        with self.assertRaises(SystemExit):
+                            main()
+                self.assertIn("Invalid number of connections", stderr.getvalue())
+        mock_maincall.assert_not_called()
+
+
+class TestView(unittest.TestCase):
+    def setUp(self):
+        self.genomes = pl.DataFrame(
+            {
+                "spire_id": ["mag_1", "mag_2", "mag_3", "mag_4"],
+                "derived_from_sample": ["sample_1", "sample_1", "sample_2", "sample_1"],
+                "completeness": [95.0, 50.0, 99.0, 92.0],
+            }
+        )
+
+    def _view(self, *args, **kwargs) -> str:
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            view(*args, **kwargs)
+        return stdout.getvalue()
+
+    @patch.object(sys.modules["spirepy.cli.view"], "scan_genome_metadata")
+    def test_view_mags_options(self, mock_scan: MagicMock):
+        mock_scan.return_value = self.genomes.lazy()
+
+        output = self._view(
+            Sample("sample_1", Study("study_1")),
+            "mags",
+            columns="spire_id,completeness",
+            where=["completeness > 90"],
+            limit=1,
+            output_format="tsv",
+        )
+
+        self.assertEqual(output, "spire_id\tcompleteness\nmag_1\t95.0\n")
+
+    @patch.object(Study, "summary")
+    def test_view_summary_tsv(self, mock_summary: MagicMock):
+        mock_summary.return_value = pl.DataFrame(
+            {
+                "study": ["study_1"],
+                "phyla": [
+                    [
+                        {"phylum": "p__Bacillota", "mags": 2},
+                        {"phylum": "p__Bacteroidota", "mags": 1},
+                    ]
+                ],
+            }
+        )
+
+        output = self._view(Study("study_1"), "summary", output_format="tsv")
+
+        self.assertEqual(
+            output, "study\tphyla\nstudy_1\tp__Bacillota:2;p__Bacteroidota:1\n"
+        )
+
+    @patch.object(Study, "get_metadata")
+    def test_view_ndjson(self, mock_get_metadata: MagicMock):
+        mock_get_metadata.return_value = pl.DataFrame(
+            {"sample_id": ["sample_1", "sample_2"], "country": ["PT", "DE"]}
+        )
+
+        output = self._view(Study("study_1"), "metadata", output_format="ndjson")
+
+        self.assertEqual(
+            [json.loads(line) for line in output.splitlines()],
+            [
+                {"sample_id": "sample_1", "country": "PT"},
+                {"sample_id": "sample_2", "country": "DE"},
+            ],
+        )
+
+    def test_view_piped_to_head(self):
+        """Tests that the output stops quietly when the reader closes the pipe."""
+        script = textwrap.dedent(
+            """
+            from unittest.mock import patch
+            import polars as pl
+            from spirepy import Study
+            from spirepy.cli.view import view
+
+            frame = pl.DataFrame({"sample_id": [f"s{i}" for i in range(10**6)]})
+            with patch.object(Study, "get_metadata", return_value=frame):
+                view(Study("study_1"), "metadata", output_format=%r)
+            """
+        )
+        for output_format in ("tsv", "ndjson"):
+            with self.subTest(output_format=output_format):
+                command = [sys.executable, "-c", script % output_format]
+                result = subprocess.run(
+                    f"{shlex.join(command)} | head -1; exit ${{PIPESTATUS[0]}}",
+                    shell=True,
+                    executable="/bin/bash",
+                    capture_output=True,
+                    text=True,
+                )
+                self.assertEqual(len(result.stdout.splitlines()), 1)
+                self.assertEqual(result.stderr, "")
+                self.assertEqual(result.returncode, 0)
+
+
+class TestDownload(unittest.TestCase):
+    @patch.object(sys.modules["spirepy.cli.download"], "Journal")
+    @patch.object(Sample, "download_mags")
+    def test_sample_mags_use_journal(
+        self, mock_download_mags: MagicMock, MockJournal: MagicMock
+    ):
+        """Tests that MAG downloads of a sample are recorded in the journal."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            download(Sample("sample_1"), "mags", tmpdir)
+
+        mock_download_mags.assert_called_once_with(tmpdir, MockJournal.return_value)
 
 
 if __name__ == "__main__":
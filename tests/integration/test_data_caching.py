@@ -18,7 +18,7 @@ class TestDataCacheOnDisk(unittest.TestCase):
         if os.path.exists(cache_dir):
             shutil.rmtree(cache_dir)
 
-    @patch('polars.read_csv')
+    @patch('spirepy.data._download_tsv')
     def test_disk_cache_creation(self, mock_read_csv):
         """Test that calling a cached function creates the on-disk cache."""
         mock_read_csv.return_value = pl.DataFrame({'a': [1]})
@@ -0,0 +1,133 @@
+import io
+import os
+import os.path as path
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+from spirepy import Study, blobstore
+from spirepy.blobstore import BlobStore
+
+
+def _write_tar(url: str, fpath: str):
+    with tarfile.open(fpath, "w") as tar:
+        for name in ["mags/a.fa", "mags/b.fa"]:
+            content = b">contig_1\nACGT\n"
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.store = BlobStore(path.join(self.tmpdir.name, "blobs"))
+        self.downloads = []
+
+    def _download(self, url: str, fpath: str):
+        self.downloads.append(url)
+        with open(fpath, "wb") as f:
+            f.write(b">contig_1\nACGT\n")
+
+    def _download_tar(self, url: str, fpath: str):
+        self.downloads.append(url)
+        _write_tar(url, fpath)
+
+    def test_fetch_downloads_once(self):
+        first = path.join(self.tmpdir.name, "out1", "a.fa")
+        second = path.join(self.tmpdir.name, "out2", "a.fa")
+
+        digest = self.store.fetch("https://example.org/a", first, self._download)
+        self.store.fetch("https://example.org/a", second, self._download)
+
+        self.assertEqual(self.downloads, ["https://example.org/a"])
+        for fpath in [first, second]:
+            with open(fpath, "rb") as f:
+                self.assertEqual(f.read(), b">contig_1\nACGT\n")
+        self.assertTrue(path.exists(self.store.blob_path(digest)))
+
+    def test_fetch_tar_deduplicates_members(self):
+        output = path.join(self.tmpdir.name, "out")
+
+        members = self.store.fetch_tar(
+            "https://example.org/t", output, self._download_tar
+        )
+        self.store.fetch_tar("https://example.org/t", output, self._download_tar)
+
+        self.assertEqual(self.downloads, ["https://example.org/t"])
+        self.assertEqual(sorted(members), ["mags/a.fa", "mags/b.fa"])
+        # Both members have the same content, so a single file is stored
+        self.assertEqual(len(set(members.values())), 1)
+        self.assertTrue(path.exists(path.join(output, "mags", "b.fa")))
+
+    def test_unsafe_member(self):
+        with self.assertRaises(ValueError):
+            blobstore._member_path("../outside.fa")
+
+    @patch("spirepy.blobstore._reflink", side_effect=OSError)
+    def test_gc(self, mock_reflink: MagicMock):
+        kept = path.join(self.tmpdir.name, "kept", "a.fa")
+        deleted = path.join(self.tmpdir.name, "deleted")
+        self.store.fetch("https://example.org/a", kept, self._download)
+        members = self.store.fetch_tar(
+            "https://example.org/t", deleted, self._download_tar
+        )
+        with open(kept, "rb") as f:
+            self.assertEqual(f.read(), b">contig_1\nACGT\n")
+        self.assertEqual(self.store.gc(), (0, 0))
+
+        for name in members:
+            os.unlink(path.join(deleted, name))
+        self.assertEqual(self.store.gc(), (0, 0))
+        os.unlink(kept)
+
+        self.assertEqual(self.store.gc(), (1, 15))
+        # Removed files are downloaded again
+        self.store.fetch("https://example.org/a", kept, self._download)
+        self.assertEqual(len(self.downloads), 3)
+
+    @patch("spirepy.blobstore._reflink", side_effect=shutil.copyfile)
+    def test_gc_keeps_reflinked(self, mock_reflink: MagicMock):
+        output = path.join(self.tmpdir.name, "out", "a.fa")
+        self.store.fetch("https://example.org/a", output, self._download)
+
+        self.assertEqual(self.store.gc(), (0, 0))
+
+        with open(output, "ab") as f:
+            f.write(b"N")
+        self.assertEqual(self.store.gc(), (1, 15))
+
+    def test_gc_waits_for_lock(self):
+        done = threading.Event()
+        with self.store._lock():
+            thread = threading.Thread(target=lambda: (self.store.gc(), done.set()))
+            thread.start()
+            self.assertFalse(done.wait(0.2))
+        thread.join()
+        self.assertTrue(done.is_set())
+
+
+class TestStudyDownload(unittest.TestCase):
+    @patch("spirepy.scheduler.retrieve")
+    def test_download_mags_uses_store(self, mock_retrieve: MagicMock):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        store = BlobStore(path.join(tmpdir.name, "blobs"))
+        mock_retrieve.side_effect = lambda url, fpath, priority: _write_tar(url, fpath)
+
+        with patch("spirepy.study.blobstore.default_store", return_value=store):
+            Study("test_study").download_mags(path.join(tmpdir.name, "out"))
+            Study("test_study").download_mags(path.join(tmpdir.name, "out2"))
+
+        mock_retrieve.assert_called_once()
+        self.assertTrue(
+            path.exists(path.join(tmpdir.name, "out2", "mags", "mags", "a.fa"))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,28 @@
+import gzip
+import os
+import os.path as path
+import tempfile
 import unittest
 from unittest.mock import patch
 
 import polars as pl
 
+from spirepy import data, scheduler
 from spirepy.data import cluster_metadata, genome_metadata
 
 
 class TestDataFunctions(unittest.TestCase):
-    @patch("polars.read_csv")
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        for patcher in [
+            patch("spirepy.data.cache_dir", self.tmpdir.name),
+            patch("spirepy.data._remote_validators", return_value=None),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch("spirepy.data._download_tsv")
     def test_cluster_metadata_returns_polars_dataframe(self, mock_read_csv):
         mock_read_csv.return_value = pl.DataFrame(
             {"cluster_id": [1, 2], "description": ["Cluster 1", "Cluster 2"]}
@@ -17,7 +32,7 @@ class TestDataFunctions(unittest.TestCase):
 
         self.assertIsInstance(result, pl.DataFrame)
 
-    @patch("polars.read_csv")
+    @patch("spirepy.data._download_tsv")
     def test_genome_metadata_returns_polars_dataframe(self, mock_read_csv):
         mock_read_csv.return_value = pl.DataFrame(
             {"genome_id": [1, 2], "species": ["Species A", "Species B"]}
@@ -27,7 +42,7 @@ class TestDataFunctions(unittest.TestCase):
 
         self.assertIsInstance(result, pl.DataFrame)
 
-    @patch("polars.read_csv")
+    @patch("spirepy.data._download_tsv")
     def test_cluster_metadata_caching(self, mock_read_csv):
         cluster_metadata.clear()
         mock_read_csv.return_value = pl.DataFrame({"a": [1]})
@@ -37,7 +52,7 @@ class TestDataFunctions(unittest.TestCase):
 
         mock_read_csv.assert_called_once()
 
-    @patch("polars.read_csv")
+    @patch("spirepy.data._download_tsv")
     def test_genome_metadata_caching(self, mock_read_csv):
         genome_metadata.clear()
         mock_read_csv.return_value = pl.DataFrame({"a": [1]})
@@ -47,6 +62,191 @@ class TestDataFunctions(unittest.TestCase):
 
         mock_read_csv.assert_called_once()
 
+    @patch("spirepy.scheduler.retrieve")
+    def test_download_tsv(self, mock_retrieve):
+        def retrieve(url, fpath, priority):
+            with gzip.open(fpath, "wt") as f:
+                f.write("a\tb\n1\tx\n")
+
+        mock_retrieve.side_effect = retrieve
+        url = "https://example.org/table.tsv.gz"
+
+        frame = data._download_tsv(url)
+
+        self.assertEqual(frame.to_dicts(), [{"a": 1, "b": "x"}])
+        self.assertEqual(mock_retrieve.call_args.args[0], url)
+        self.assertEqual(mock_retrieve.call_args.args[2], scheduler.METADATA)
+        # The download was removed once parsed
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+
+class TestCacheFreshness(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        patchers = [
+            patch("spirepy.data.cache_dir", self.tmpdir.name),
+            patch("spirepy.data.check_interval", 60),
+            patch("spirepy.data.time.time", side_effect=lambda: self.now),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+        self.now = 1000.0
+
+    @patch("spirepy.data._remote_validators")
+    @patch("spirepy.data._download_tsv")
+    def test_not_checked_within_interval(self, mock_read_csv, mock_validators):
+        mock_read_csv.return_value = pl.DataFrame({"a": [1]})
+        mock_validators.return_value = {"etag": '"v1"', "last_modified": None}
+
+        genome_metadata()
+        self.now += 30
+        genome_metadata()
+
+        mock_read_csv.assert_called_once()
+        mock_validators.assert_called_once()
+
+    @patch("spirepy.data._remote_validators")
+    @patch("spirepy.data._download_tsv")
+    def test_not_modified(self, mock_read_csv, mock_validators):
+        mock_read_csv.return_value = pl.DataFrame({"a": [1]})
+        mock_validators.return_value = {"etag": '"v1"', "last_modified": None}
+        genome_metadata()
+
+        mock_validators.return_value = None
+        self.now += 120
+        genome_metadata()
+
+        mock_read_csv.assert_called_once()
+        mock_validators.assert_called_with(
+            "https://swifter.embl.de/~fullam/spire/metadata/spire_v1_genome_metadata.tsv.gz",
+            '"v1"',
+            None,
+        )
+
+    @patch("spirepy.data._remote_validators")
+    @patch("spirepy.data._download_tsv")
+    def test_modified(self, mock_read_csv, mock_validators):
+        mock_read_csv.return_value = pl.DataFrame({"a": [1]})
+        mock_validators.return_value = {"etag": '"v1"', "last_modified": None}
+        genome_metadata()
+
+        mock_read_csv.return_value = pl.DataFrame({"a": [2]})
+        mock_validators.return_value = {"etag": '"v2"', "last_modified": None}
+        self.now += 120
+
+        self.assertEqual(genome_metadata()["a"].to_list(), [2])
+        self.assertEqual(mock_read_csv.call_count, 2)
+
+    @patch("spirepy.data._remote_validators")
+    @patch("spirepy.data._download_tsv")
+    def test_failed_refresh_is_retried(self, mock_read_csv, mock_validators):
+        mock_read_csv.return_value = pl.DataFrame({"a": [1]})
+        mock_validators.return_value = {"etag": '"v1"', "last_modified": None}
+        genome_metadata()
+
+        mock_read_csv.side_effect = OSError("connection reset")
+        mock_validators.return_value = {"etag": '"v2"', "last_modified": None}
+        self.now += 120
+        with self.assertRaises(OSError):
+            genome_metadata()
+
+        # The cached copy keeps its validators, so it is still found stale
+        self.assertEqual(genome_metadata._read_state("spire_v1")["etag"], '"v1"')
+        mock_read_csv.side_effect = None
+        mock_read_csv.return_value = pl.DataFrame({"a": [2]})
+        self.assertEqual(genome_metadata()["a"].to_list(), [2])
+        self.assertEqual(genome_metadata._read_state("spire_v1")["etag"], '"v2"')
+
+    @patch("spirepy.data._remote_validators", side_effect=OSError)
+    @patch("spirepy.data._download_tsv")
+    def test_releases_side_by_side(self, mock_read_csv, mock_validators):
+        mock_read_csv.side_effect = lambda url: pl.DataFrame({"url": [url]})
+
+        v1 = cluster_metadata(release="spire_v1")
+        v2 = cluster_metadata(release="spire_v2")
+        cluster_metadata.clear(release="spire_v2")
+
+        self.assertIn("spire_v1_cluster", v1["url"][0])
+        self.assertIn("spire_v2_cluster", v2["url"][0])
+        self.assertTrue(path.exists(cluster_metadata._path("spire_v1")))
+        self.assertFalse(path.exists(cluster_metadata._path("spire_v2")))
+
+
+class TestSampleIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.patcher = patch("spirepy.data.cache_dir", self.tmpdir.name)
+        self.patcher.start()
+        data._sample_index = None
+
+    def tearDown(self):
+        self.patcher.stop()
+        data._sample_index = None
+        self.tmpdir.cleanup()
+
+    def test_lookup_study(self):
+        data.index_samples("STUDY_B", ["s3", "s1"])
+        data.index_samples("STUDY_A", ["s2"])
+
+        self.assertEqual(data.lookup_study("s1"), "STUDY_B")
+        self.assertEqual(data.lookup_study("s2"), "STUDY_A")
+        self.assertIsNone(data.lookup_study("s0"))
+        self.assertIsNone(data.lookup_study("s9"))
+        self.assertEqual(data.sample_index()["sample_id"].to_list(), ["s1", "s2", "s3"])
+
+    def test_index_persists_on_disk(self):
+        data.index_samples("STUDY_A", ["s1", "s2"])
+        data._sample_index = None
+
+        self.assertEqual(data.lookup_study("s2"), "STUDY_A")
+
+    @patch("spirepy.data.SAMPLE_INDEX_PARTS", 2)
+    def test_updates_are_appended(self):
+        for i in range(2):
+            data.index_samples(f"STUDY_{i}", [f"s{i}"])
+        self.assertEqual(len(data._sample_index_parts()), 2)
+        # The next update merges the parts
+        data.index_samples("STUDY_X", ["s0", "s2"])
+        self.assertEqual(len(data._sample_index_parts()), 1)
+        data._sample_index = None
+
+        self.assertEqual(data.lookup_study("s0"), "STUDY_X")
+        self.assertEqual(data.lookup_study("s1"), "STUDY_1")
+
+    @patch("spirepy.data.scan_genome_metadata")
+    def test_build_from_genome_metadata(self, mock_scan):
+        mock_scan.return_value = pl.LazyFrame(
+            {
+                "spire_id": ["m1", "m2", "m3"],
+                "derived_from_sample": ["s1", "s1", "s2"],
+                "study_id": ["STUDY_A", "STUDY_A", "STUDY_B"],
+            }
+        )
+
+        data.build_sample_index()
+
+        self.assertEqual(data.sample_index()["sample_id"].to_list(), ["s1", "s2"])
+        self.assertEqual(data.lookup_study("s2"), "STUDY_B")
+
+    @patch("spirepy.data.scan_genome_metadata")
+    def test_build_without_study_column(self, mock_scan):
+        mock_scan.return_value = pl.LazyFrame({"derived_from_sample": ["s1"]})
+
+        with self.assertRaises(ValueError):
+            data.build_sample_index()
+
+    def test_group_by_study(self):
+        data.index_samples("STUDY_A", ["s1", "s2"])
+        data.index_samples("STUDY_B", ["s3"])
+
+        grouped = data.group_by_study(["s3", "s1", "unknown", "s2"])
+
+        self.assertEqual(
+            grouped, {"STUDY_B": ["s3"], "STUDY_A": ["s1", "s2"], None: ["unknown"]}
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
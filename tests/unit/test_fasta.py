@@ -0,0 +1,93 @@
+import gzip
+import os
+import os.path as path
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import polars as pl
+import pyarrow as pa
+
+from spirepy import Study, fasta
+
+
+class TestFasta(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.output = self.tmpdir.name
+        mags = path.join(self.output, "mags")
+        os.makedirs(mags)
+        with gzip.open(path.join(mags, "spire_mag_1.fa.gz"), "wt") as f:
+            f.write(">c1\nGGCC\nAATT\n>c2 desc\nGCNN\n>c3\nATATAT\n")
+        with open(path.join(mags, "spire_mag_2.fa"), "w") as f:
+            f.write(">c4\nacgtacgt\n")
+
+    def test_read_fasta(self):
+        records = list(
+            fasta.read_fasta(path.join(self.output, "mags", "spire_mag_1.fa.gz"))
+        )
+
+        self.assertEqual(
+            records, [("c1", "GGCCAATT"), ("c2", "GCNN"), ("c3", "ATATAT")]
+        )
+
+    @patch("spirepy.fasta.BATCH_SIZE", 2)
+    def test_to_parquet_and_stats(self):
+        fpath = fasta.to_parquet(
+            path.join(self.output, "mags"),
+            path.join(self.output, "mags.parquet"),
+            {"spire_mag_1": "sample_1"},
+        )
+
+        sequences = pl.read_parquet(fpath)
+        self.assertEqual(sequences.columns, ["id", "sample", "genome", "sequence"])
+        self.assertEqual(sequences["id"].to_list(), ["c1", "c2", "c3", "c4"])
+        self.assertEqual(
+            sequences["sample"].to_list(), ["sample_1", "sample_1", "sample_1", None]
+        )
+
+        stats = fasta.sequence_stats(fpath)
+        self.assertEqual(stats["length"].to_list(), [8, 4, 6, 8])
+        self.assertEqual(stats["gc"].to_list(), [4, 2, 0, 4])
+        self.assertEqual(stats["acgt"].to_list(), [8, 2, 6, 8])
+
+        genomes = fasta.genome_stats(stats)
+        self.assertEqual(genomes["genome"].to_list(), ["spire_mag_1", "spire_mag_2"])
+        self.assertEqual(genomes["contigs"].to_list(), [3, 1])
+        self.assertEqual(genomes["length"].to_list(), [18, 8])
+        self.assertEqual(genomes["n50"].to_list(), [6, 8])
+        self.assertEqual(genomes["gc"].to_list(), [6 / 16, 0.5])
+
+    def test_base_counts_empty_and_sliced(self):
+        sequences = pa.array(["GGAA", "", "ccNN", "", "T", "GC"]).slice(1)
+
+        lengths, gc, acgt = fasta._base_counts(sequences)
+
+        self.assertEqual(lengths.tolist(), [0, 4, 0, 1, 2])
+        self.assertEqual(gc.tolist(), [0, 2, 0, 0, 2])
+        self.assertEqual(acgt.tolist(), [0, 2, 0, 1, 2])
+
+    @patch.object(Study, "get_metadata")
+    @patch.object(Study, "get_mags")
+    def test_study_get_mag_stats(self, mock_get_mags, mock_get_metadata):
+        mock_get_metadata.return_value = pl.DataFrame({"sample_id": ["sample_1"]})
+        mock_get_mags.return_value = pl.DataFrame(
+            {
+                "spire_id": ["spire_mag_1", "spire_mag_2", "spire_mag_3"],
+                "derived_from_sample": ["sample_1", "sample_1", "sample_1"],
+            }
+        )
+
+        stats = Study("test_study").get_mag_stats(self.output)
+
+        self.assertEqual(
+            stats["spire_id"].to_list(), ["spire_mag_1", "spire_mag_2", "spire_mag_3"]
+        )
+        self.assertEqual(stats["length"].to_list(), [18, 8, None])
+        sequences = pl.read_parquet(path.join(self.output, "mags.parquet"))
+        self.assertEqual(sequences["sample"].unique().to_list(), ["sample_1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
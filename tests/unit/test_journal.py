@@ -0,0 +1,73 @@
+import os
+import os.path as path
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from spirepy.journal import Journal
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.journal = Journal(path.join(self.tmpdir.name, "jobs.sqlite"))
+        self.units = {
+            item: path.join(self.tmpdir.name, f"{item}.txt") for item in ["a", "b", "c"]
+        }
+        self.calls = []
+
+    def _write(self, item: str, fpath: str):
+        self.calls.append(item)
+        if item == "b" and self.calls.count("b") < 3:
+            raise OSError("temporary failure")
+        with open(fpath, "w") as f:
+            f.write(item)
+
+    @patch("spirepy.journal.time.sleep")
+    def test_retries_with_backoff(self, mock_sleep: MagicMock):
+        failed = self.journal.execute("test", self.units, self._write, backoff=2)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(self.calls, ["a", "b", "b", "b", "c"])
+        self.assertEqual([c.args[0] for c in mock_sleep.call_args_list], [2, 4])
+
+    @patch("spirepy.journal.time.sleep")
+    def test_rerun_skips_done_units(self, mock_sleep: MagicMock):
+        failed = self.journal.execute("test", self.units, self._write, retries=1)
+        self.assertEqual(failed, ["b"])
+
+        self.calls.clear()
+        self.journal.execute("test", self.units, self._write, retries=2)
+
+        self.assertEqual(self.calls, ["b", "b"])
+
+    @patch("spirepy.journal.time.sleep")
+    def test_missing_output_is_redone(self, mock_sleep: MagicMock):
+        self.journal.execute("test", {"a": self.units["a"]}, self._write)
+        os.unlink(self.units["a"])
+        self.journal.execute("test", {"a": self.units["a"]}, self._write)
+
+        self.assertEqual(self.calls, ["a", "a"])
+
+    def test_invalid_retries(self):
+        with self.assertRaises(ValueError):
+            self.journal.execute("test", self.units, self._write, retries=0)
+
+        self.assertEqual(self.calls, [])
+
+    @patch("spirepy.journal.time.sleep")
+    def test_status(self, mock_sleep: MagicMock):
+        self.journal.execute("test", self.units, self._write, retries=1)
+
+        status = Journal(self.journal.fpath).status()
+
+        self.assertEqual(status["target"].to_list(), ["test"])
+        self.assertEqual(status["done"].to_list(), [2])
+        self.assertEqual(status["failed"].to_list(), [1])
+        self.assertEqual(status["pending"].to_list(), [0])
+        self.assertEqual(status["bytes"].to_list(), [2])
+
+
+if __name__ == "__main__":
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
@@ -0,0 +1,149 @@
+import json
+import os
+import os.path as path
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import polars as pl
+
+from spirepy import data
+from spirepy.lock import FileLock
+
+
+class TestFileLock(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.fpath = path.join(self.tmpdir.name, "table.lock")
+
+    def _write_lock(self, host: str, pid: int, age: float = 0):
+        with open(self.fpath, "w") as f:
+            json.dump({"host": host, "pid": pid}, f)
+        mtime = time.time() - age
+        os.utime(self.fpath, (mtime, mtime))
+
+    def test_mutual_exclusion(self):
+        order = []
+
+        def worker(name):
+            with FileLock(self.fpath, poll_interval=0.01):
+                order.append(f"{name} in")
+                time.sleep(0.05)
+                order.append(f"{name} out")
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for i in range(0, len(order), 2):
+            self.assertEqual(order[i].split()[0], order[i + 1].split()[0])
+        self.assertFalse(path.exists(self.fpath))
+
+    def test_dead_owner_is_stale(self):
+        finished = subprocess.run(
+            [sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True
+        )
+        self._write_lock(socket.gethostname(), int(finished.stdout))
+
+        with FileLock(self.fpath, poll_interval=0.01):
+            with open(self.fpath) as f:
+                self.assertEqual(json.load(f)["pid"], os.getpid())
+
+    def test_old_lock_is_stale(self):
+        self._write_lock("another-host", 1, age=60)
+
+        with FileLock(self.fpath, stale_after=30, poll_interval=0.01):
+            with open(self.fpath) as f:
+                self.assertEqual(json.load(f)["pid"], os.getpid())
+
+    def test_live_lock_is_kept(self):
+        self._write_lock("another-host", 1)
+        lock = FileLock(self.fpath, stale_after=30)
+
+        self.assertFalse(lock._break_if_stale())
+        self.assertTrue(path.exists(self.fpath))
+
+    def test_lock_refreshed_while_breaking_is_kept(self):
+        self._write_lock("another-host", 1, age=60)
+        lock = FileLock(self.fpath, stale_after=30)
+        rename = os.rename
+
+        def heartbeat_then_rename(src, dst):
+            # The owner updates the lock just after it was found stale
+            os.utime(src)
+            rename(src, dst)
+
+        with patch("spirepy.lock.os.rename", side_effect=heartbeat_then_rename):
+            self.assertFalse(lock._break_if_stale())
+        with open(self.fpath) as f:
+            self.assertEqual(json.load(f)["host"], "another-host")
+        self.assertEqual(os.listdir(self.tmpdir.name), ["table.lock"])
+
+
+class TestConcurrentCacheFill(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        patcher = patch("spirepy.data.cache_dir", self.tmpdir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("spirepy.data._remote_validators", return_value=None)
+    @patch("spirepy.data._download_tsv")
+    def test_table_downloaded_once(self, mock_read_csv, mock_validators):
+        def slow_read_csv(url):
+            time.sleep(0.2)
+            return pl.DataFrame({"a": [1]})
+
+        mock_read_csv.side_effect = slow_read_csv
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(data.cluster_metadata()))
+            for _ in range(4)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        mock_read_csv.assert_called_once()
+        self.assertEqual([r["a"].to_list() for r in results], [[1]] * 4)
+
+    def test_ipc_copy_built_once(self):
+        # The table is cached as Parquet, but has no Arrow IPC copy yet
+        fpath = data.cluster_metadata._path(data.RELEASE)
+        os.makedirs(path.dirname(fpath))
+        pl.DataFrame({"a": [1]}).write_parquet(fpath)
+        with open(data.cluster_metadata._state_path(data.RELEASE), "w") as f:
+            json.dump({"fetched": time.time(), "checked": time.time()}, f)
+        write_ipc = data._write_ipc
+
+        def slow_write_ipc(frame, fpath):
+            time.sleep(0.2)
+            write_ipc(frame, fpath)
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(data.cluster_metadata()))
+            for _ in range(4)
+        ]
+        with patch("spirepy.data._write_ipc", side_effect=slow_write_ipc) as mock:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        mock.assert_called_once()
+        self.assertEqual([r["a"].to_list() for r in results], [[1]] * 4)
+
+
+if __name__ == "__main__":
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
@@ -0,0 +1,94 @@
+import gzip
+import io
+import json
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from spirepy import Sample, data, metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        """Subscribe a recorder for each test."""
+        self.recorder = metrics.subscribe(metrics.Recorder())
+        self.addCleanup(metrics.unsubscribe, self.recorder)
+
+    def test_timed_records_errors(self):
+        with self.assertRaises(ValueError):
+            with metrics.timed("parse", source="x"):
+                raise ValueError("bad")
+
+        (event,) = self.recorder.events
+        self.assertEqual(event["kind"], "parse")
+        self.assertIn("bad", event["error"])
+        self.assertGreaterEqual(event["seconds"], 0)
+
+    @patch("spirepy.transfer.urllib.request.urlopen")
+    def test_sample_fetch_event(self, mock_urlopen: MagicMock):
+        response = mock_urlopen.return_value.__enter__.return_value
+        response.status = 200
+        response.headers = {}
+        response.read.side_effect = io.BytesIO(b"sample_id\nS1\nS1\n").read
+
+        Sample("S1").get_contig_depths()
+
+        parse, event = self.recorder.events
+        self.assertEqual(parse["kind"], "parse")
+        self.assertEqual(parse["source"], event["url"])
+        self.assertEqual(parse["rows"], 2)
+        self.assertEqual(event["kind"], "fetch")
+        self.assertEqual(event["url"], "https://spire.embl.de/download_contig_depths/S1")
+        self.assertEqual(event["status"], 200)
+        self.assertEqual(event["rows"], 2)
+
+    @patch("spirepy.data._remote_validators", return_value=None)
+    @patch("spirepy.scheduler.retrieve")
+    def test_cached_table_events(self, mock_retrieve: MagicMock, mock_validators):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        patcher = patch("spirepy.data.cache_dir", tmpdir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        content = gzip.compress(b"spire_id\nmag_1\nmag_2\n")
+
+        def retrieve(url, fpath, priority):
+            with open(fpath, "wb") as f:
+                f.write(content)
+
+        mock_retrieve.side_effect = retrieve
+
+        data.genome_metadata()
+
+        fetch, parse, write, cache = self.recorder.events
+        self.assertEqual(fetch["kind"], "fetch")
+        self.assertEqual(fetch["bytes"], len(content))
+        self.assertEqual(parse["kind"], "parse")
+        self.assertEqual(parse["rows"], 2)
+        self.assertEqual(write["kind"], "write")
+        self.assertEqual(write["rows"], 2)
+        self.assertEqual(cache["kind"], "cache")
+        self.assertFalse(cache["hit"])
+
+    def test_summary_and_exporters(self):
+        metrics.emit({"kind": "fetch", "seconds": 1.5, "bytes": 10, "status": 200})
+        metrics.emit({"kind": "fetch", "seconds": 0.5, "bytes": 5, "status": 200})
+        metrics.emit({"kind": "cache", "seconds": 0.1, "hit": True, "rows": 3})
+        metrics.emit({"kind": "cache", "seconds": 0.2, "hit": False, "rows": 3})
+
+        summary = self.recorder.summary()
+        self.assertEqual(summary["fetch"]["count"], 2)
+        self.assertEqual(summary["fetch"]["seconds"], 2.0)
+        self.assertEqual(summary["fetch"]["bytes"], 15)
+        self.assertEqual(summary["cache"]["hits"], 1)
+        self.assertEqual(summary["cache"]["misses"], 1)
+
+        self.assertEqual(json.loads(self.recorder.to_json())["summary"], summary)
+        prometheus = self.recorder.to_prometheus()
+        self.assertIn("spirepy_fetch_total 2\n", prometheus)
+        self.assertIn("spirepy_fetch_bytes_total 15\n", prometheus)
+        self.assertIn("spirepy_cache_hits_total 1\n", prometheus)
+
+
+if __name__ == "__main__":
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
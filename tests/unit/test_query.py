@@ -0,0 +1,135 @@
+import importlib
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from spirepy import data
+from spirepy.genome import Genome
+from spirepy.query import Query
+
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        """Set up a fake genome metadata table and sample index."""
+        self.genomes = pl.DataFrame(
+            {
+                "spire_id": ["MAG_A", "MAG_B", "MAG_C", "MAG_D"],
+                "derived_from_sample": ["s1", "s1", "s2", "s3"],
+                "completeness": [95.0, 80.0, 99.0, 92.0],
+                "contamination": [1.0, 2.0, 7.0, 0.5],
+            }
+        )
+        self.index = pl.DataFrame(
+            {"sample_id": ["s1", "s2", "s3"], "study": ["STUDY_A", "STUDY_A", "STUDY_B"]}
+        )
+        scan_patcher = patch.dict(
+            "spirepy.query._tables", {"genomes": lambda: self.genomes.lazy()}
+        )
+        index_patcher = patch("spirepy.query.sample_index", return_value=self.index)
+        scan_patcher.start()
+        index_patcher.start()
+        self.addCleanup(scan_patcher.stop)
+        self.addCleanup(index_patcher.stop)
+
+    def test_invalid_table(self):
+        with self.assertRaises(ValueError):
+            Query("invalid")
+
+    def test_collect_with_filters(self):
+        """Tests that SQL and expression predicates are combined."""
+        query = Query("genomes").filter("completeness > 90", pl.col("contamination") < 5)
+        expected = self.genomes.filter(pl.col("spire_id").is_in(["MAG_A", "MAG_D"]))
+        assert_frame_equal(query.collect(), expected)
+
+    def test_builder_is_immutable(self):
+        query = Query("genomes")
+        filtered = query.filter("completeness > 90").select("spire_id").limit(1)
+
+        self.assertEqual(query.collect().height, 4)
+        assert_frame_equal(filtered.collect(), pl.DataFrame({"spire_id": ["MAG_A"]}))
+
+    def test_to_genomes(self):
+        genomes = Query("genomes").filter("completeness > 90").to_genomes()
+
+        self.assertEqual([g.id for g in genomes], ["MAG_A", "MAG_C", "MAG_D"])
+        self.assertIsInstance(genomes[0], Genome)
+        self.assertEqual(
+            [g.sample.id for g in genomes], ["s1", "s2", "s3"]
+        )
+
+    def test_to_samples_and_studies(self):
+        query = Query("genomes").filter("contamination < 5")
+
+        self.assertEqual([s.id for s in query.to_samples()], ["s1", "s3"])
+        self.assertEqual([s.name for s in query.to_studies()], ["STUDY_A", "STUDY_B"])
+
+
+class TestSampleQuery(unittest.TestCase):
+    def setUp(self):
+        """Cache the metadata of one of two indexed studies."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        patcher = patch("spirepy.data.cache_dir", self.tmpdir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        data._sample_index = None
+        self.addCleanup(setattr, data, "_sample_index", None)
+        data.index_samples("STUDY_A", ["s1", "s2"])
+        data.index_samples("STUDY_B", ["s3"])
+        data.cache_study_metadata(
+            "STUDY_A",
+            pl.DataFrame(
+                {
+                    "study_id": ["STUDY_A", "STUDY_A"],
+                    "sample_id": ["s1", "s2"],
+                    "environment": ["gut", "soil"],
+                }
+            ),
+        )
+        genomes = pl.LazyFrame(
+            {
+                "spire_id": ["MAG_A", "MAG_B", "MAG_C"],
+                "derived_from_sample": ["s1", "s2", "s3"],
+                "completeness": [95.0, 99.0, 92.0],
+            }
+        )
+        patcher = patch.dict("spirepy.query._tables", {"genomes": lambda: genomes})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_samples_have_metadata(self):
+        samples = Query("samples").collect()
+
+        self.assertEqual(samples["sample_id"].to_list(), ["s1", "s2", "s3"])
+        self.assertEqual(samples["study"].to_list(), ["STUDY_A", "STUDY_A", "STUDY_B"])
+        self.assertEqual(samples["environment"].to_list(), ["gut", "soil", None])
+
+    def test_genomes_from_samples(self):
+        gut = Query("samples").filter("environment = 'gut'")
+
+        genomes = Query("genomes").filter("completeness > 90").from_samples(gut)
+
+        self.assertEqual(genomes.collect()["spire_id"].to_list(), ["MAG_A"])
+        with self.assertRaises(ValueError):
+            gut.from_samples(gut)
+
+
+class TestQueryCli(unittest.TestCase):
+    @patch.object(importlib.import_module("spirepy.cli.query"), "Query")
+    def test_query_builds_and_prints(self, MockQuery: MagicMock):
+        from spirepy.cli import query
+
+        q = MockQuery.return_value.filter.return_value
+        query("genomes", ["completeness > 90"], "spire_id,completeness", 10)
+
+        MockQuery.assert_called_once_with("genomes")
+        MockQuery.return_value.filter.assert_called_once_with("completeness > 90")
+        q.select.assert_called_once_with("spire_id", "completeness")
+        q.select.return_value.limit.assert_called_once_with(10)
+
+
+if __name__ == "__main__":
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
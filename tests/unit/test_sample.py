@@ -1,10 +1,13 @@
+import os.path as path
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock, call
 import polars as pl
 import pandas as pd
 from polars.testing import assert_frame_equal
 
-from spirepy import Sample, Study
+from spirepy import Sample, Study, scheduler
+from spirepy.journal import Journal
 
 
 class TestSample(unittest.TestCase):
@@ -27,27 +30,60 @@ class TestSample(unittest.TestCase):
         self.assertEqual(str(self.sample), expected_str)
         self.assertEqual(repr(self.sample), expected_str)
 
-    @patch("spirepy.sample.pl.read_csv")
-    def test_get_metadata(self, mock_read_csv: MagicMock):
+    @patch("spirepy.sample.lookup_study")
+    def test_study_lookup(self, mock_lookup_study: MagicMock):
+        """Tests that the study is resolved from the sample index when not given."""
+        mock_lookup_study.return_value = "STUDY_B"
+        sample = Sample(id=self.sample_id)
+
+        self.assertEqual(sample.study.name, "STUDY_B")
+        self.assertIs(sample.study, sample.study)
+        mock_lookup_study.assert_called_once_with(self.sample_id)
+
+    @patch("spirepy.sample.index_samples")
+    @patch("spirepy.transfer.read_tsv")
+    @patch("spirepy.sample.lookup_study", return_value=None)
+    def test_study_fetched_when_not_indexed(
+        self,
+        mock_lookup_study: MagicMock,
+        mock_read_tsv: MagicMock,
+        mock_index_samples: MagicMock,
+    ):
+        """Tests that a sample missing from the index is looked up by itself."""
+        mock_read_tsv.return_value = pl.DataFrame(
+            {"study_id": ["STUDY_C"], "sample_id": [self.sample_id]}
+        )
+        sample = Sample(self.sample_id)
+
+        # Printing the sample makes no request
+        self.assertIn("Study: None", str(sample))
+        mock_read_tsv.assert_not_called()
+
+        self.assertEqual(sample.study.name, "STUDY_C")
+        mock_read_tsv.assert_called_once()
+        mock_index_samples.assert_called_once_with("STUDY_C", [self.sample_id])
+
+    @patch("spirepy.transfer.read_tsv")
+    def test_get_metadata(self, mock_read_tsv: MagicMock):
         """Tests get_metadata for successful data retrieval and caching."""
         mock_data = pl.DataFrame({"sample_id": [self.sample_id]})
-        mock_read_csv.return_value = mock_data
+        mock_read_tsv.return_value = mock_data
 
         # First call - should fetch data
         result1 = self.sample.get_metadata()
-        expected_url = f"https://spire.embl.de/spire/api/sample/{self.sample_id}?format=tsv"
-        mock_read_csv.assert_called_once_with(expected_url, separator="\t")
+        expected_url = (
+            f"https://spire.embl.de/spire/api/sample/{self.sample_id}?format=tsv"
+        )
+        mock_read_tsv.assert_called_once_with(expected_url)
         assert_frame_equal(result1, mock_data)
 
         # Second call - should use cache
         result2 = self.sample.get_metadata()
-        mock_read_csv.assert_called_once()  # Should still be called only once
+        mock_read_tsv.assert_called_once()  # Should still be called only once
         assert_frame_equal(result2, mock_data)
 
     @patch("spirepy.sample.genome_metadata")
-    def test_get_mags(
-        self,  mock_genome_metadata: MagicMock
-    ):
+    def test_get_mags(self, mock_genome_metadata: MagicMock):
         """Tests get_mags for data processing and caching."""
         # Mock input data
         mock_genome_data = pl.DataFrame(
@@ -78,9 +114,13 @@ class TestSample(unittest.TestCase):
         mock_genome_metadata.assert_called_once()
         assert_frame_equal(result2, expected_mags)
 
+    @patch("spirepy.scheduler.urlopen")
     @patch("pandas.read_csv")
-    def test_get_eggnog_data(self, mock_read_csv: MagicMock):
+    def test_get_eggnog_data(self, mock_read_csv: MagicMock, mock_urlopen: MagicMock):
         """Tests get_eggnog_data for data retrieval and caching."""
+        response = mock_urlopen.return_value.__enter__.return_value
+        response.status = 200
+        response.read.return_value = b"compressed"
         mock_df = pd.DataFrame({"gene": ["gene1"], "annotation": ["annot1"]})
         mock_read_csv.return_value = mock_df
         expected_data = pl.from_pandas(mock_df)
@@ -88,46 +128,51 @@ class TestSample(unittest.TestCase):
         # First call
         result1 = self.sample.get_eggnog_data()
         expected_url = f"https://spire.embl.de/download_eggnog/{self.sample_id}"
-        mock_read_csv.assert_called_once_with(
-            expected_url,
-            sep="\t",
-            skiprows=4,
-            skipfooter=3,
-            compression="gzip",
-            engine="python",
+        mock_urlopen.assert_called_once_with(expected_url, scheduler.FILE)
+        self.assertEqual(mock_read_csv.call_args.args[0].getvalue(), b"compressed")
+        self.assertEqual(
+            mock_read_csv.call_args.kwargs,
+            dict(
+                sep="\t",
+                skiprows=4,
+                skipfooter=3,
+                compression="gzip",
+                engine="python",
+            ),
         )
         assert_frame_equal(result1, expected_data)
 
         # Second call
         result2 = self.sample.get_eggnog_data()
+        mock_urlopen.assert_called_once()
         mock_read_csv.assert_called_once()
         assert_frame_equal(result2, expected_data)
 
-    @patch("spirepy.sample.pl.read_csv")
-    def test_get_amr_annotations(self, mock_read_csv: MagicMock):
+    @patch("spirepy.transfer.read_tsv")
+    def test_get_amr_annotations(self, mock_read_tsv: MagicMock):
         """Tests get_amr_annotations for all modes, caching, and invalid input."""
         mock_data = pl.DataFrame({"gene": ["gene_amr"], "resistance": ["drug_x"]})
-        mock_read_csv.return_value = mock_data
+        mock_read_tsv.return_value = mock_data
 
         # Test 'deeparg' mode (default)
         result_deeparg = self.sample.get_amr_annotations(mode="deeparg")
         expected_url_deeparg = (
             f"https://spire.embl.de/download_deeparg/{self.sample_id}"
         )
-        mock_read_csv.assert_called_with(expected_url_deeparg, separator="\t")
+        mock_read_tsv.assert_called_with(expected_url_deeparg, columns=None)
         assert_frame_equal(result_deeparg, mock_data)
 
         # Test caching for the same mode
         self.sample.get_amr_annotations(mode="deeparg")
-        self.assertEqual(mock_read_csv.call_count, 1)
+        self.assertEqual(mock_read_tsv.call_count, 1)
 
         # Test 'megares' mode - should be a new call
         result_megares = self.sample.get_amr_annotations(mode="megares")
         expected_url_megares = (
             f"https://spire.embl.de/download_abricate_megares/{self.sample_id}"
         )
-        self.assertEqual(mock_read_csv.call_count, 2)
-        mock_read_csv.assert_called_with(expected_url_megares, separator="\t")
+        self.assertEqual(mock_read_tsv.call_count, 2)
+        mock_read_tsv.assert_called_with(expected_url_megares, columns=None)
         assert_frame_equal(result_megares, mock_data)
 
         # Test 'vfdb' mode - should be a new call
@@ -135,8 +180,8 @@ class TestSample(unittest.TestCase):
         expected_url_vfdb = (
             f"https://spire.embl.de/download_abricate_vfdb/{self.sample_id}"
         )
-        self.assertEqual(mock_read_csv.call_count, 3)
-        mock_read_csv.assert_called_with(expected_url_vfdb, separator="\t")
+        self.assertEqual(mock_read_tsv.call_count, 3)
+        mock_read_tsv.assert_called_with(expected_url_vfdb, columns=None)
         assert_frame_equal(result_vfdb, mock_data)
 
         # Verify all results are cached correctly
@@ -145,6 +190,58 @@ class TestSample(unittest.TestCase):
         self.assertIn("megares", self.sample._amr_annotations)
         self.assertIn("vfdb", self.sample._amr_annotations)
 
+    @patch("spirepy.transfer.read_tsv")
+    def test_get_contig_depths_projection(self, mock_read_tsv: MagicMock):
+        """Tests that only the requested columns are parsed, and cached as a superset."""
+        depths = pl.DataFrame(
+            {"contig": ["c1", "c2"], "depth": [1.5, 20.0], "length": [100, 200]}
+        )
+        mock_read_tsv.side_effect = lambda url, columns=None: (
+            depths if columns is None else depths.select(columns)
+        )
+        url = f"https://spire.embl.de/download_contig_depths/{self.sample_id}"
+
+        result = self.sample.get_contig_depths(columns=["contig"], filter="depth > 10")
+        mock_read_tsv.assert_called_once_with(url, columns=["contig", "depth"])
+        self.assertEqual(result.to_dict(as_series=False), {"contig": ["c2"]})
+
+        # Served from the cached projection
+        result = self.sample.get_contig_depths(columns=["depth"])
+        self.assertEqual(mock_read_tsv.call_count, 1)
+        self.assertEqual(result["depth"].to_list(), [1.5, 20.0])
+
+        # Another column is read along with the cached ones
+        self.sample.get_contig_depths(columns=["length"])
+        mock_read_tsv.assert_called_with(url, columns=["contig", "depth", "length"])
+
+        # All columns are read once, and then cached
+        assert_frame_equal(self.sample.get_contig_depths(), depths)
+        mock_read_tsv.assert_called_with(url, columns=None)
+        self.sample.get_contig_depths(columns=["contig"])
+        self.assertEqual(mock_read_tsv.call_count, 3)
+
+    @patch("spirepy.sample.scan_genome_metadata")
+    def test_get_mags_projection(self, mock_scan: MagicMock):
+        mock_scan.return_value = pl.LazyFrame(
+            {
+                "spire_id": ["MAG_1", "MAG_2", "MAG_3"],
+                "derived_from_sample": [self.sample_id, self.sample_id, "OTHER"],
+                "completeness": [95.0, 60.0, 99.0],
+            }
+        )
+
+        result = self.sample.get_mags(
+            columns=["spire_id"], filter=pl.col("completeness") > 90
+        )
+
+        self.assertEqual(result.to_dict(as_series=False), {"spire_id": ["MAG_1"]})
+        # The columns read are cached for all the sample's MAGs
+        self.assertEqual(self.sample._mags.columns, ["spire_id", "completeness"])
+        self.assertEqual(self.sample._mags.height, 2)
+        result = self.sample.get_mags(columns=["completeness"])
+        self.assertEqual(result["completeness"].to_list(), [95.0, 60.0])
+        mock_scan.assert_called_once()
+
     @patch("spirepy.sample.logger.error")
     def test_get_amr_annotations_invalid_mode(self, mock_logger_error: MagicMock):
         """Tests that an invalid mode returns None and logs an error."""
@@ -154,14 +251,14 @@ class TestSample(unittest.TestCase):
             "Invalid option, please choose one of the following: deeparg, megares, vfdb"
         )
 
-    @patch("spirepy.sample.urllib.request.urlretrieve")
+    @patch("spirepy.scheduler.retrieve")
     @patch("spirepy.sample.os.makedirs")
     @patch.object(Sample, "get_mags")
     def test_download_mags(
         self,
         mock_get_mags: MagicMock,
         mock_makedirs: MagicMock,
-        mock_urlretrieve: MagicMock,
+        mock_retrieve: MagicMock,
     ):
         """Tests the download_mags functionality."""
         output_folder = "/fake/dir"
@@ -173,28 +270,30 @@ class TestSample(unittest.TestCase):
         # Check that the output folder is created
         mock_makedirs.assert_called_once_with(output_folder, exist_ok=True)
 
-        # Check that urlretrieve is called for each MAG
+        # Check that a download is scheduled for each MAG
         expected_calls = [
             call(
                 f"https://spire.embl.de/download_file/MAG_1",
                 f"{output_folder}/MAG_1.fa.gz",
+                priority=scheduler.FILE,
             ),
             call(
                 f"https://spire.embl.de/download_file/MAG_2",
                 f"{output_folder}/MAG_2.fa.gz",
+                priority=scheduler.FILE,
             ),
         ]
-        mock_urlretrieve.assert_has_calls(expected_calls, any_order=True)
-        self.assertEqual(mock_urlretrieve.call_count, 2)
+        mock_retrieve.assert_has_calls(expected_calls, any_order=True)
+        self.assertEqual(mock_retrieve.call_count, 2)
 
-    @patch("spirepy.sample.urllib.request.urlretrieve")
+    @patch("spirepy.scheduler.retrieve")
     @patch("spirepy.sample.os.makedirs")
     @patch.object(Sample, "get_mags")
     def test_download_mags_no_mags(
         self,
         mock_get_mags: MagicMock,
         mock_makedirs: MagicMock,
-        mock_urlretrieve: MagicMock,
+        mock_retrieve: MagicMock,
     ):
         """Tests that no downloads are attempted if there are no MAGs."""
         output_folder = "/fake/dir"
@@ -206,7 +305,28 @@ class TestSample(unittest.TestCase):
         # The directory should still be created
         mock_makedirs.assert_called_once_with(output_folder, exist_ok=True)
         # No download calls should be made
-        mock_urlretrieve.assert_not_called()
+        mock_retrieve.assert_not_called()
+
+    @patch("spirepy.scheduler.retrieve")
+    @patch.object(Sample, "get_mags")
+    def test_download_mags_with_journal(
+        self, mock_get_mags: MagicMock, mock_retrieve: MagicMock
+    ):
+        """Tests that MAGs recorded as downloaded in the journal are skipped."""
+        mock_get_mags.return_value = pl.DataFrame({"spire_id": ["MAG_1", "MAG_2"]})
+
+        def retrieve(url, fpath, priority):
+            with open(fpath, "w") as f:
+                f.write(url)
+
+        mock_retrieve.side_effect = retrieve
+        with tempfile.TemporaryDirectory() as tmpdir:
+            journal = Journal(path.join(tmpdir, "jobs.sqlite"))
+            self.sample.download_mags(path.join(tmpdir, "mags"), journal)
+            self.sample.download_mags(path.join(tmpdir, "mags"), journal)
+
+            self.assertEqual(mock_retrieve.call_count, 2)
+            self.assertEqual(journal.status()["done"].to_list(), [2])
 
 
 if __name__ == "__main__":
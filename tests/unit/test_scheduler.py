@@ -0,0 +1,140 @@
+import io
+import os.path as path
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from spirepy import scheduler
+from spirepy.scheduler import Scheduler
+
+
+def _wait_for(predicate):
+    deadline = time.monotonic() + 5
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError
+        time.sleep(0.01)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler(max_per_host=1)
+        self.started = []
+
+    def _request(self, name: str, priority: int, host: str = "example.org"):
+        def run():
+            self.scheduler._acquire(host, priority)
+            self.started.append(name)
+            self.scheduler._release(host)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.addCleanup(thread.join)
+        return thread
+
+    def test_parse_rate(self):
+        self.assertEqual(scheduler.parse_rate("500k"), 500_000)
+        self.assertEqual(scheduler.parse_rate("1.5M"), 1_500_000)
+        self.assertEqual(scheduler.parse_rate("10"), 10)
+        with self.assertRaises(ValueError):
+            scheduler.parse_rate("fast")
+
+    def test_priority_and_host_limit(self):
+        self.scheduler._acquire("example.org", scheduler.FILE)
+        self._request("tarball", scheduler.BULK)
+        _wait_for(lambda: len(self.scheduler._waiting) == 1)
+        self._request("metadata", scheduler.METADATA)
+        _wait_for(lambda: len(self.scheduler._waiting) == 2)
+        # Other hosts are not held up
+        self._request("other", scheduler.BULK, host="other.org").join()
+        self.assertEqual(self.started, ["other"])
+
+        self.scheduler._release("example.org")
+        _wait_for(lambda: len(self.started) == 3)
+
+        self.assertEqual(self.started, ["other", "metadata", "tarball"])
+
+    def test_threads_take_turns(self):
+        primed, go = threading.Event(), threading.Event()
+
+        def mine():
+            # This thread was already granted connections, so the other goes first
+            for _ in range(2):
+                self.scheduler._acquire("example.org", scheduler.FILE)
+                self.scheduler._release("example.org")
+            primed.set()
+            go.wait()
+            self.scheduler._acquire("example.org", scheduler.FILE)
+            self.started.append("mine")
+            self.scheduler._release("example.org")
+
+        thread = threading.Thread(target=mine)
+        thread.start()
+        self.addCleanup(thread.join)
+        primed.wait()
+        self.scheduler._acquire("example.org", scheduler.FILE)
+        go.set()
+        _wait_for(lambda: len(self.scheduler._waiting) == 1)
+        self._request("theirs", scheduler.FILE)
+        _wait_for(lambda: len(self.scheduler._waiting) == 2)
+
+        self.scheduler._release("example.org")
+        _wait_for(lambda: len(self.started) == 2)
+
+        self.assertEqual(self.started, ["theirs", "mine"])
+
+    def test_parse_connections(self):
+        self.assertEqual(scheduler.parse_connections("8"), 8)
+        for spec in ("0", "-1", "many"):
+            with self.assertRaises(ValueError):
+                scheduler.parse_connections(spec)
+        with self.assertRaises(ValueError):
+            Scheduler(max_per_host=0)
+
+    @patch.dict("os.environ", {"SPIREPY_BANDWIDTH_LIMIT": "abc"})
+    def test_invalid_environment_is_ignored(self):
+        self.addCleanup(setattr, scheduler, "_default", None)
+        scheduler._default = None
+
+        with self.assertLogs("SPIREpy", level="ERROR") as logs:
+            default = scheduler.default_scheduler()
+
+        self.assertIsNone(default.bandwidth)
+        self.assertIn("SPIREPY_BANDWIDTH_LIMIT", logs.output[0])
+
+    @patch("spirepy.scheduler.time.sleep")
+    def test_bandwidth_limit(self, mock_sleep: MagicMock):
+        limited = Scheduler(bandwidth=10_000)
+
+        # The bucket starts full
+        limited._throttle(10_000)
+        mock_sleep.assert_not_called()
+        limited._throttle(5_000)
+
+        self.assertAlmostEqual(mock_sleep.call_args[0][0], 0.5, places=2)
+
+    @patch("spirepy.scheduler.urllib.request.urlopen")
+    def test_retrieve_with_progress(self, mock_urlopen: MagicMock):
+        content = bytes(range(256)) * 1000
+        response = mock_urlopen.return_value.__enter__.return_value
+        response.headers = {"Content-Length": str(len(content))}
+        response.read.side_effect = io.BytesIO(content).read
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        fpath = path.join(tmpdir.name, "file.tar")
+
+        with self.scheduler.progress() as display:
+            self.scheduler.retrieve("https://example.org/file.tar", fpath)
+            (total,) = display.tasks
+
+        with open(fpath, "rb") as f:
+            self.assertEqual(f.read(), content)
+        # The transfer's task was removed once done, and counted in the total
+        self.assertEqual(total.completed, len(content))
+        self.assertEqual(self.scheduler._active["example.org"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import gzip
+import os
+import os.path as path
+import random
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from spirepy import Study
+from spirepy.seqindex import SequenceIndex
+
+
+class TestSequenceIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        patcher = patch("spirepy.data.cache_dir", path.join(self.tmpdir.name, "cache"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.folder = path.join(self.tmpdir.name, "genecalls")
+        os.makedirs(path.join(self.folder, "sample_1"))
+        rng = random.Random(0)
+        # Long enough for records to span several BGZF blocks
+        self.sequences = {
+            f"gene_{i}": "".join(
+                rng.choice("ACGT") for _ in range(rng.randint(10, 5000))
+            )
+            for i in range(100)
+        }
+        ids = list(self.sequences)
+        with gzip.open(path.join(self.folder, "sample_1", "genes.fna.gz"), "wt") as f:
+            self._write(f, ids[:60])
+        with open(path.join(self.folder, "genes.fna"), "w") as f:
+            self._write(f, ids[60:])
+        with open(path.join(self.folder, "notes.txt"), "w") as f:
+            f.write(">not_a_sequence\n")
+
+    def _write(self, f, ids: list):
+        for id in ids:
+            seq = self.sequences[id]
+            f.write(f">{id} some description\n")
+            for i in range(0, len(seq), 60):
+                f.write(seq[i : i + 60] + "\n")
+
+    def test_get(self):
+        ids = ["gene_99", "gene_0", "gene_59", "gene_60", "gene_30"]
+
+        sequences = SequenceIndex(self.folder).get(ids)
+
+        self.assertEqual(sequences, {id: self.sequences[id] for id in ids})
+
+    def test_index_is_saved(self):
+        fname = path.join("sample_1", "genes.fna.gz")
+        with open(path.join(self.folder, fname), "rb") as f:
+            downloaded = f.read()
+        index = SequenceIndex(self.folder)
+        entries = index.entries()
+
+        self.assertEqual(entries.height, 100)
+        self.assertEqual(
+            sorted(entries["file"].unique().to_list()),
+            ["genes.fna", path.join("sample_1", "genes.fna.gz")],
+        )
+        self.assertFalse(SequenceIndex(self.folder)._is_stale())
+        # The downloaded files are left as they are, and their recompressed
+        # copies are still valid gzip
+        with open(path.join(self.folder, fname), "rb") as f:
+            self.assertEqual(f.read(), downloaded)
+        with gzip.open(index.bgzf_path(fname), "rb") as f:
+            self.assertEqual(f.read(), gzip.decompress(downloaded))
+
+    def test_only_changed_files_are_indexed(self):
+        SequenceIndex(self.folder).entries()
+        self.sequences["gene_100"] = "ACGT"
+        with open(path.join(self.folder, "genes.fna"), "a") as f:
+            self._write(f, ["gene_100"])
+
+        index = SequenceIndex(self.folder)
+        self.assertTrue(index._is_stale())
+        with patch.object(
+            SequenceIndex, "_index_gzip", side_effect=AssertionError
+        ) as mock_index_gzip:
+            sequences = index.get(["gene_100", "gene_0"])
+
+        mock_index_gzip.assert_not_called()
+        self.assertEqual(sequences["gene_100"], "ACGT")
+        self.assertEqual(sequences["gene_0"], self.sequences["gene_0"])
+        self.assertEqual(index.entries().height, 101)
+
+    def test_missing(self):
+        with self.assertRaises(KeyError):
+            SequenceIndex(self.folder).get(["gene_0", "gene_1000"])
+
+    def test_study_get_sequences(self):
+        sequences = Study("test_study").get_sequences(["gene_5"], self.tmpdir.name)
+
+        self.assertEqual(sequences, {"gene_5": self.sequences["gene_5"]})
+        with self.assertRaises(ValueError):
+            Study("test_study").get_sequences(["gene_5"], self.tmpdir.name, "mags")
+
+
+if __name__ == "__main__":
+    unittest.main()
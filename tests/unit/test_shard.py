@@ -0,0 +1,124 @@
+import os
+import os.path as path
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import polars as pl
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from spirepy import Sample, Study
+from spirepy.cli.download import download_shard
+from spirepy.shard import merge, parse_shard, partition, shard_name, write_manifest
+
+
+class TestPartition(unittest.TestCase):
+    def setUp(self):
+        self.keys = [f"sample_{i}" for i in range(100)]
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("3/10"), (3, 10))
+        for spec in ["10/10", "a/3", "3"]:
+            with self.assertRaises(ValueError):
+                parse_shard(spec)
+
+    def test_partition_is_complete_and_deterministic(self):
+        shards = partition(self.keys, 4)
+
+        self.assertEqual(sorted(sum(shards, [])), sorted(self.keys))
+        self.assertEqual(shards, partition(list(self.keys), 4))
+        # Keys keep their shard when other keys are added
+        more = partition(self.keys + ["sample_new"], 4)
+        for shard, more_shard in zip(shards, more):
+            self.assertTrue(set(shard) <= set(more_shard))
+
+    def test_weighted_partition_is_balanced(self):
+        weights = [1000 if i < 4 else 1 for i in range(len(self.keys))]
+
+        shards = partition(self.keys, 4, weights)
+
+        totals = [sum(weights[self.keys.index(k)] for k in shard) for shard in shards]
+        self.assertEqual(sorted(sum(shards, [])), sorted(self.keys))
+        self.assertLessEqual(max(totals) - min(totals), 1)
+        self.assertEqual(shards, partition(self.keys, 4, weights))
+
+    @patch.object(Study, "get_mags")
+    @patch.object(Study, "get_metadata")
+    def test_study_shard_samples(
+        self, mock_get_metadata: MagicMock, mock_get_mags: MagicMock
+    ):
+        mock_get_metadata.return_value = pl.DataFrame({"sample_id": self.keys})
+        mock_get_mags.return_value = pl.DataFrame(
+            {"derived_from_sample": ["sample_0"] * 50}
+        )
+        study = Study("STUDY")
+
+        shards = [study.shard_samples(i, 3) for i in range(3)]
+
+        self.assertEqual(
+            sorted(s.id for shard in shards for s in shard), sorted(self.keys)
+        )
+        self.assertIn("sample_0", [s.id for s in shards[0]])
+        self.assertEqual(len(shards[0]), 1)
+
+
+class TestMerge(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.output = self.tmpdir.name
+
+    def _write_shard(self, index: int, frame: pl.DataFrame):
+        fpath = path.join(self.output, "amr", f"{shard_name(index, 2)}.parquet")
+        os.makedirs(path.dirname(fpath), exist_ok=True)
+        frame.write_parquet(fpath)
+        write_manifest(self.output, index, 2, [("amr", fpath, path.getsize(fpath))])
+
+    def test_merge(self):
+        self._write_shard(0, pl.DataFrame({"gene": ["a", "b"], "sample_id": "s1"}))
+        self._write_shard(1, pl.DataFrame({"gene": ["c"], "sample_id": "s2"}))
+
+        merge(self.output)
+
+        metadata = pq.read_metadata(path.join(self.output, "amr", "_metadata"))
+        self.assertEqual(metadata.num_rows, 3)
+        self.assertEqual(metadata.num_row_groups, 2)
+        manifest = pl.read_csv(path.join(self.output, "manifest.tsv"), separator="\t")
+        self.assertEqual(manifest.height, 2)
+
+    @patch.object(Sample, "get_eggnog_data")
+    @patch.object(Study, "shard_samples")
+    def test_download_and_merge_shards(
+        self, mock_shard_samples: MagicMock, mock_get_eggnog_data: MagicMock
+    ):
+        study = Study("STUDY")
+        shards = [["s1", "s2"], ["s3", "s4"]]
+        mock_shard_samples.side_effect = lambda index, count: [
+            Sample(s, study) for s in shards[index]
+        ]
+        mock_get_eggnog_data.return_value = pl.DataFrame({"gene": ["a", "b"]})
+
+        with patch("spirepy.data.cache_dir", self.output):
+            for index in range(2):
+                download_shard(study, "eggnog", self.output, (index, 2))
+        merge(self.output)
+
+        folder = path.join(self.output, "eggnog")
+        self.assertEqual(pq.ParquetDataset(folder).read().num_rows, 8)
+        dataset = ds.parquet_dataset(path.join(folder, "_metadata"))
+        self.assertEqual(dataset.to_table().num_rows, 8)
+        frame = pl.scan_parquet(path.join(folder, "shard-*.parquet")).collect()
+        self.assertEqual(sorted(frame["sample_id"].unique()), ["s1", "s2", "s3", "s4"])
+
+    @patch("spirepy.shard.logger.warning")
+    def test_merge_missing_shard(self, mock_warning: MagicMock):
+        self._write_shard(1, pl.DataFrame({"gene": ["c"], "sample_id": "s2"}))
+
+        merge(self.output)
+
+        self.assertIn("missing shards 0 of 2", mock_warning.call_args[0][0])
+
+
+if __name__ == "__main__":
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
@@ -0,0 +1,106 @@
+import gzip
+import io
+import os.path as path
+import random
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+
+from spirepy import Sample, sketch
+from spirepy.genome import Genome
+from spirepy.sketch import SketchIndex
+
+
+def _mutate(sequence: str, rate: float, rng: random.Random) -> str:
+    return "".join(rng.choice("ACGT") if rng.random() < rate else b for b in sequence)
+
+
+def _fasta(sequence: str) -> io.BytesIO:
+    return io.BytesIO(
+        f">contig_1\n{sequence[:3000]}\n>contig_2\n{sequence[3000:]}\n".encode()
+    )
+
+
+@patch("spirepy.sketch.SCALED", 4)
+class TestSketch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        rng = random.Random(0)
+        self.reference = "".join(rng.choice("ACGT") for _ in range(5000))
+        self.sequences = {
+            "close": _mutate(self.reference, 0.01, rng),
+            "far": _mutate(self.reference, 0.2, rng),
+            "unrelated": "".join(rng.choice("ACGT") for _ in range(5000)),
+        }
+        self.index = SketchIndex(path.join(self.tmpdir.name, "sketches"))
+
+    def test_sketch_is_canonical(self):
+        complement = str.maketrans("ACGT", "TGCA")
+        reverse = self.reference.translate(complement)[::-1]
+
+        forward = sketch.sketch(io.BytesIO(f">f\n{self.reference}\n".encode()))
+        self.assertGreater(len(forward), 0)
+        self.assertLess(len(forward), len(self.reference))
+        np.testing.assert_array_equal(
+            forward, sketch.sketch(io.BytesIO(f">r\n{reverse}\n".encode()))
+        )
+
+    def test_sketch_gzip_and_chunks(self):
+        fpath = path.join(self.tmpdir.name, "genome.fa.gz")
+        with gzip.open(fpath, "wt") as f:
+            f.write(f">contig_1\n{self.reference}\n")
+
+        with patch("spirepy.sketch.CHUNK_SIZE", 100):
+            chunked = sketch.sketch(fpath)
+
+        np.testing.assert_array_equal(
+            chunked, sketch.sketch(io.BytesIO(f">c\n{self.reference}\n".encode()))
+        )
+
+    def test_query(self):
+        self.index.add(
+            {name: sketch.sketch(_fasta(seq)) for name, seq in self.sequences.items()}
+        )
+        self.index.add({"reference": sketch.sketch(_fasta(self.reference))})
+
+        result = self.index.query(self.index.get("reference"), k=3, exclude="reference")
+
+        # Genomes sharing no hashes are left out
+        self.assertEqual(result["genome"].to_list(), ["close", "far"])
+        self.assertGreater(result["ani"][0], 0.97)
+        self.assertIsNone(self.index.get("missing"))
+        # Excluding a genome that is not in the index leaves out no other one
+        result = self.index.query(self.index.get("reference"), k=2, exclude="a")
+        self.assertEqual(result["genome"].to_list(), ["reference", "close"])
+
+    def test_add_replaces_genome(self):
+        self.index.add({"genome": sketch.sketch(_fasta(self.reference))})
+        self.index.query(self.index.get("genome"))
+        replacement = sketch.sketch(_fasta(self.sequences["unrelated"]))
+
+        self.index.add({"genome": replacement})
+
+        np.testing.assert_array_equal(self.index.get("genome"), replacement)
+        self.assertEqual(self.index.genomes()["genome"].to_list(), ["genome"])
+
+    def test_genome_similar(self):
+        self.index.add(
+            {name: sketch.sketch(_fasta(seq)) for name, seq in self.sequences.items()}
+        )
+        study = MagicMock()
+        study.open_mag.return_value = _fasta(self.reference)
+        genome = Genome("reference", Sample("sample_1", study))
+
+        result = genome.similar(k=1, index=self.index)
+
+        study.open_mag.assert_called_once_with("reference")
+        self.assertEqual(result["genome"].to_list(), ["close"])
+        # The genome was added to the index
+        self.assertIsNotNone(self.index.get("reference"))
+
+
+if __name__ == "__main__":
+    unittest.main()
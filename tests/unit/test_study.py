@@ -1,9 +1,26 @@
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 import polars as pl
 from polars.testing import assert_frame_equal
 
-from spirepy import Study, Sample
+from spirepy import Study, Sample, data, scheduler
+
+
+def _count_contigs(sample):
+    if sample.id == "sample_bad":
+        raise ValueError("bad sample")
+    return sample.get_contig_depths().height
+
+
+def _study_rows(sample):
+    if sample.id == "sample_bad":
+        raise ValueError("bad sample")
+    return sample.study._metadata.height
+
+
+def _unpicklable(sample):
+    return lambda: sample.id
 
 
 class TestStudy(unittest.TestCase):
@@ -19,24 +36,35 @@ class TestStudy(unittest.TestCase):
         self.assertIsNone(self.study._samples)
         self.assertIsNone(self.study._mags)
 
-    @patch("spirepy.study.pl.read_csv")
-    def test_get_metadata(self, mock_read_csv: MagicMock):
+    @patch("spirepy.transfer.read_tsv")
+    def test_get_metadata(self, mock_read_tsv: MagicMock):
         """Tests metadata retrieval and caching."""
+        # The samples are added to the sample index in a temporary cache
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        patcher = patch("spirepy.data.cache_dir", tmpdir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, data, "_sample_index", None)
+        data._sample_index = None
         mock_data = pl.DataFrame(
             {"study_id": [self.study_name], "sample_id": ["sample1"]}
         )
-        mock_read_csv.return_value = mock_data
+        mock_read_tsv.return_value = mock_data
 
         # First call should fetch data
         result1 = self.study.get_metadata()
-        expected_url = f"https://spire.embl.de/spire/api/study/{self.study_name}?format=tsv"
-        mock_read_csv.assert_called_once_with(expected_url, separator="\t")
+        expected_url = (
+            f"https://spire.embl.de/spire/api/study/{self.study_name}?format=tsv"
+        )
+        mock_read_tsv.assert_called_once_with(expected_url)
         assert_frame_equal(result1, mock_data)
 
         # Second call should use the cache
         result2 = self.study.get_metadata()
-        mock_read_csv.assert_called_once()  # Should not be called again
+        mock_read_tsv.assert_called_once()  # Should not be called again
         assert_frame_equal(result2, mock_data)
+        self.assertEqual(data.lookup_study("sample1"), self.study_name)
 
     @patch.object(Study, "get_metadata")
     def test_get_samples(self, mock_get_metadata: MagicMock):
@@ -58,6 +86,97 @@ class TestStudy(unittest.TestCase):
         mock_get_metadata.assert_called_once()  # Should not be called again
         self.assertIs(samples1, samples2)  # Should be the exact same list object
 
+        # Sample metadata should be sliced from the study metadata
+        assert_frame_equal(samples1[1].get_metadata(), mock_metadata.slice(1, 1))
+
+    @patch("spirepy.sample.Sample.get_contig_depths", autospec=True)
+    @patch.object(Study, "get_metadata")
+    def test_iter_samples(
+        self, mock_get_metadata: MagicMock, mock_get_contig_depths: MagicMock
+    ):
+        """Tests that samples are prefetched in order and their data dropped."""
+        mock_get_metadata.return_value = pl.DataFrame(
+            {"sample_id": [f"sample_{i}" for i in range(5)]}
+        )
+
+        def get_contig_depths(sample):
+            sample._contig_depths = pl.DataFrame({"contig": [sample.id]})
+            return sample._contig_depths
+
+        mock_get_contig_depths.side_effect = get_contig_depths
+
+        seen = []
+        for sample in self.study.iter_samples(["get_contig_depths"], prefetch=2):
+            self.assertEqual(sample._contig_depths["contig"][0], sample.id)
+            seen.append(sample)
+
+        self.assertEqual([s.id for s in seen], [f"sample_{i}" for i in range(5)])
+        self.assertEqual(mock_get_contig_depths.call_count, 5)
+        self.assertTrue(all(s._contig_depths is None for s in seen))
+
+    @patch("spirepy.sample.Sample.get_contig_depths", side_effect=OSError("down"))
+    @patch.object(Study, "get_metadata")
+    def test_iter_samples_error(
+        self, mock_get_metadata: MagicMock, mock_get_contig_depths: MagicMock
+    ):
+        """Tests that download errors are raised in the consumer."""
+        mock_get_metadata.return_value = pl.DataFrame({"sample_id": ["sample_A"]})
+
+        with self.assertRaises(OSError):
+            list(self.study.iter_samples(["get_contig_depths"]))
+
+    @patch("spirepy.sample.Sample.get_contig_depths", autospec=True)
+    @patch.object(Study, "get_metadata")
+    def test_map_samples(
+        self, mock_get_metadata: MagicMock, mock_get_contig_depths: MagicMock
+    ):
+        """Tests that results are returned in order, with per-sample errors."""
+        sample_ids = ["sample_A", "sample_bad", "sample_C", "sample_D"]
+        mock_get_metadata.return_value = pl.DataFrame({"sample_id": sample_ids})
+        mock_get_contig_depths.side_effect = lambda sample: pl.DataFrame(
+            {"contig": [sample.id] * len(sample.id)}
+        )
+
+        results = list(
+            self.study.map_samples(_count_contigs, executor="thread", chunksize=3)
+        )
+
+        self.assertEqual([r[0] for r in results], sample_ids)
+        self.assertEqual([r[1] for r in results], [8, None, 8, 8])
+        self.assertIsNone(results[0][2])
+        self.assertIsInstance(results[1][2], ValueError)
+
+    @patch.object(Study, "get_metadata")
+    def test_map_samples_process(self, mock_get_metadata: MagicMock):
+        """Tests that workers get the metadata of their chunk with the samples."""
+        sample_ids = ["sample_A", "sample_bad", "sample_C"]
+        mock_get_metadata.return_value = pl.DataFrame({"sample_id": sample_ids})
+        study = Study(self.study_name)
+
+        results = list(study.map_samples(_study_rows, max_workers=2, chunksize=2))
+
+        self.assertEqual([r[0] for r in results], sample_ids)
+        # Workers only hold the rows of their chunk rather than fetching them
+        self.assertEqual([r[1] for r in results], [2, None, 1])
+        self.assertIsInstance(results[1][2], ValueError)
+        self.assertIsNone(results[2][2])
+
+    @patch.object(Study, "get_metadata")
+    def test_map_samples_chunk_error(self, mock_get_metadata: MagicMock):
+        """Tests that an error of a whole chunk is returned for its samples."""
+        sample_ids = ["sample_A", "sample_B", "sample_C"]
+        mock_get_metadata.return_value = pl.DataFrame({"sample_id": sample_ids})
+
+        results = list(self.study.map_samples(_unpicklable, max_workers=1, chunksize=2))
+
+        self.assertEqual([r[0] for r in results], sample_ids)
+        self.assertTrue(all(r[1] is None and r[2] is not None for r in results))
+
+    @patch.object(Study, "get_metadata")
+    def test_map_samples_invalid_executor(self, mock_get_metadata: MagicMock):
+        with self.assertRaises(ValueError):
+            list(self.study.map_samples(_count_contigs, executor="gpu"))
+
     @patch("spirepy.study.genome_metadata")
     @patch.object(Study, "get_metadata")
     def test_get_mags(
@@ -97,14 +216,45 @@ class TestStudy(unittest.TestCase):
         mock_genome_metadata.assert_called_once()
         assert_frame_equal(result2, expected_mags)
 
+    @patch("spirepy.study.scan_genome_metadata")
+    @patch.object(Study, "get_metadata")
+    def test_get_mags_projection(
+        self, mock_get_metadata: MagicMock, mock_scan: MagicMock
+    ):
+        """Tests that projected MAGs are cached for later projections."""
+        mock_get_metadata.return_value = pl.DataFrame({"sample_id": ["sample_1"]})
+        mock_scan.return_value = pl.LazyFrame(
+            {
+                "spire_id": ["MAG_A", "MAG_B", "MAG_C"],
+                "derived_from_sample": ["sample_1", "sample_1", "sample_2"],
+                "completeness": [95.0, 60.0, 99.0],
+            }
+        )
+
+        result = self.study.get_mags(columns=["spire_id"], filter="completeness > 90")
+        self.assertEqual(result["spire_id"].to_list(), ["MAG_A"])
+        result = self.study.get_mags(
+            columns=["spire_id"], filter=pl.col("completeness") < 90
+        )
+        self.assertEqual(result["spire_id"].to_list(), ["MAG_B"])
+        mock_scan.assert_called_once()
+
+        # Columns not cached yet are read along with the cached ones
+        result = self.study.get_mags(columns=["derived_from_sample"])
+        self.assertEqual(mock_scan.call_count, 2)
+        self.assertEqual(
+            self.study._mags.columns,
+            ["spire_id", "completeness", "derived_from_sample"],
+        )
+
     @patch("spirepy.study.tarfile.open")
     @patch("spirepy.study.os.makedirs")
-    @patch("spirepy.study.urllib.request.urlretrieve")
+    @patch("spirepy.scheduler.retrieve")
     @patch("spirepy.study.tempfile.TemporaryDirectory")
     def test_download_mags(
         self,
         mock_tempdir: MagicMock,
-        mock_urlretrieve: MagicMock,
+        mock_retrieve: MagicMock,
         mock_makedirs: MagicMock,
         mock_tar_open: MagicMock,
     ):
@@ -125,7 +275,9 @@ class TestStudy(unittest.TestCase):
         # 1. Check that the download was called correctly
         expected_url = f"https://swifter.embl.de/~fullam/spire/compiled/{self.study_name}_spire_v1_MAGs.tar"
         expected_tar_path = f"{fake_temp_dir}/{self.study_name}_mags.tar"
-        mock_urlretrieve.assert_called_once_with(expected_url, expected_tar_path)
+        mock_retrieve.assert_called_once_with(
+            expected_url, expected_tar_path, priority=scheduler.BULK
+        )
 
         # 2. Check that the output directory was created
         mock_makedirs.assert_called_once_with(output_dir, exist_ok=True)
@@ -0,0 +1,125 @@
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import polars as pl
+
+from spirepy import Study, data, summary
+
+
+class TestSummary(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.genomes = pl.DataFrame(
+            {
+                "spire_id": ["m1", "m2", "m3", "m4"],
+                "derived_from_sample": ["s1", "s1", "s2", "s3"],
+                "spire_cluster": ["c1", "c2", "c1", "c3"],
+                "completeness": [95.0, 60.0, 40.0, 99.0],
+                "contamination": [1.0, 5.0, 2.0, 0.5],
+            }
+        )
+        self.clusters = pl.DataFrame(
+            {
+                "spire_cluster": ["c1", "c2", "c3"],
+                "classification": [
+                    "d__Bacteria;p__Bacillota;c__Bacilli",
+                    "d__Bacteria;p__Bacteroidota;c__Bacteroidia",
+                    "d__Bacteria;p__Bacillota;c__Clostridia",
+                ],
+            }
+        )
+        self.genome_metadata = MagicMock()
+        self.genome_metadata.fetched.return_value = 1.0
+        for patcher in [
+            patch("spirepy.data.cache_dir", self.tmpdir.name),
+            patch("spirepy.data.genome_metadata", self.genome_metadata),
+            patch(
+                "spirepy.data.scan_genome_metadata",
+                side_effect=lambda release: self.genomes.lazy(),
+            ),
+            patch(
+                "spirepy.data.scan_cluster_metadata",
+                side_effect=lambda release: self.clusters.lazy(),
+            ),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        data._sample_index = None
+        self.addCleanup(setattr, data, "_sample_index", None)
+        data.index_samples("study_1", ["s1", "s2", "s4"])
+        data.index_samples("study_2", ["s3"])
+
+    def test_compute_summaries(self):
+        result = summary.compute_summaries()
+
+        self.assertEqual(result["study"].to_list(), ["study_1", "study_2"])
+        self.assertEqual(result["samples"].to_list(), [3, 1])
+        self.assertEqual(result["samples_with_mags"].to_list(), [2, 1])
+        self.assertEqual(result["mags"].to_list(), [3, 1])
+        self.assertEqual(result["clusters"].to_list(), [2, 1])
+        self.assertEqual(result["high_quality"].to_list(), [1, 1])
+        self.assertEqual(result["medium_quality"].to_list(), [1, 0])
+        self.assertEqual(result["completeness_median"].to_list(), [60.0, 99.0])
+        self.assertEqual(
+            result["phyla"][0].to_list(),
+            [
+                {"phylum": "p__Bacillota", "mags": 2},
+                {"phylum": "p__Bacteroidota", "mags": 1},
+            ],
+        )
+
+    def test_study_summaries_incremental(self):
+        first = summary.study_summaries()
+
+        # A new study is indexed: only it is computed
+        data.index_samples("study_3", ["s5"])
+        with patch(
+            "spirepy.summary.compute_summaries", wraps=summary.compute_summaries
+        ) as mock_compute:
+            second = summary.study_summaries()
+            mock_compute.assert_called_once_with(["study_3"], data.RELEASE)
+            # Nothing changed since
+            summary.study_summaries()
+            mock_compute.assert_called_once()
+
+            self.assertEqual(
+                second["study"].to_list(), ["study_1", "study_2", "study_3"]
+            )
+            self.assertTrue(second.head(2).equals(first))
+            self.assertEqual(second["mags"][2], 0)
+
+            # The genome metadata was downloaded again: all studies are computed
+            self.genome_metadata.fetched.return_value = 2.0
+            summary.study_summaries()
+            mock_compute.assert_called_with(release=data.RELEASE)
+
+    def test_study_summaries_replaced_samples(self):
+        summary.study_summaries()
+
+        # s2 moves to study_2 and s3 to study_1, so both keep their counts
+        data.index_samples("study_2", ["s2"])
+        data.index_samples("study_1", ["s3"])
+        with patch(
+            "spirepy.summary.compute_summaries", wraps=summary.compute_summaries
+        ) as mock_compute:
+            result = summary.study_summaries()
+            mock_compute.assert_called_once_with(["study_1", "study_2"], data.RELEASE)
+
+        self.assertEqual(result["samples"].to_list(), [3, 1])
+        self.assertEqual(result["mags"].to_list(), [3, 1])
+        self.assertEqual(result["completeness_median"].to_list(), [95.0, 40.0])
+        self.assertNotIn("samples_hash", result.columns)
+
+    @patch.object(Study, "get_metadata")
+    def test_study_summary(self, mock_get_metadata):
+        result = Study("study_2").summary()
+
+        mock_get_metadata.assert_called_once()
+        self.assertEqual(result.height, 1)
+        self.assertEqual(result["mags"].to_list(), [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
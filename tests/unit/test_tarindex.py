@@ -0,0 +1,118 @@
+import io
+import os.path as path
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from spirepy import Study
+from spirepy.tarindex import TarIndex
+
+
+class TestTarIndex(unittest.TestCase):
+    def setUp(self):
+        """Write a small archive and serve it through fake range requests."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.tarball = path.join(self.tmpdir.name, "STUDY_spire_v1_MAGs.tar")
+        self.files = {
+            "STUDY/spire_mag_001.fa.gz": b"first",
+            # Long names need extra headers
+            "STUDY/" + "x" * 150 + "/spire_mag_002.fa.gz": b"second" * 1000,
+            "STUDY/spire_mag_003.fa.gz": b"third",
+        }
+        with tarfile.open(self.tarball, "w") as tar:
+            for name, content in self.files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        with open(self.tarball, "rb") as f:
+            self.archive = f.read()
+
+        self.requests = []
+
+        def read_range(url, start, end):
+            self.requests.append((start, end))
+            return self.archive[start:end]
+
+        patchers = [
+            patch("spirepy.tarindex._read_range", side_effect=read_range),
+            patch("spirepy.data.cache_dir", self.tmpdir.name),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.url = "https://example.org/STUDY_spire_v1_MAGs.tar"
+
+    def test_members(self):
+        members = TarIndex(self.url).members()
+
+        self.assertEqual(members["name"].to_list(), list(self.files))
+        self.assertEqual(
+            members["key"].to_list(),
+            ["spire_mag_001", "spire_mag_002", "spire_mag_003"],
+        )
+        for name, offset, size in members.select("name", "offset", "size").rows():
+            self.assertEqual(self.archive[offset : offset + size], self.files[name])
+
+    @patch("spirepy.tarindex.BLOCK_SIZE", 4096)
+    def test_headers_are_read_ahead(self):
+        with tarfile.open(self.tarball, "w") as tar:
+            for i in range(40):
+                info = tarfile.TarInfo(f"STUDY/spire_mag_{i:03}.fa.gz")
+                info.size = 100
+                tar.addfile(info, io.BytesIO(b"x" * 100))
+        with open(self.tarball, "rb") as f:
+            self.archive = f.read()
+
+        members = TarIndex(self.url).members()
+
+        self.assertEqual(members.height, 40)
+        # Each request covers the headers of several members
+        self.assertLessEqual(len(self.requests), len(self.archive) // 4096 + 1)
+        self.assertFalse(path.exists(TarIndex(self.url)._path() + ".lock"))
+
+    def test_index_is_cached(self):
+        TarIndex(self.url).members()
+        self.requests.clear()
+
+        TarIndex(self.url).members()
+
+        self.assertEqual(self.requests, [])
+
+    def test_read_coalesces_requests(self):
+        index = TarIndex(self.url)
+        index.members()
+        self.requests.clear()
+
+        contents = index.read(["spire_mag_003", "STUDY/spire_mag_001.fa.gz"])
+
+        self.assertEqual(
+            contents,
+            {"spire_mag_003": b"third", "STUDY/spire_mag_001.fa.gz": b"first"},
+        )
+        self.assertEqual(len(self.requests), 1)
+
+    def test_read_from_tarball(self):
+        index = TarIndex(self.url)
+        index.members()
+        self.requests.clear()
+
+        contents = index.read(["spire_mag_002"], tarball=self.tarball)
+
+        self.assertEqual(contents, {"spire_mag_002": b"second" * 1000})
+        self.assertEqual(self.requests, [])
+
+    def test_missing_member(self):
+        with self.assertRaises(KeyError):
+            TarIndex(self.url).read(["spire_mag_999"])
+
+    @patch.object(Study, "_mags_url")
+    def test_study_open_mag(self, mock_mags_url):
+        mock_mags_url.return_value = self.url
+
+        self.assertEqual(Study("STUDY").open_mag("spire_mag_001").read(), b"first")
+
+
+if __name__ == "__main__":
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
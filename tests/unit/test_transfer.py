@@ -0,0 +1,68 @@
+import gzip
+import io
+import unittest
+from unittest.mock import patch, MagicMock
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from spirepy import transfer
+
+
+def _response(body: bytes, encoding: str = None) -> MagicMock:
+    response = MagicMock()
+    response.status = 200
+    response.headers = {} if encoding is None else {"Content-Encoding": encoding}
+    response.read.side_effect = io.BytesIO(body).read
+    return response
+
+
+@patch("spirepy.transfer.READ_SIZE", 7)
+@patch("spirepy.transfer.BATCH_SIZE", 16)
+class TestReadTsv(unittest.TestCase):
+    def setUp(self):
+        rows = [f"contig_{i}\t{i * 1.5 if i > 8 else i}\t{i * 100}" for i in range(12)]
+        self.text = "\n".join(["contig\tdepth\tlength"] + rows) + "\n"
+        self.expected = pl.read_csv(self.text.encode(), separator="\t")
+        patcher = patch("spirepy.transfer.urllib.request.urlopen")
+        self.mock_urlopen = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _serve(self, body: bytes, encoding: str = None):
+        response = _response(body, encoding)
+        self.mock_urlopen.return_value.__enter__.return_value = response
+
+    def test_gzip(self):
+        self._serve(gzip.compress(self.text.encode()), "gzip")
+
+        result = transfer.read_tsv("https://example.org/depths")
+
+        request = self.mock_urlopen.call_args[0][0]
+        self.assertIn("gzip", request.get_header("Accept-encoding"))
+        # Types inferred per batch are widened to those of the whole file
+        assert_frame_equal(result, self.expected)
+
+    def test_identity_with_columns(self):
+        self._serve(self.text.encode())
+
+        result = transfer.read_tsv("https://example.org/depths", columns=["depth"])
+
+        assert_frame_equal(result, self.expected.select("depth"))
+
+    def test_header_only(self):
+        self._serve(b"contig\tdepth\n")
+
+        result = transfer.read_tsv("https://example.org/depths")
+
+        self.assertEqual(result.columns, ["contig", "depth"])
+        self.assertTrue(result.is_empty())
+
+    def test_unsupported_encoding(self):
+        self._serve(b"\x00", "br")
+
+        with self.assertRaises(OSError):
+            transfer.read_tsv("https://example.org/depths")
+
+
+if __name__ == "__main__":
+    unittest.main()